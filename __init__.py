@@ -1,16 +1,22 @@
 """Base module for the quant_local Python package. Contains common models and
    utilities, like the Sector class and dollar string conversions. Specific
    strategies are under the "strategies" subpackage.
+
+   Spreadsheet backends (xlrd and openpyxl) are imported on first use rather
+   than at package import, so that modules needing only lightweight utilities
+   (like "keys") do not pay for them. Parsing and lookup functions are
+   instrumented (see the "profiling" module) when profiling is enabled.
 """
 
 import os
 import re
 import math
-import openpyxl
-import xlrd
+import collections.abc
+from quant_local import profiling
 
 PACK_PATH, _ = os.path.split(os.path.abspath(__file__))
 DATASTORE_PATH = PACK_PATH + "/datastore"
+DISTINCT_VALUE_BYTES = 40 # approximate cost of storing one distinct value in a DictionaryColumn
 
 def convertDollarString(ds):
     """Convert to numerical dollar amount. This can be a dollar string without
@@ -40,10 +46,10 @@ def convertDollarString(ds):
 
 def getDatePaths():
     """Returns list of absolute paths to date folders (8-digit names) in the
-       datastore
+       datastore, in chronological order (most recent last)
     """
     candidates = []
-    for folderName in os.listdir(DATASTORE_PATH):
+    for folderName in sorted(os.listdir(DATASTORE_PATH)):
         if re.match("^\d{8}$", folderName):
             candidates.append(os.path.abspath(DATASTORE_PATH + "/%s" % folderName))
     return candidates
@@ -54,24 +60,33 @@ def getSectorsTable():
     datePaths = getDatePaths()
     return readXlsxDicts(datePaths[-1] + "/sectors.xlsx")
     
-def getSectorPaths(datePath):
+def getSectorCodes():
+    """Returns the list of sector codes in the Sectors table
+    """
+    return [sector["Code"] for sector in getSectorsTable()]
+
+def getSectorPaths(datePath, codes=None):
     """Returns absolute paths to all available sector spreadsheets acquired on
-       the given date
+       the given date. The Sectors table is read for the list of sector codes
+       unless one is given (callers scanning many dates should read it once;
+       see *getSectorCodes()*).
     """
     candidates = []
-    sectors = getSectorsTable()
-    pattern = "^(%s)\.xls$" % "|".join([sector["Code"] for sector in sectors])
+    codes = getSectorCodes() if codes is None else codes
+    pattern = "^(%s)\.xls$" % "|".join(codes)
     for fileName in os.listdir(datePath):
         if re.match(pattern, fileName):
             candidates.append(os.path.abspath(datePath + "/%s" % fileName))
     return candidates
 
-def getSectors():
+@profiling.timed("getSectors")
+def getSectors(datePath=None):
     """Returns a list of Sector objects as parsed from the most recent
-       datastore snapshot.
+       datastore snapshot (or from the snapshot at the given date path).
     """
-    datePaths = getDatePaths()
-    sectorPaths = getSectorPaths(datePaths[-1])
+    if datePath is None:
+        datePath = getDatePaths()[-1]
+    sectorPaths = getSectorPaths(datePath)
     return [Sector(sectorPath) for sectorPath in sectorPaths]
 
 def getSectorByCode(sectors, code):
@@ -83,12 +98,16 @@ def getSectorByCode(sectors, code):
             return sector
     raise Exception("Could not find sector matching code %s" % code)
 
-def getPositions(sectors):
+@profiling.timed("getPositions")
+def getPositions(sectors, datePath=None):
     """In addition to position information stored in positions.xlsx, augments
-       with specific security information gleaned from that sector.
+       with specific security information gleaned from that sector. Positions
+       are returned as (mutable) dictionaries, since callers annotate them.
+       Defaults to the most recent snapshot, unless a date path is given.
     """
-    datePaths = getDatePaths()
-    positions = readXlsxDicts(datePaths[-1] + "/positions.xlsx")
+    if datePath is None:
+        datePath = getDatePaths()[-1]
+    positions = [dict(record) for record in readXlsxTable(datePath + "/positions.xlsx")]
     codes = [sector.getCode() for sector in sectors]
     for position in positions:
         sector_ndx = codes.index(position["sector"])
@@ -97,11 +116,195 @@ def getPositions(sectors):
         position.update(security)
     return positions
 
-def readXlsDicts(xlsPath, sheetName=None):
-    """Reads an .XLS file and returns a list of dictionaries corresponding to
-       the continuous table in the given sheet (defaults to the first sheet if
-       no name is specified).
+def isBlankRow(rv):
+    """Returns True if the given row of cell values is empty, which marks the
+       end of a continuous table. (Empty .XLS cells are read as "", and empty
+       .XLSX cells as None.)
+    """
+    return len("".join(["" if v is None else str(v) for v in rv]).strip()) == 0
+
+def getCodeTypecode(nCodes):
+    """Returns the smallest unsigned *array.array* typecode that can hold the
+       given number of distinct codes
+    """
+    return "B" if nCodes <= 0x100 else "H" if nCodes <= 0x10000 else "I"
+
+def packColumn(values):
+    """Packs a list of cell values into the most compact column container.
+       Columns that are entirely float (or entirely int) are stored in typed
+       *array.array* buffers, and columns that are mostly float (e.g., with a
+       few blank or "--" cells) are stored as a NumericColumn. Columns with
+       repeated values (ratings, sectors, industries, etc.) are dictionary-
+       encoded as a DictionaryColumn, whenever that is smaller than the
+       float alternatives. Columns of (mostly unique) strings, like symbols
+       and company names, are stored as a StringColumn. Any other column is
+       left as a list. Values read back out are of the same type as those
+       passed in.
+    """
+    import array
+    nFloats = len([v for v in values if type(v) is float])
+    if 0 < len(values) and all([type(v) is int for v in values]):
+        try:
+            return array.array("q", values)
+        except OverflowError:
+            pass
+    nDistinct = len(set([(type(v), v) for v in values]))
+    dictionaryBytes = len(values) * array.array(getCodeTypecode(nDistinct)).itemsize + nDistinct * DISTINCT_VALUE_BYTES
+    if 0 < len(values) and nFloats == len(values) and len(values) * 8 <= dictionaryBytes:
+        return array.array("d", values)
+    if 0 < nFloats and len(values) < 2 * nFloats and len(values) * 9 <= dictionaryBytes:
+        return NumericColumn(values)
+    if nDistinct <= len(values) // 2 or nFloats == len(values) or len(values) < 2 * nFloats:
+        return DictionaryColumn(values)
+    if 0 < len(values) and all([type(v) is str for v in values]):
+        return StringColumn(values)
+    return list(values)
+
+class NumericColumn(object):
+    """Column container for mostly-numeric values. Float values are stored in
+       a typed *array.array* buffer (with NaN placeholders). The remaining
+       non-float values are stored once each, and referenced by a per-row
+       array of codes (0 for rows holding a float).
+    """
+
+    __slots__ = ("data", "codes", "values")
+
+    def __init__(self, values):
+        """Packs the given list of cell values
+        """
+        import array
+        self.data = array.array("d", [v if type(v) is float else math.nan for v in values])
+        lookup = {}
+        codes = []
+        for v in values:
+            if type(v) is float:
+                codes.append(0)
+            else:
+                key = (type(v), v)
+                if key not in lookup:
+                    lookup[key] = len(lookup) + 1
+                codes.append(lookup[key])
+        self.codes = array.array(getCodeTypecode(len(lookup) + 1), codes)
+        self.values = (None,) + tuple([key[1] for key in lookup])
+
+    def __len__(self):
+        """Returns the number of values in this column
+        """
+        return len(self.data)
+
+    def __getitem__(self, i):
+        """Returns the original value at the given row index (negative indices
+           count from the end; out-of-range indices raise IndexError)
+        """
+        code = self.codes[i]
+        if code != 0:
+            return self.values[code]
+        return self.data[i]
+
+    def __iter__(self):
+        """Iterates over original values, in row order
+        """
+        values = self.values
+        for v, code in zip(self.data, self.codes):
+            yield values[code] if code != 0 else v
+
+    def getExceptions(self):
+        """Returns a list of (row index, value) tuples for the non-float values
+           in this column
+        """
+        return [(i, self.values[code]) for i, code in enumerate(self.codes) if code != 0]
+
+class DictionaryColumn(object):
+    """Column container for low-cardinality values. Each distinct value is
+       stored once (in order of first appearance), and rows are stored as
+       indices into those values in the smallest unsigned *array.array*
+       typecode that fits.
+    """
+
+    __slots__ = ("codes", "values")
+
+    def __init__(self, values):
+        """Packs the given list of cell values
+        """
+        import array
+        lookup = {}
+        codes = []
+        for v in values:
+            key = (type(v), v) # keeps 1, 1.0, and True distinct
+            if key not in lookup:
+                lookup[key] = len(lookup)
+            codes.append(lookup[key])
+        self.codes = array.array(getCodeTypecode(len(lookup)), codes)
+        self.values = tuple([key[1] for key in lookup])
+
+    def __len__(self):
+        """Returns the number of values in this column
+        """
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        """Returns the original value at the given row index
+        """
+        return self.values[self.codes[i]]
+
+    def __iter__(self):
+        """Iterates over original values, in row order
+        """
+        values = self.values
+        for code in self.codes:
+            yield values[code]
+
+class StringColumn(object):
+    """Column container for (mostly unique) string values. All values are
+       concatenated into one string, and each row is stored as an offset into
+       it (in an *array.array* buffer), so a row costs a few bytes instead of
+       a separate string object.
+    """
+
+    __slots__ = ("text", "offsets")
+
+    def __init__(self, values):
+        """Packs the given list of string values
+        """
+        import array
+        self.text = "".join(values)
+        offsets = [0]
+        for v in values:
+            offsets.append(offsets[-1] + len(v))
+        self.offsets = array.array("I" if offsets[-1] <= 0xFFFFFFFF else "Q", offsets)
+
+    def __len__(self):
+        """Returns the number of values in this column
+        """
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """Returns the string at the given row index (negative indices count
+           from the end; out-of-range indices raise IndexError)
+        """
+        n = len(self.offsets) - 1
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("Column row index %d out of range" % i)
+        return self.text[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        """Iterates over string values, in row order
+        """
+        text = self.text
+        offsets = self.offsets
+        for i in range(len(offsets) - 1):
+            yield text[offsets[i]:offsets[i+1]]
+
+@profiling.timed("readXlsTable")
+def readXlsTable(xlsPath, sheetName=None):
+    """Reads an .XLS file and returns a Table object corresponding to the
+       continuous table in the given sheet (defaults to the first sheet if no
+       name is specified).
     """
+    import xlrd
+    profiling.addFileBytes("readXlsTable", xlsPath)
     wb = xlrd.open_workbook(xlsPath)
     sheet_names = wb.sheet_names()
     sheet_ndx = 0
@@ -110,22 +313,22 @@ def readXlsDicts(xlsPath, sheetName=None):
     ws = wb.sheet_by_index(sheet_ndx)
     header = ws.row_values(0)
     rows = []
-    for i in range(ws.nrows):
-        rv = ws.row_values(i+1)
-        if len("".join([str(v) for v in rv]).strip()) == 0:
+    for i in range(1, ws.nrows):
+        rv = ws.row_values(i)
+        if isBlankRow(rv):
             break
         assert(len(rv) == len(header))
-        entry = {}
-        for j, key in enumerate(header):
-            entry[key] = rv[j]
-        rows.append(entry)
-    return rows
+        rows.append(rv)
+    return Table(header, [[rv[j] for rv in rows] for j in range(len(header))])
 
-def readXlsxDicts(xlsxPath, sheetName=None):
-    """Reads an .XLSX file and returns a list of dictionaries corresponding to
-       the continuous table in the given sheet (defaults to the first sheet if
-       no name is specified).
+@profiling.timed("readXlsxTable")
+def readXlsxTable(xlsxPath, sheetName=None):
+    """Reads an .XLSX file and returns a Table object corresponding to the
+       continuous table in the given sheet (defaults to the first sheet if no
+       name is specified).
     """
+    import openpyxl
+    profiling.addFileBytes("readXlsxTable", xlsxPath)
     wb = openpyxl.open(xlsxPath)
     sheet_names = wb.sheetnames
     sheet_ndx = 0
@@ -139,14 +342,106 @@ def readXlsxDicts(xlsxPath, sheetName=None):
             header = [cell.value for cell in row]
         else:
             rv = [cell.value for cell in row]
-            if len("".join([str(v) for v in rv]).strip()) == 0:
+            if isBlankRow(rv):
                 break
             assert(len(rv) == len(header))
-            entry = {}
-            for j, key in enumerate(header):
-                entry[key] = rv[j]
-            rows.append(entry)
-    return rows
+            rows.append(rv)
+    return Table(header, [[rv[j] for rv in rows] for j in range(len(header))])
+
+def readXlsDicts(xlsPath, sheetName=None):
+    """Reads an .XLS file and returns a list of read-only, dictionary-like
+       Record objects corresponding to the continuous table in the given sheet
+       (defaults to the first sheet if no name is specified).
+    """
+    return list(readXlsTable(xlsPath, sheetName))
+
+def readXlsxDicts(xlsxPath, sheetName=None):
+    """Reads an .XLSX file and returns a list of read-only, dictionary-like
+       Record objects corresponding to the continuous table in the given sheet
+       (defaults to the first sheet if no name is specified).
+    """
+    return list(readXlsxTable(xlsxPath, sheetName))
+
+class Table(object):
+    """Column-oriented table in which all rows share a single header. Each
+       column is stored as one container (see *packColumn()*), so per-row
+       overhead is limited to the column slots themselves. Rows are exposed as
+       Record objects, which are mapping-compatible views into the columns.
+    """
+
+    def __init__(self, header, columns):
+        """Initializes a table from a sequence of header keys and a matching
+           sequence of column value lists (one per key).
+        """
+        assert(len(header) == len(columns))
+        self.header = tuple(header)
+        self.index = {}
+        for j, key in enumerate(self.header):
+            self.index[key] = j
+        self.columns = [packColumn(column) for column in columns]
+        self.nRows = len(self.columns[0]) if 0 < len(self.columns) else 0
+
+    def __len__(self):
+        """Returns the number of rows in this table
+        """
+        return self.nRows
+
+    def __iter__(self):
+        """Iterates over Record views of each row in this table
+        """
+        for row in range(self.nRows):
+            yield Record(self, row)
+
+    def __getitem__(self, row):
+        """Returns a Record view of the given row index
+        """
+        if row < 0:
+            row += self.nRows
+        if not 0 <= row < self.nRows:
+            raise IndexError("Table row index %d out of range" % row)
+        return Record(self, row)
+
+    def getColumn(self, key):
+        """Returns the column container (an *array.array*, NumericColumn,
+           DictionaryColumn, StringColumn, or list) for the given header key
+        """
+        return self.columns[self.index[key]]
+
+class Record(collections.abc.Mapping):
+    """Read-only, dictionary-like view of a single row within a Table. Only
+       the owning table and row index are stored (via *__slots__*), so records
+       are cheap to create and hold. Any code expecting a dictionary of
+       properties (subscripting, *.keys()*, *dict.update()*, etc.) can consume
+       a Record directly; use *dict(record)* for a mutable copy.
+    """
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        """Records are constructed by (and reference) their owning Table
+        """
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, key):
+        """Returns the value in the given column for this row
+        """
+        return self.table.columns[self.table.index[key]][self.row]
+
+    def __iter__(self):
+        """Iterates over header keys, like a dictionary
+        """
+        return iter(self.table.header)
+
+    def __len__(self):
+        """Returns the number of header keys
+        """
+        return len(self.table.header)
+
+    def __repr__(self):
+        """Represented like the equivalent dictionary
+        """
+        return repr(dict(self))
 
 class Sector(object):
     """Models a specific sector of industry, as organized under the Fidelity
@@ -158,10 +453,55 @@ class Sector(object):
         """Initializes a sector model from a given spreadsheet. (For example,
            the energy sector would be initialized from the *ENERGY.xlsx*
            spreadsheet.) Sector spreadsheets are organized under specific
-           datastore snapshots.
+           datastore snapshots. All worksheets are parsed up front into a
+           single Table (one row per symbol), after which the workbook itself
+           is released.
         """
+        import xlrd
         self.sectorPath = xlsPath
-        self.wb = xlrd.open_workbook(xlsPath)
+        with profiling.stage("Sector.load"):
+            profiling.addFileBytes("Sector.load", xlsPath)
+            wb = xlrd.open_workbook(xlsPath)
+            self.table = self.readTable(wb)
+        self.rowIndex = {}
+        for row, symbol in enumerate(self.table.getColumn("Symbol")):
+            if symbol not in self.rowIndex:
+                self.rowIndex[symbol] = row
+
+    def readTable(self, wb):
+        """Merges all worksheets of the given workbook into a single Table,
+           with one row for each symbol listed in the "Search Criteria" sheet.
+           Properties repeated across worksheets (like "Company Name") take
+           their value from the last worksheet in which they appear.
+        """
+        ws = wb.sheet_by_name("Search Criteria")
+        col_ndx = ws.row_values(0).index("Symbol")
+        symbols = []
+        for row_ndx, row in enumerate(ws.col_values(col_ndx)):
+            if len(row.strip()) == 0:
+                break
+            if row_ndx > 0:
+                symbols.append(row)
+        header = []
+        columns = {}
+        for ws in wb.sheets():
+            sheetHeader = ws.row_values(0)
+            symbCol = ws.col_values(sheetHeader.index("Symbol"))
+            rowOf = {}
+            for row_ndx, symbol in enumerate(symbCol):
+                if row_ndx > 0 and symbol not in rowOf:
+                    rowOf[symbol] = row_ndx
+            rows = []
+            for symbol in symbols:
+                if symbol in rowOf:
+                    rows.append(ws.row_values(rowOf[symbol]))
+                else:
+                    rows.append([""] * len(sheetHeader))
+            for j, key in enumerate(sheetHeader):
+                if key not in columns:
+                    header.append(key)
+                columns[key] = [rv[j] for rv in rows]
+        return Table(header, [columns[key] for key in header])
 
     def getCode(self):
         """Returns the code for this sector. A "code" is the alphabetic
@@ -176,32 +516,13 @@ class Sector(object):
     def getSymbols(self):
         """Returns list of all symbols listed for this sector
         """
-        sheet_names = self.wb.sheet_names()
-        sheet_ndx = sheet_names.index("Search Criteria")
-        ws = self.wb.sheet_by_index(sheet_ndx)
-        header = ws.row_values(0)
-        col_ndx = header.index("Symbol")
-        symbols = []
-        for row_ndx, row in enumerate(ws.col_values(col_ndx)):
-            if len(row.strip()) == 0:
-                break
-            if row_ndx > 0:
-                symbols.append(row)
-        return symbols
+        return list(self.table.getColumn("Symbol"))
 
+    @profiling.timed("Sector.getSecurity", trace=False)
     def getSecurity(self, symbol):
-        """Aggregates all symbol properties across all worksheets
-        """
-        sheet_names = self.wb.sheet_names()
-        properties = {}
-        for sheet_name in sheet_names:
-            sheet_ndx = sheet_names.index(sheet_name)
-            ws = self.wb.sheet_by_index(sheet_ndx)
-            header = ws.row_values(0)
-            symbCol_ndx = header.index("Symbol")
-            symbRow_ndx = ws.col_values(symbCol_ndx).index(symbol)
-            values = ws.row_values(symbRow_ndx)
-            assert(len(header) == len(values))
-            for i in range(len(header)):
-                properties[header[i]] = values[i]
-        return properties
+        """Aggregates all symbol properties across all worksheets, returned as
+           a (read-only, dictionary-like) Record
+        """
+        if symbol not in self.rowIndex:
+            raise ValueError("Symbol %s not found in sector %s" % (symbol, self.getCode()))
+        return self.table[self.rowIndex[symbol]]
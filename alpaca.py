@@ -0,0 +1,18 @@
+"""Shared Alpaca client factory. Strategies and the "bars" cache get their
+   REST client from *getApi()*, which reads the keypair from the "keys"
+   package and imports alpaca_trade_api only when a client is first needed,
+   so importing any module that may talk to Alpaca stays cheap.
+"""
+
+from quant_local import keys, profiling
+
+BASE_URL = "https://paper-api.alpaca.markets"
+
+def getApi(baseUrl=BASE_URL):
+    """Returns an (instrumented) Alpaca REST client for the given endpoint,
+       which defaults to paper trading
+    """
+    import alpaca_trade_api as ata
+    keypair = keys.get("alpaca")
+    api = ata.REST(key_id=keypair[1], secret_key=keypair[0], base_url=baseUrl)
+    return profiling.instrumentClient(api, "alpaca")
@@ -0,0 +1,239 @@
+"""Locally-cached OHLCV bars. Bars for each symbol and timeframe are stored as
+   one compressed numpy archive under "cache/bars/<timeframe>/<SYMBOL>.npz",
+   holding integer "t" timestamps (seconds since the epoch, UTC, ascending)
+   and a float "ohlcv" array with one row per bar and one column per FIELDS
+   entry. Strategies read bars from this cache, and only symbols that are
+   missing (or older than the cache TTL) are fetched from Alpaca, in batches.
+
+   Daily charts saved under "charts/" (CSV files with "Date,Open,High,Low,
+   Close,Volume" columns) can be read in the same layout with *readChart()*.
+
+   Coarser bars are derived from the minute store by *resample()*, so one
+   cached set of minute bars can serve strategies on any timeframe:
+
+   >>> minute = getBars(["SPY", "QQQ"], "minute")
+   >>> daily = resample(minute, "day")
+   >>> fifteen = resample(minute, "15min")
+
+   Bars are grouped by New York trading session (only bars starting within
+   the regular NYSE session, 9:30 to 16:00, are kept by default), so
+   intraday buckets are anchored at the open and never span sessions. All
+   symbols are reduced together, with numpy "reduceat" segment reductions
+   (first open, maximum high, minimum low, last close, and summed volume)
+   over the sorted bars.
+"""
+
+import os
+import re
+import time
+import datetime
+import numpy
+import quant_local
+from quant_local import alpaca, profiling
+
+CACHE_PATH = quant_local.PACK_PATH + "/cache/bars"
+CHARTS_PATH = quant_local.PACK_PATH + "/charts"
+CACHE_TTL = 86400.0
+FIELDS = ["open", "high", "low", "close", "volume"]
+BATCH_SIZE = 100 # symbols per Alpaca barset request
+TIMEZONE = "America/New_York"
+SESSION_OPEN = 9 * 60 + 30 # minutes after local midnight
+SESSION_CLOSE = 16 * 60
+
+def getCachePath(symbol, timeframe, cachePath=CACHE_PATH):
+    """Returns the path of the cached bar archive for a symbol and timeframe
+    """
+    return os.path.abspath(cachePath + "/%s/%s.npz" % (timeframe, symbol))
+
+def saveBars(symbol, timeframe, t, ohlcv, cachePath=CACHE_PATH):
+    """Atomically writes bars for a symbol and timeframe to the cache
+    """
+    path = getCachePath(symbol, timeframe, cachePath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'wb') as f:
+        numpy.savez_compressed(f, t=numpy.asarray(t, dtype=numpy.int64), ohlcv=numpy.asarray(ohlcv, dtype=numpy.float64))
+    os.replace(path + ".tmp", path)
+
+def loadBars(symbol, timeframe, cachePath=CACHE_PATH, ttl=None):
+    """Returns cached (t, ohlcv) arrays for a symbol and timeframe, or None if
+       there are no cached bars (or, if a TTL in seconds is given, they are
+       older than that)
+    """
+    path = getCachePath(symbol, timeframe, cachePath)
+    if not os.path.isfile(path):
+        return None
+    if ttl is not None and ttl < time.time() - os.path.getmtime(path):
+        return None
+    profiling.addFileBytes("bars.load", path)
+    with numpy.load(path) as archive:
+        return archive["t"], archive["ohlcv"]
+
+def fetchBars(symbols, timeframe="day", limit=1000, api=None):
+    """Fetches bars for the given symbols from Alpaca, in batches. Returns a
+       dictionary mapping each symbol to (t, ohlcv) arrays. Daily bars are
+       labelled with 00:00 UTC of their session date, like those read by
+       *readChart()* or resampled by *resample()*.
+    """
+    api = alpaca.getApi() if api is None else api
+    fetched = {}
+    for i in range(0, len(symbols), BATCH_SIZE):
+        barset = api.get_barset(symbols[i:i+BATCH_SIZE], timeframe, limit=limit)
+        for symbol in symbols[i:i+BATCH_SIZE]:
+            points = barset[symbol] if symbol in barset else []
+            t = numpy.array([int(point.t.timestamp()) for point in points], dtype=numpy.int64)
+            ohlcv = numpy.array([[point.o, point.h, point.l, point.c, point.v] for point in points], dtype=numpy.float64).reshape(-1, len(FIELDS))
+            if timeframe == "day" and 0 < len(t):
+                t = (t + getLocalOffsets(t)) // 86400 * 86400
+            fetched[symbol] = (t, ohlcv)
+    return fetched
+
+@profiling.timed("getBars")
+def getBars(symbols, timeframe="day", limit=1000, cachePath=CACHE_PATH, ttl=CACHE_TTL, fetch=True):
+    """Returns a dictionary mapping each of the given symbols to (t, ohlcv)
+       arrays, from the cache where fresh. Other symbols are fetched (and
+       cached) unless *fetch* is False, in which case stale bars are returned
+       as they are and uncached symbols are omitted.
+    """
+    bars = {}
+    missing = []
+    for symbol in symbols:
+        cached = loadBars(symbol, timeframe, cachePath, ttl if fetch else None)
+        if cached is None:
+            missing.append(symbol)
+        else:
+            bars[symbol] = cached
+    if fetch and 0 < len(missing):
+        for symbol, (t, ohlcv) in fetchBars(missing, timeframe, limit).items():
+            saveBars(symbol, timeframe, t, ohlcv, cachePath)
+            bars[symbol] = (t, ohlcv)
+    return bars
+
+def alignField(bars, symbols, field="close"):
+    """Aligns one field of the given bars on the union of their timestamps.
+       Returns the sorted timestamps and a (time x symbol) float array, with
+       NaN where a symbol has no bar.
+    """
+    j = FIELDS.index(field)
+    parts = [bars[symbol][0] for symbol in symbols if symbol in bars]
+    t = numpy.unique(numpy.concatenate(parts)) if 0 < len(parts) else numpy.array([], dtype=numpy.int64)
+    values = numpy.full((len(t), len(symbols)), numpy.nan)
+    for i, symbol in enumerate(symbols):
+        if symbol in bars:
+            symbolT, ohlcv = bars[symbol]
+            values[numpy.searchsorted(t, symbolT), i] = ohlcv[:, j]
+    return t, values
+
+def readChart(csvPath):
+    """Reads a daily chart CSV file (with "M/D/YYYY" dates) from "charts/",
+       returning (t, ohlcv) arrays like *loadBars()*
+    """
+    t = []
+    rows = []
+    with open(csvPath, 'r') as f:
+        header = [key.strip().lower() for key in f.readline().split(",")]
+        columns = [header.index(field) for field in FIELDS]
+        for line in f:
+            cells = line.strip().split(",")
+            if len(cells) < len(header):
+                continue
+            date = datetime.datetime.strptime(cells[header.index("date")], "%m/%d/%Y")
+            t.append(int(date.replace(tzinfo=datetime.timezone.utc).timestamp()))
+            rows.append([float(cells[k]) for k in columns])
+    order = numpy.argsort(t, kind="stable")
+    return numpy.array(t, dtype=numpy.int64)[order], numpy.array(rows, dtype=numpy.float64).reshape(-1, len(FIELDS))[order]
+
+def getLocalOffsets(t):
+    """Returns the UTC offset (in seconds) of New York local time for each of
+       the given UTC timestamps. Offsets are looked up once per distinct UTC
+       day (daylight saving changes happen early on Sunday mornings, outside
+       of any session).
+    """
+    import zoneinfo
+    zone = zoneinfo.ZoneInfo(TIMEZONE)
+    days, inverse = numpy.unique(t // 86400, return_inverse=True)
+    offsets = numpy.array([datetime.datetime.fromtimestamp(int(day) * 86400 + 43200, zone).utcoffset().total_seconds() for day in days], dtype=numpy.int64)
+    return offsets[inverse.reshape(-1)]
+
+def parseRule(rule):
+    """Parses a resampling rule ("<N>min", "day", "week", or "month") into a
+       (unit, minutes) tuple
+    """
+    match = re.match(r"^(\d+)min$", rule)
+    if match is not None and 0 < int(match.group(1)):
+        return "min", int(match.group(1))
+    if rule in ["day", "week", "month"]:
+        return rule, 0
+    raise Exception("Unsupported resampling rule '%s'" % rule)
+
+def getBuckets(t, rule, sessionOnly=True):
+    """Returns (keep, keys, labels) for the given sorted UTC bar timestamps:
+       a boolean mask of bars to keep, and for each kept bar, a bucket key
+       (non-decreasing with time) and the timestamp labelling its bucket.
+       Intraday buckets are labelled with their UTC start time; daily,
+       weekly, and monthly buckets with 00:00 UTC of the session date (like
+       *readChart()*) of the bucket's first day, Monday, or first of month.
+    """
+    unit, minutes = parseRule(rule)
+    local = t + getLocalOffsets(t)
+    days = local // 86400
+    minuteOfDay = (local % 86400) // 60
+    keep = numpy.ones(len(t), dtype=bool)
+    if sessionOnly:
+        keep = (SESSION_OPEN <= minuteOfDay) & (minuteOfDay < SESSION_CLOSE)
+    days = days[keep]
+    if unit == "min":
+        anchor = SESSION_OPEN if sessionOnly else 0
+        slots = (minuteOfDay[keep] - anchor) // minutes
+        keys = days * (24 * 60) + slots
+        labels = t[keep] - (local[keep] - (days * 86400 + (anchor + slots * minutes) * 60))
+    elif unit == "day":
+        keys = days
+        labels = days * 86400
+    elif unit == "week":
+        keys = (days + 3) // 7 # epoch day 0 was a Thursday; weeks start Monday
+        labels = (keys * 7 - 3) * 86400
+    else:
+        keys = days.astype("datetime64[D]").astype("datetime64[M]").astype(numpy.int64)
+        labels = keys.astype("datetime64[M]").astype("datetime64[D]").astype(numpy.int64) * 86400
+    return keep, keys, labels
+
+@profiling.timed("bars.resample")
+def resample(bars, rule, sessionOnly=True):
+    """Resamples a dictionary of (t, ohlcv) bars by symbol (for example,
+       minute bars from *getBars()*) to the given rule: "<N>min" (like
+       "5min"), "day", "week", or "month". All symbols are concatenated and
+       reduced in one pass, with segments split wherever the symbol or bucket
+       changes. Returns a dictionary of resampled (t, ohlcv) bars.
+    """
+    symbols = list(bars.keys())
+    parts = [bars[symbol] for symbol in symbols]
+    if len(parts) == 0:
+        return {}
+    t = numpy.concatenate([part[0] for part in parts]).astype(numpy.int64)
+    ohlcv = numpy.concatenate([part[1] for part in parts]).reshape(-1, len(FIELDS))
+    ids = numpy.repeat(numpy.arange(len(symbols)), [len(part[0]) for part in parts])
+    keep, keys, labels = getBuckets(t, rule, sessionOnly)
+    ohlcv = ohlcv[keep]
+    ids = ids[keep]
+    if len(ids) == 0:
+        return dict([(symbol, (numpy.array([], dtype=numpy.int64), numpy.zeros((0, len(FIELDS))))) for symbol in symbols])
+    changed = numpy.ones(len(ids), dtype=bool)
+    changed[1:] = (ids[1:] != ids[:-1]) | (keys[1:] != keys[:-1])
+    starts = numpy.flatnonzero(changed)
+    stops = numpy.append(starts[1:], len(ids))
+    resampled = numpy.empty((len(starts), len(FIELDS)))
+    resampled[:, 0] = ohlcv[starts, 0]
+    resampled[:, 1] = numpy.maximum.reduceat(ohlcv[:, 1], starts)
+    resampled[:, 2] = numpy.minimum.reduceat(ohlcv[:, 2], starts)
+    resampled[:, 3] = ohlcv[stops - 1, 3]
+    resampled[:, 4] = numpy.add.reduceat(ohlcv[:, 4], starts)
+    segmentIds = ids[starts]
+    bounds = numpy.searchsorted(segmentIds, numpy.arange(len(symbols) + 1))
+    segmentLabels = labels[starts]
+    return dict([(symbol, (segmentLabels[bounds[i]:bounds[i+1]], resampled[bounds[i]:bounds[i+1]])) for i, symbol in enumerate(symbols)])
+
+def getResampledBars(symbols, rule, cachePath=CACHE_PATH, ttl=CACHE_TTL, fetch=True):
+    """Returns bars for the given symbols on the given timeframe (see
+       *resample()*), derived from the cached minute store
+    """
+    return resample(getBars(symbols, "minute", cachePath=cachePath, ttl=ttl, fetch=fetch), rule)
@@ -0,0 +1,4 @@
+"""Benchmarks for the quant_local package. Each module can be run from the
+   command line (e.g., "python -m quant_local.benchmarks.importtime") and
+   emits machine-readable results to STDOUT.
+"""
@@ -0,0 +1,47 @@
+"""Benchmark of the alpaca_bolband walk-forward optimizer. Daily closes for a
+   synthetic universe (geometric random walks) are generated in memory, and
+   *alpaca_bolband.optimize()* is timed over the full parameter grid, both
+   in-process and across a process pool. One JSON object is printed per run,
+   for example:
+
+   {"workers": 4, "seconds": 1.2, "symbols": 500, "sessions": 504, ...}
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy
+from quant_local.strategies import alpaca_bolband
+
+def getCloses(nSymbols, nSessions, seed=0):
+    """Returns a (session x symbol) array of synthetic daily closes
+    """
+    rng = numpy.random.default_rng(seed)
+    returns = rng.normal(0.0003, 0.02, (nSessions, nSymbols))
+    return 100.0 * numpy.exp(numpy.cumsum(returns, axis=0))
+
+def main():
+    """Parses command-line arguments and times the optimizer
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--sessions", type=int, default=504)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    closes = getCloses(args.symbols, args.sessions, args.seed)
+    for workers in sorted(set([1, args.workers])):
+        t0 = time.perf_counter()
+        result = alpaca_bolband.optimize(closes, maxWorkers=workers)
+        print(json.dumps({
+            "workers": workers,
+            "seconds": time.perf_counter() - t0,
+            "symbols": args.symbols,
+            "sessions": args.sessions,
+            "folds": len(result["folds"]),
+            "parameterSets": len(result["results"]),
+        }))
+
+if __name__ == "__main__":
+    main()
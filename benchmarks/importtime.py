@@ -0,0 +1,89 @@
+"""Import-time benchmark (and regression guard) for the quant_local package.
+   Each target module is imported in a fresh interpreter under
+   "python -X importtime"; the cumulative import time is reported along with
+   any heavy dependencies (spreadsheet backends, numpy, Alpaca) that were
+   pulled in. Exits with a non-zero status if a target imports a forbidden
+   module or exceeds the (optional) time budget.
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+import quant_local
+
+TARGETS = {
+    "quant_local": ["openpyxl", "xlrd", "numpy", "alpaca_trade_api"],
+    "quant_local.keys": ["openpyxl", "xlrd", "numpy", "alpaca_trade_api"],
+    "quant_local.alpaca": ["openpyxl", "xlrd", "numpy", "alpaca_trade_api"],
+    "quant_local.strategies.tffit_metamodel": ["openpyxl", "xlrd", "numpy", "alpaca_trade_api", "tensorflow"],
+    "quant_local.strategies.alpaca_bolband": ["openpyxl", "xlrd", "alpaca_trade_api"],
+    "quant_local.strategies.codesphere": ["openpyxl", "xlrd", "alpaca_trade_api"],
+    "quant_local.strategies.headhunter": ["openpyxl", "xlrd", "alpaca_trade_api", "scipy"],
+    "quant_local.strategies.papa_moo": ["openpyxl", "xlrd", "alpaca_trade_api"],
+}
+IMPORTTIME_PATTERN = r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$"
+
+def getImportTimes(target):
+    """Imports the given module in a subprocess with "-X importtime" enabled.
+       Returns a dictionary mapping each imported module name to a tuple of
+       (self, cumulative) import times in microseconds.
+    """
+    parentPath, _ = os.path.split(quant_local.PACK_PATH)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([parentPath, env.get("PYTHONPATH", "")])
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % target], cwd=parentPath, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise Exception("Unable to import '%s':\n%s" % (target, proc.stderr))
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(IMPORTTIME_PATTERN, line)
+        if match is None:
+            continue
+        selfUs, cumulUs, _, name = match.groups()
+        times[name] = (int(selfUs), int(cumulUs))
+    return times
+
+def benchmark(target, forbidden, repeat=5):
+    """Returns a result dictionary for the given import target. The best
+       (minimum) cumulative time across repeated runs is reported, to reduce
+       noise from a cold filesystem cache.
+    """
+    best = None
+    for _ in range(repeat):
+        times = getImportTimes(target)
+        if best is None or times[target][1] < best[target][1]:
+            best = times
+    loaded = [name for name in forbidden if name in best]
+    return {
+        "target": target,
+        "cumulative_us": best[target][1],
+        "self_us": best[target][0],
+        "modules": len(best),
+        "forbidden_loaded": loaded,
+    }
+
+def main():
+    """Benchmarks each target and prints one JSON object per line. With
+       "--max-us", any target whose cumulative import time exceeds that budget
+       is also treated as a regression.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-us", type=int, default=None)
+    args = parser.parse_args()
+    failed = False
+    for target, forbidden in TARGETS.items():
+        result = benchmark(target, forbidden, args.repeat)
+        if 0 < len(result["forbidden_loaded"]):
+            failed = True
+        if args.max_us is not None and args.max_us < result["cumulative_us"]:
+            failed = True
+        print(json.dumps(result))
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Consistency check (and timing) of incremental papa_moo picks. Every
+   datastore snapshot is processed in chronological order, and its frontier
+   picks are computed both from scratch (*papa_moo.getPicks()*) and
+   incrementally against the state of the previous snapshot
+   (*papa_moo.getIncrementalPicks()*, with state kept in a temporary
+   folder). One JSON object is printed per snapshot, for example:
+
+   {"date": "20220218", "full_seconds": 0.02, "incremental_seconds": 0.01, "match": true, ...}
+
+   Exits with a non-zero status if the two paths pick differently for any
+   snapshot.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import warnings
+import quant_local
+from quant_local.strategies import papa_moo
+
+def main():
+    """Runs both paths over every snapshot (or the last N, with "--last") and
+       prints the comparison for each
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--last", type=int, default=None, help="Only check the most recent N snapshots")
+    args = parser.parse_args()
+    datePaths = quant_local.getDatePaths()
+    if args.last is not None:
+        datePaths = datePaths[-args.last:]
+    statePath = tempfile.mkdtemp(prefix="quant_local_state_")
+    failed = False
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for datePath in datePaths:
+                _, date = os.path.split(datePath)
+                sectors = quant_local.getSectors(datePath)
+                filtersBuy = papa_moo.getFiltersBuy(datePath)
+                t0 = time.perf_counter()
+                full = papa_moo.getPicks(sectors, papa_moo.filterBuys(sectors, filtersBuy))
+                t1 = time.perf_counter()
+                _, baseline = papa_moo.loadBaseline(date, filtersBuy, statePath)
+                incremental, state, stats = papa_moo.getIncrementalPicks(date, sectors, filtersBuy, baseline)
+                t2 = time.perf_counter()
+                state["recommendations"] = []
+                papa_moo.saveState(state, statePath)
+                match = full == incremental
+                failed = failed or not match
+                print(json.dumps({
+                    "date": date,
+                    "full_seconds": t1 - t0,
+                    "incremental_seconds": t2 - t1,
+                    "filter_evaluations": stats["filter evaluations"],
+                    "metric_evaluations": stats["metric evaluations"],
+                    "match": match,
+                }))
+                if not match:
+                    print(json.dumps({"date": date, "full": full, "incremental": incremental}))
+    finally:
+        shutil.rmtree(statePath)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
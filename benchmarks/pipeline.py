@@ -0,0 +1,130 @@
+"""Stage-by-stage benchmark of the papa_moo pipeline. A synthetic datastore
+   (see "synthetic.py") is generated at the requested scale, the package is
+   pointed at it, and each stage of *papa_moo.main()* is timed in turn for
+   every snapshot. One JSON object is printed per stage, with times and
+   counts totaled across the snapshots timed, for example:
+
+   {"stage": "filterBuys", "seconds": 4.1, "securities": 10000, "snapshots_timed": 10, ...}
+
+   Pass "--path" to reuse (or keep) a generated datastore between runs, since
+   generating large universes can take much longer than the benchmark itself.
+"""
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import warnings
+import quant_local
+from quant_local.strategies import papa_moo
+from quant_local.benchmarks import synthetic
+
+def timeStage(results, stage, func, *args):
+    """Calls the given function with the given arguments, appending a result
+       dictionary (stage name and elapsed wall time) to the results list.
+       Returns the function's return value.
+    """
+    t0 = time.perf_counter()
+    value = func(*args)
+    results.append({"stage": stage, "seconds": time.perf_counter() - t0})
+    return value
+
+def getSectorMetrics(sectors, allBuys):
+    """Evaluates *papa_moo.getMetrics()* for the buy candidates in every
+       sector. Returns a dictionary mapping sector code to (symbols, metric
+       table) tuples.
+    """
+    metrics = {}
+    for sector in sectors:
+        code = sector.getCode()
+        if code in allBuys:
+            metrics[code] = papa_moo.getMetrics(sector, allBuys[code])
+    return metrics
+
+def getFrontiers(metrics):
+    """Evaluates *papa_moo.getFrontier()* for each sector's metric table
+    """
+    return dict([(code, papa_moo.getFrontier(xy[0,:], xy[1,:])) for code, (symbols, xy) in metrics.items() if 0 < len(symbols)])
+
+def runPipeline(datePath):
+    """Runs each stage of the papa_moo pipeline against the given snapshot of
+       the current *quant_local.DATASTORE_PATH*, returning a list of per-stage
+       results
+    """
+    results = []
+    timeStage(results, "getDatePaths", quant_local.getDatePaths)
+    sectors = timeStage(results, "getSectors", quant_local.getSectors, datePath)
+    filtersBuy = timeStage(results, "getFiltersBuy", papa_moo.getFiltersBuy, datePath)
+    filtersSell = timeStage(results, "getFiltersSell", papa_moo.getFiltersSell, datePath)
+    positions = timeStage(results, "getPositions", quant_local.getPositions, sectors, datePath)
+    allBuys = timeStage(results, "filterBuys", papa_moo.filterBuys, sectors, filtersBuy)
+    timeStage(results, "filterSells", papa_moo.filterSells, positions, filtersSell)
+    metrics = timeStage(results, "getMetrics", getSectorMetrics, sectors, allBuys)
+    timeStage(results, "getFrontier", getFrontiers, metrics)
+    nSecurities = sum([len(sector.getSymbols()) for sector in sectors])
+    nCandidates = sum([len(symbols) for symbols in allBuys.values()])
+    for result in results:
+        result["securities"] = nSecurities
+        result["candidates"] = nCandidates
+    return results
+
+def runSnapshots(datePaths):
+    """Runs the pipeline against each of the given snapshots, returning a
+       dictionary of per-stage results with seconds, securities, and
+       candidates totaled across snapshots
+    """
+    totals = {}
+    for datePath in datePaths:
+        for result in runPipeline(datePath):
+            total = totals.setdefault(result["stage"], {"stage": result["stage"], "seconds": 0.0, "securities": 0, "candidates": 0})
+            for key in ["seconds", "securities", "candidates"]:
+                total[key] += result[key]
+    return totals
+
+def main():
+    """Generates (or reuses) a synthetic datastore and prints per-stage timing
+       results as JSON lines. Every snapshot is timed (or only the most recent
+       N, with "--last"), and the best (minimum) total time across repeats is
+       reported for each stage.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--securities", type=int, default=1000)
+    parser.add_argument("--snapshots", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pass-rate", type=float, default=synthetic.PASS_RATE, help="Fraction of securities passing the buy filters")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--last", type=int, default=None, help="Only time the most recent N snapshots")
+    parser.add_argument("--path", default=None, help="Datastore folder to reuse (generated if missing or empty)")
+    args = parser.parse_args()
+    rootPath = args.path if args.path is not None else tempfile.mkdtemp(prefix="quant_local_bench_")
+    try:
+        t0 = time.perf_counter()
+        if not os.path.isdir(rootPath) or len(os.listdir(rootPath)) == 0:
+            synthetic.generate(rootPath, args.securities, args.snapshots, seed=args.seed, passRate=args.pass_rate)
+        generateSeconds = time.perf_counter() - t0
+        quant_local.DATASTORE_PATH = os.path.abspath(rootPath)
+        datePaths = quant_local.getDatePaths()
+        nSnapshots = len(datePaths)
+        if args.last is not None:
+            datePaths = datePaths[-args.last:]
+        best = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for _ in range(args.repeat):
+                for stage, result in runSnapshots(datePaths).items():
+                    if stage not in best or result["seconds"] < best[stage]["seconds"]:
+                        best[stage] = result
+        print(json.dumps({"stage": "generate", "seconds": generateSeconds, "snapshots": nSnapshots}))
+        for result in best.values():
+            result["securities_per_second"] = result["securities"] / result["seconds"] if 0 < result["seconds"] else None
+            result["snapshots"] = nSnapshots
+            result["snapshots_timed"] = len(datePaths)
+            print(json.dumps(result))
+    finally:
+        if args.path is None:
+            shutil.rmtree(rootPath)
+
+if __name__ == "__main__":
+    main()
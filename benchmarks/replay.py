@@ -0,0 +1,104 @@
+"""Offline checks of the "scrape" module. C-suites are parsed from the saved
+   fixture pages in "benchmarks/fixtures/http" in replay mode (so no request
+   ever reaches the network), and retry handling is exercised against a
+   local HTTP server that throttles, fails, and recovers on cue. One JSON
+   object is printed per check, for example:
+
+   {"check": "throttled", "seconds": 1.0, "requests": 2, "fetched": true, "passed": true}
+
+   Exits with a non-zero status if any check fails.
+"""
+
+import os
+import sys
+import json
+import time
+import warnings
+import threading
+import http.server
+from quant_local import scrape
+from quant_local.strategies import headhunter
+
+FIXTURE_PATH = os.path.abspath(os.path.dirname(__file__) + "/fixtures/http")
+EXPECTED_CSUITE = [("woods_darren_1965", "Chairman, CEO & Pres", 1001001), ("mikells_kathryn_1966", "Sr. VP & Chief Financial Officer", 1002002)]
+
+# status codes served, in order, for each path (the last one repeats)
+RESPONSES = {
+    "/throttled": [(429, {"Retry-After": "1"}), (200, {})],
+    "/flaky": [(503, {}), (502, {}), (200, {})],
+    "/missing": [(404, {})],
+    "/down": [(500, {})],
+}
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves the canned RESPONSES, counting requests per path
+    """
+
+    counts = {}
+
+    def do_GET(self):
+        """Responds with the next status code for the requested path
+        """
+        n = Handler.counts.get(self.path, 0)
+        Handler.counts[self.path] = n + 1
+        status, headers = RESPONSES[self.path][min(n, len(RESPONSES[self.path]) - 1)]
+        body = b"ok" if status == 200 else b""
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Keeps the server quiet
+        """
+        pass
+
+def checkReplay():
+    """Parses the XOM fixture (and its Bloomberg lookups) in replay mode, and
+       confirms that a symbol without fixtures fails instead of fetching
+    """
+    scraper = scrape.Scraper(FIXTURE_PATH, replay=True)
+    csuites = headhunter.getCSuites([{"Symbol": "XOM"}, {"Symbol": "NOPE"}], scraper)
+    found = [(officer["Identifier"], officer["Title"], officer.get("BloombergId", None)) for officer in csuites[0]]
+    return found == EXPECTED_CSUITE and csuites[1] == []
+
+def checkRetry(baseUrl, path, expectFetched, expectRequests, minSeconds=0.0):
+    """Fetches the given path from the local server, returning True if the
+       outcome, request count, and (minimum) elapsed time are as expected
+    """
+    scraper = scrape.Scraper(minInterval=0.0, timeout=5.0, retries=3, backoff=0.01)
+    t0 = time.perf_counter()
+    try:
+        fetched = scraper.fetch(baseUrl + path) == b"ok"
+    except Exception:
+        fetched = False
+    seconds = time.perf_counter() - t0
+    requests = Handler.counts.get(path, 0)
+    passed = fetched == expectFetched and requests == expectRequests and minSeconds <= seconds
+    print(json.dumps({"check": path.strip("/"), "seconds": seconds, "requests": requests, "fetched": fetched, "passed": passed}))
+    return passed
+
+def main():
+    """Runs every check, exiting non-zero if any fails
+    """
+    warnings.simplefilter("ignore")
+    passed = checkReplay()
+    print(json.dumps({"check": "replay", "passed": passed}))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    baseUrl = "http://127.0.0.1:%u" % server.server_address[1]
+    try:
+        passed = checkRetry(baseUrl, "/throttled", True, 2, 1.0) and passed
+        passed = checkRetry(baseUrl, "/flaky", True, 3) and passed
+        passed = checkRetry(baseUrl, "/missing", False, 1) and passed
+        passed = checkRetry(baseUrl, "/down", False, 4) and passed
+    finally:
+        server.shutdown()
+    if not passed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Generates synthetic datastore snapshots for benchmarking. Each snapshot
+   folder mirrors the layout saved from Fidelity market research: one .XLS
+   spreadsheet per sector (with the same worksheets and columns), plus the
+   "sectors.xlsx", "filters_buy.xlsx", "filters_sell.xlsx", and
+   "positions.xlsx" tables. Prices follow a seeded random walk across
+   snapshots, so results are reproducible for a given scale and seed.
+
+   A given fraction of securities (the pass rate) is generated to satisfy
+   every buy filter in every snapshot, and the rest to fail at least one, so
+   the metric and frontier stages of the pipeline see a controllable number
+   of candidates.
+
+   Writing .XLS files requires the xlwt package, which is imported on first
+   use (it is not needed by the rest of quant_local).
+"""
+
+import os
+import json
+import random
+import argparse
+import datetime
+
+SECTORS = [
+    ("Communication Services", "COMM_SERV", 50),
+    ("Consumer Discretionary", "CONS_DISC", 25),
+    ("Consumer Staples", "CONS_STAP", 30),
+    ("Energy", "ENERGY", 10),
+    ("Financials", "FINANCIALS", 40),
+    ("Health Care", "HEALTH_CARE", 35),
+    ("Industrials", "INDUSTRIALS", 20),
+    ("Information Technology", "INFO_TECH", 45),
+    ("Materials", "MATERIALS", 15),
+    ("Real Estate", "REAL_ESTATE", 60),
+    ("Utilities", "UTILITIES", 55),
+] # (Name, Code, ID), as listed in the "sectors.xlsx" table
+SHEETS = [
+    ("Search Criteria", ["Symbol", "Company Name", "Security Type", "Security Price", "Sector", "Industry", "Sub-Industry", "Market Capitalization", "% Price Change Today", "Equity Summary Score from StarMine from Refinitiv"]),
+    ("Basic Facts", ["Symbol", "Company Name", "Security Price", "Volume (90 Day Avg)", "Market Capitalization", "Dividend Yield", "Company Headquarters Location", "Sector", "Industry", "Optionable"]),
+    ("Performance & Volatility", ["Symbol", "Company Name", "Price Performance (52 Weeks)", "Total Return (1 Yr Annualized)", "Beta (1 Year Annualized)", "Standard Deviation (1 Yr Annualized)"]),
+    ("Valuation, Growth & Ownership", ["Symbol", "Company Name", "S&P Global Market Intelligence Valuation", "S&P Global Market Intelligence Quality", "S&P Global Market Intelligence Growth Stability", "S&P Global Market Intelligence Financial Health", "P/E (Price/TTM Earnings)", "PEG Ratio", "EPS Growth (Proj This Yr vs. Last Yr)", "Institutional Ownership", "Institutional Ownership (Last vs. Prior Qtr)"]),
+    ("Analyst Opinions", ["Symbol", "Company Name", "Equity Summary Score from StarMine from Refinitiv", "Equity Summary Score Change (1 Month)", "I/B/E/S Estimates from Refinitiv", "MSCI Overall Environmental, Social & Governance Rating", "MSCI Environmental Score", "MSCI Social Score", "MSCI Governance Score"]),
+]
+FILTERS_BUY = [
+    ("Company Headquarters Location", "==", "United States of America"),
+    ("Equity Summary Score from StarMine from Refinitiv", "==", "Very Bullish"),
+    ("Security Price", ">", 10),
+    ("Security Price", "<", 100),
+    ("Market Capitalization", ">=", 1000000000),
+    ("Price Performance (52 Weeks)", ">", 0),
+]
+FILTERS_SELL = [
+    ("Equity Summary Score from StarMine from Refinitiv", "!=", "Very Bullish"),
+    ("duration_days", ">", 14),
+    ("gain_pct", ">=", 0.1),
+]
+POSITIONS_HEADER = ["symbol", "sector", "shares", "acquired", "original_price", "latest_price", "as_of", "gain_pct", "duration_days"]
+SCORES = ["Very Bullish", "Bullish", "Neutral", "Bearish", "Very Bearish"]
+RATINGS = ["AAA", "AA", "A", "BBB", "BB", "B", "CCC", ""]
+LOCATIONS = ["United States of America"] * 8 + ["Canada", "China"]
+FIRST_DATE = datetime.date(2021, 3, 11)
+PASS_RATE = 0.25 # fraction of securities passing all buy filters
+PASS_PRICES = (11.0, 95.0) # within the "Security Price" buy filters
+
+def formatDollarString(dv):
+    """Inverse of *quant_local.convertDollarString()* for magnitude-suffixed
+       values (e.g., 1.23e9 becomes "$1.23B")
+    """
+    for suffix, mag in [("B", 1e9), ("M", 1e6), ("k", 1e3)]:
+        if mag <= dv:
+            return "$%.2f%s" % (dv / mag, suffix)
+    return "$%.2f" % dv
+
+def getSymbol(i):
+    """Returns the synthetic ticker symbol for the i-th security
+    """
+    letters = ""
+    i += 1
+    while 0 < i:
+        i, r = divmod(i - 1, 26)
+        letters = chr(ord("A") + r) + letters
+    return "Z" + letters
+
+def getUniverse(nSecurities, rng, passRate=PASS_RATE):
+    """Returns a list of dictionaries defining the static (snapshot-invariant)
+       properties of each synthetic security, including initial price. The
+       given fraction of securities (chosen at random) is marked as "Passing"
+       the buy filters, with a US headquarters, a price within the buy
+       range, and enough shares for a market capitalization above $1B.
+    """
+    universe = []
+    for i in range(nSecurities):
+        name, code, _ = SECTORS[i % len(SECTORS)]
+        passing = rng.random() < passRate
+        universe.append({
+            "Symbol": getSymbol(i),
+            "Company Name": "Synthetic Co %u" % i,
+            "Sector": name,
+            "Code": code,
+            "Industry": "%s Industry %u" % (name, rng.randrange(4)),
+            "Sub-Industry": "%s Sub-Industry %u" % (name, rng.randrange(8)),
+            "Company Headquarters Location": LOCATIONS[0] if passing else rng.choice(LOCATIONS),
+            "Optionable": rng.choice(["Yes", "No"]),
+            "Shares": 10 ** rng.uniform(8.1, 10) if passing else 10 ** rng.uniform(6, 10),
+            "Price": rng.uniform(*PASS_PRICES) if passing else 10 ** rng.uniform(0, 2.7),
+            "Beta": rng.uniform(0.2, 2.0),
+            "Passing": passing,
+        })
+    return universe
+
+def stepUniverse(universe, rng):
+    """Advances the price of each security by one (weekly) random-walk step.
+       Prices of passing securities are kept within the buy range.
+    """
+    for security in universe:
+        security["Price"] *= max(0.5, 1 + rng.gauss(0.002, 0.04 * security["Beta"]))
+        if security["Passing"]:
+            security["Price"] = min(max(security["Price"], PASS_PRICES[0]), PASS_PRICES[1])
+
+def getProperties(security, rng):
+    """Returns the full dictionary of (sector spreadsheet) properties for the
+       given security at the current step. Some cells are left blank or
+       filled with "--", as they are in Fidelity exports. Passing securities
+       are "Very Bullish" with a positive 52-week price performance; all
+       others get a different summary score, so they fail the buy filters.
+    """
+    price = security["Price"]
+    if security["Passing"]:
+        score, performance = SCORES[0], abs(rng.gauss(10, 40)) + 0.1
+    else:
+        score, performance = rng.choice(SCORES[1:]), rng.gauss(10, 40)
+    props = dict(security)
+    props.update({
+        "Security Type": "Common Stock",
+        "Security Price": round(price, 2),
+        "Market Capitalization": formatDollarString(price * security["Shares"]),
+        "% Price Change Today": rng.gauss(0, 2),
+        "Equity Summary Score from StarMine from Refinitiv": score,
+        "Volume (90 Day Avg)": rng.uniform(0.01, 50.0),
+        "Dividend Yield": rng.choice(["", rng.uniform(0, 8)]),
+        "Price Performance (52 Weeks)": performance,
+        "Total Return (1 Yr Annualized)": rng.gauss(12, 40),
+        "Beta (1 Year Annualized)": security["Beta"],
+        "Standard Deviation (1 Yr Annualized)": abs(rng.gauss(0.4, 0.2)),
+        "S&P Global Market Intelligence Valuation": float(rng.randrange(1, 100)),
+        "S&P Global Market Intelligence Quality": float(rng.randrange(1, 100)),
+        "S&P Global Market Intelligence Growth Stability": float(rng.randrange(1, 100)),
+        "S&P Global Market Intelligence Financial Health": float(rng.randrange(1, 100)),
+        "P/E (Price/TTM Earnings)": rng.choice(["--", rng.uniform(2, 80)]),
+        "PEG Ratio": rng.choice(["", rng.uniform(0.1, 5)]),
+        "EPS Growth (Proj This Yr vs. Last Yr)": rng.gauss(10, 30),
+        "Institutional Ownership": rng.uniform(0, 100),
+        "Institutional Ownership (Last vs. Prior Qtr)": rng.gauss(0, 5),
+        "Equity Summary Score Change (1 Month)": rng.choice(["", "Upgrade", "Downgrade"]),
+        "I/B/E/S Estimates from Refinitiv": float(rng.randrange(1, 6)),
+        "MSCI Overall Environmental, Social & Governance Rating": rng.choice(RATINGS),
+        "MSCI Environmental Score": rng.choice(["", "%.1f" % rng.uniform(0, 10)]),
+        "MSCI Social Score": rng.choice(["", "%.1f" % rng.uniform(0, 10)]),
+        "MSCI Governance Score": rng.choice(["", "%.1f" % rng.uniform(0, 10)]),
+    })
+    return props
+
+def writeSectorXls(xlsPath, securities, date):
+    """Writes one sector spreadsheet (all worksheets) for the given list of
+       security property dictionaries. Like Fidelity exports, each table is
+       followed by a blank row and an "AS OF" footer.
+    """
+    try:
+        import xlwt
+    except ImportError:
+        raise Exception("The xlwt package is required to write synthetic .XLS sector spreadsheets")
+    wb = xlwt.Workbook()
+    footer = "AS OF 09:55 PM ET %s Quotes delayed at least 15 minutes." % date.strftime("%m/%d/%Y")
+    for sheetName, header in SHEETS:
+        ws = wb.add_sheet(sheetName)
+        for j, key in enumerate(header):
+            ws.write(0, j, key)
+        for i, props in enumerate(securities):
+            for j, key in enumerate(header):
+                ws.write(i + 1, j, props[key])
+        ws.write(len(securities) + 2, 0, footer)
+    wb.save(xlsPath)
+
+def writeXlsx(xlsxPath, header, rows):
+    """Writes a single-worksheet .XLSX table with the given header and rows
+    """
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    wb.save(xlsxPath)
+
+def writeSnapshot(datePath, universe, positions, date, rng):
+    """Writes a complete snapshot folder for the current state of the given
+       universe. Positions are (symbol, code, shares, acquired, price) tuples.
+    """
+    os.makedirs(datePath, exist_ok=True)
+    bySector = {}
+    for security in universe:
+        bySector.setdefault(security["Code"], []).append(getProperties(security, rng))
+    for code, securities in bySector.items():
+        writeSectorXls(datePath + "/%s.xls" % code, securities, date)
+    writeXlsx(datePath + "/sectors.xlsx", ["Name", "Code", "ID"], [list(s) for s in SECTORS])
+    writeXlsx(datePath + "/filters_buy.xlsx", ["property", "comparator", "value"], [list(f) for f in FILTERS_BUY])
+    writeXlsx(datePath + "/filters_sell.xlsx", ["property", "comparator", "value"], [list(f) for f in FILTERS_SELL])
+    prices = dict([(s["Symbol"], s["Price"]) for s in universe])
+    rows = []
+    for i, (symbol, code, shares, acquired, price) in enumerate(positions):
+        rows.append([symbol, code, shares, acquired, round(price, 2), round(prices[symbol], 2), datetime.datetime.combine(date, datetime.time()), "=(F%u-E%u)/E%u" % (i + 2, i + 2, i + 2), "=G%u-D%u" % (i + 2, i + 2)])
+    writeXlsx(datePath + "/positions.xlsx", POSITIONS_HEADER, rows)
+
+def generate(rootPath, nSecurities=1000, nSnapshots=10, nPositions=10, seed=0, passRate=PASS_RATE):
+    """Generates a synthetic datastore under the given root path, with the
+       given number of securities (spread evenly across sectors), weekly
+       snapshots, and fraction of securities passing the buy filters. Returns
+       the list of snapshot folder paths.
+    """
+    rng = random.Random(seed)
+    universe = getUniverse(nSecurities, rng, passRate)
+    held = rng.sample(universe, min(nPositions, nSecurities))
+    acquired = datetime.datetime.combine(FIRST_DATE, datetime.time())
+    positions = [(s["Symbol"], s["Code"], rng.randrange(1, 50), acquired, s["Price"]) for s in held]
+    datePaths = []
+    for k in range(nSnapshots):
+        date = FIRST_DATE + datetime.timedelta(weeks=k)
+        datePath = os.path.abspath(rootPath + "/%s" % date.strftime("%Y%m%d"))
+        writeSnapshot(datePath, universe, positions, date, rng)
+        datePaths.append(datePath)
+        stepUniverse(universe, rng)
+    return datePaths
+
+def main():
+    """Generates a synthetic datastore from command-line arguments and prints
+       a JSON summary of what was written
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="Root folder under which snapshot folders are written")
+    parser.add_argument("--securities", type=int, default=1000)
+    parser.add_argument("--snapshots", type=int, default=10)
+    parser.add_argument("--positions", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pass-rate", type=float, default=PASS_RATE, help="Fraction of securities passing the buy filters")
+    args = parser.parse_args()
+    datePaths = generate(args.path, args.securities, args.snapshots, args.positions, args.seed, args.pass_rate)
+    print(json.dumps({"path": os.path.abspath(args.path), "securities": args.securities, "snapshots": len(datePaths), "passRate": args.pass_rate}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Resident recommendation service. Keeps the latest datastore snapshot
+   (parsed sectors, filters, positions, and papa_moo recommendations) in
+   memory and answers JSON queries over localhost HTTP:
+
+   * GET /recommendations: papa_moo BUY/HOLD/SELL recommendations by sector
+   * GET /security?symbol=XOM: all properties of one security
+   * GET /positions: positions, augmented with security properties
+   * GET /status: snapshot date, load time, and reload count
+   * POST /screen: a query (see *query.fromSpec()*), for example
+     {"columns": ["Symbol"], "where": ["Security Price", "<", 10]}
+
+   A background thread polls the datastore for new date folders and for
+   changed files within the current snapshot. Only the affected pieces are
+   reloaded (a changed sector spreadsheet reloads that sector; changed filter
+   or position tables reload just those), into a new snapshot object that
+   replaces the old one in a single assignment. Requests in flight keep using
+   the snapshot they started with, so none are dropped during a reload.
+
+   Run with "python -m quant_local.daemon --port 8765".
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import http.server
+import urllib.parse
+import quant_local
+from quant_local import query
+from quant_local.strategies import papa_moo
+
+def getStamps(datePath):
+    """Returns a dictionary mapping each spreadsheet file name in the given
+       snapshot folder to its (modification time, size) stamp
+    """
+    stamps = {}
+    for fileName in os.listdir(datePath):
+        if fileName.endswith(".xls") or fileName.endswith(".xlsx"):
+            stat = os.stat(os.path.abspath(datePath + "/%s" % fileName))
+            stamps[fileName] = (stat.st_mtime, stat.st_size)
+    return stamps
+
+def toJson(value):
+    """Converts a value for JSON serialization: NaN floats become None, and
+       values JSON cannot represent (like datetimes) become strings
+    """
+    if isinstance(value, dict) or isinstance(value, quant_local.Record):
+        return dict([(str(k), toJson(v)) for k, v in value.items()])
+    if isinstance(value, list) or isinstance(value, tuple):
+        return [toJson(v) for v in value]
+    if type(value) is type(0.0) and value != value:
+        return None
+    if value is None or type(value) in [type(True), type(0), type(0.0), type("")]:
+        return value
+    return str(value)
+
+class Snapshot(object):
+    """Immutable, fully-loaded state for one datastore snapshot. Built from a
+       previous snapshot where possible, re-parsing only changed files.
+    """
+
+    def __init__(self, datePath, previous=None):
+        """Loads the snapshot at the given date path. If a previous snapshot
+           of the same date path is given, its unchanged sectors, filters, and
+           positions are reused.
+        """
+        self.datePath = datePath
+        _, self.date = os.path.split(datePath)
+        self.stamps = getStamps(datePath)
+        self.loadedAt = time.time()
+        same = previous is not None and previous.datePath == datePath
+        changed = set([name for name in self.stamps if not same or previous.stamps.get(name, None) != self.stamps[name]])
+        prevSectors = dict([(sector.sectorPath, sector) for sector in previous.sectors]) if same else {}
+        self.sectors = []
+        for sectorPath in sorted(quant_local.getSectorPaths(datePath)):
+            _, fileName = os.path.split(sectorPath)
+            if sectorPath in prevSectors and fileName not in changed:
+                self.sectors.append(prevSectors[sectorPath])
+            else:
+                self.sectors.append(quant_local.Sector(sectorPath))
+        self.sectorsByCode = dict([(sector.getCode(), sector) for sector in self.sectors])
+        self.symbolSectors = {}
+        for sector in self.sectors:
+            for symbol in sector.getSymbols():
+                self.symbolSectors.setdefault(symbol, sector)
+        sectorsChanged = not same or any([name.endswith(".xls") for name in changed]) or len(self.sectors) != len(previous.sectors)
+        self.filtersBuy = previous.filtersBuy if same and "filters_buy.xlsx" not in changed else papa_moo.getFiltersBuy(datePath)
+        self.filtersSell = previous.filtersSell if same and "filters_sell.xlsx" not in changed else papa_moo.getFiltersSell(datePath)
+        if same and not sectorsChanged and "positions.xlsx" not in changed:
+            self.positions = previous.positions
+        else:
+            self.positions = quant_local.getPositions(self.sectors, datePath)
+        if same and len(changed) == 0:
+            self.recommendations = previous.recommendations
+        else:
+            allBuys = papa_moo.filterBuys(self.sectors, self.filtersBuy)
+            allSells = papa_moo.filterSells(self.positions, self.filtersSell)
+            picks = papa_moo.getPicks(self.sectors, allBuys)
+            self.recommendations = papa_moo.getRecommendations(self.sectors, picks, allSells, self.positions)
+        self.changed = sorted(changed)
+
+class Service(object):
+    """Holds the current Snapshot, answers queries against it, and watches
+       the datastore for changes
+    """
+
+    def __init__(self, interval=5.0):
+        """Loads the most recent snapshot. The datastore is polled for changes
+           every *interval* seconds once *watch()* is started.
+        """
+        self.interval = interval
+        self.snapshot = Snapshot(quant_local.getDatePaths()[-1])
+        self.catalog = query.Catalog()
+        self.catalog.setSectors(self.snapshot.date, self.snapshot.sectors)
+        self.reloads = 0
+        self.stopEvent = threading.Event()
+
+    def checkForChanges(self):
+        """Reloads (in the calling thread) if the most recent snapshot folder,
+           or any spreadsheet within it, has changed. Returns True if a new
+           snapshot was swapped in.
+        """
+        snapshot = self.snapshot
+        datePath = quant_local.getDatePaths()[-1]
+        if datePath == snapshot.datePath and getStamps(datePath) == snapshot.stamps:
+            return False
+        newSnapshot = Snapshot(datePath, snapshot)
+        self.catalog.setSectors(newSnapshot.date, newSnapshot.sectors)
+        self.snapshot = newSnapshot
+        self.reloads += 1
+        sys.stderr.write("Reloaded snapshot %s (changed: %s)\n" % (newSnapshot.date, ", ".join(newSnapshot.changed)))
+        return True
+
+    def watch(self):
+        """Polls for changes until *stop()* is called. Errors during a reload
+           are reported, and the current snapshot is kept.
+        """
+        while not self.stopEvent.wait(self.interval):
+            try:
+                self.checkForChanges()
+            except Exception:
+                sys.stderr.write("Reload failed; keeping snapshot %s\n%s" % (self.snapshot.date, traceback.format_exc()))
+
+    def start(self):
+        """Starts watching the datastore in a background (daemon) thread
+        """
+        thread = threading.Thread(target=self.watch, name="quant_local-watch", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stops the watcher thread
+        """
+        self.stopEvent.set()
+
+    def getStatus(self):
+        """Returns the date and load time of the current snapshot
+        """
+        snapshot = self.snapshot
+        return {"date": snapshot.date, "loadedAt": snapshot.loadedAt, "reloads": self.reloads, "sectors": len(snapshot.sectors), "securities": len(snapshot.symbolSectors)}
+
+    def getRecommendations(self):
+        """Returns papa_moo recommendations for the current snapshot
+        """
+        snapshot = self.snapshot
+        return {"date": snapshot.date, "recommendations": [{"sector": code, "actions": actions} for code, actions in snapshot.recommendations]}
+
+    def getSecurity(self, symbol):
+        """Returns the sector code and properties of the given symbol
+        """
+        snapshot = self.snapshot
+        if symbol not in snapshot.symbolSectors:
+            raise KeyError("Unknown symbol '%s'" % symbol)
+        sector = snapshot.symbolSectors[symbol]
+        return {"date": snapshot.date, "sector": sector.getCode(), "properties": sector.getSecurity(symbol)}
+
+    def getPositions(self):
+        """Returns the positions of the current snapshot
+        """
+        snapshot = self.snapshot
+        return {"date": snapshot.date, "positions": snapshot.positions}
+
+    def screen(self, spec):
+        """Runs a screening query, given a dictionary with "columns", "where"
+           (see *query.fromSpec()*), and optional "dates" and "codes" entries.
+           Queries run concurrently (the Catalog only locks its caches), so a
+           long screen over the full history neither blocks other screens nor
+           delays a reload.
+        """
+        where = None if spec.get("where", None) is None else query.fromSpec(spec["where"])
+        records = self.catalog.select(spec.get("columns", ["Symbol"]), where, spec.get("dates", None), spec.get("codes", None), asRecords=True)
+        return {"count": len(records), "records": records}
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Routes HTTP requests to the Service attached to the server
+    """
+
+    protocol_version = "HTTP/1.1" # keep-alive, since responses are sized
+    disable_nagle_algorithm = True # headers and body are separate writes
+
+    def sendJson(self, status, body):
+        """Writes the given body as a JSON response
+        """
+        content = json.dumps(toJson(body)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def handle(self):
+        """Handles requests, as usual, on a (keep-alive) connection
+        """
+        try:
+            http.server.BaseHTTPRequestHandler.handle(self)
+        except ConnectionError:
+            pass
+
+    def respond(self, route):
+        """Calls the given route, responding with its result (or an error)
+        """
+        try:
+            self.sendJson(200, route())
+        except KeyError as e:
+            self.sendJson(404, {"error": str(e)})
+        except Exception as e:
+            self.sendJson(400, {"error": str(e)})
+
+    def do_GET(self):
+        """Handles /recommendations, /security, /positions, and /status
+        """
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == "/recommendations":
+            self.respond(service.getRecommendations)
+        elif url.path == "/security":
+            self.respond(lambda: service.getSecurity(params.get("symbol", [""])[0]))
+        elif url.path == "/positions":
+            self.respond(service.getPositions)
+        elif url.path == "/status":
+            self.respond(service.getStatus)
+        else:
+            self.sendJson(404, {"error": "Unknown path '%s'" % url.path})
+
+    def do_POST(self):
+        """Handles /screen, with a JSON query body
+        """
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/screen":
+            self.sendJson(404, {"error": "Unknown path '%s'" % url.path})
+            return
+        length = int(self.headers.get("Content-Length", "0"))
+        self.respond(lambda: service.screen(json.loads(self.rfile.read(length))))
+
+    def log_message(self, format, *args):
+        """Request logging is only written when the server is verbose
+        """
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def serve(host="127.0.0.1", port=8765, interval=5.0, verbose=False):
+    """Loads the service, starts the datastore watcher, and serves requests
+       until interrupted
+    """
+    service = Service(interval)
+    service.start()
+    server = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = service
+    server.verbose = verbose
+    server.daemon_threads = True
+    sys.stderr.write("Serving snapshot %s on http://%s:%u\n" % (service.snapshot.date, host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+def main():
+    """Parses command-line arguments and serves
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--interval", type=float, default=5.0, help="Datastore polling interval, in seconds")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.interval, args.verbose)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Index membership (DJIA, NASDAQ-100, S&P 500, etc.) as defined by the
+   symbol lists under "definitions/indices/". All index definitions are loaded
+   once into a shared symbol-to-integer-ID dictionary, and membership in each
+   index is stored as a packed bitset over those IDs. Lists of symbols (like
+   those of a sector) are then tested for membership with one dictionary
+   lookup per symbol and vectorized bit tests, rather than list searches:
+
+   >>> registry = getRegistry()
+   >>> mask = registry.isMember("sp500", sector.getSymbols())
+   >>> both = registry.getSymbols(registry.intersect(["sp500", "nasdaq100"]))
+"""
+
+import os
+import numpy
+import quant_local
+
+INDICES_PATH = quant_local.PACK_PATH + "/definitions/indices"
+REGISTRY = None
+
+class IndexRegistry(object):
+    """Symbol IDs and per-index membership bitsets for a folder of index
+       definitions (one "<name>.txt" file per index, one symbol per line)
+    """
+
+    def __init__(self, indicesPath=INDICES_PATH):
+        """Loads every index definition in the given folder
+        """
+        self.indicesPath = indicesPath
+        self.symbolIds = {}
+        self.symbols = []
+        self.members = {}
+        for fileName in sorted(os.listdir(indicesPath)):
+            name, ext = os.path.splitext(fileName)
+            if ext != ".txt":
+                continue
+            with open(os.path.abspath(indicesPath + "/%s" % fileName), 'r') as f:
+                listed = [line.strip() for line in f.read().strip().splitlines() if 0 < len(line.strip())]
+            ids = []
+            for symbol in listed:
+                if symbol not in self.symbolIds:
+                    self.symbolIds[symbol] = len(self.symbols)
+                    self.symbols.append(symbol)
+                ids.append(self.symbolIds[symbol])
+            self.members[name] = ids
+        self.bitsets = {}
+        for name, ids in self.members.items():
+            self.bitsets[name] = self.toBitset(ids)
+
+    def getNames(self):
+        """Returns the (sorted) list of index names
+        """
+        return sorted(self.members.keys())
+
+    def toBitset(self, ids):
+        """Returns a packed (uint8) bitset with the given symbol IDs set
+        """
+        bits = numpy.zeros(len(self.symbols), dtype=bool)
+        bits[numpy.asarray(ids, dtype=int)] = True
+        return numpy.packbits(bits)
+
+    def getBitset(self, name):
+        """Returns the packed membership bitset of the given index
+        """
+        if name not in self.bitsets:
+            raise Exception("Unable to locate index '%s'" % name)
+        return self.bitsets[name]
+
+    def getIds(self, symbols):
+        """Returns an integer numpy array of IDs for the given symbols, with -1
+           for symbols that are not in any index
+        """
+        symbolIds = self.symbolIds
+        return numpy.array([symbolIds.get(symbol, -1) for symbol in symbols], dtype=numpy.int64)
+
+    def testBits(self, bitset, ids):
+        """Returns a boolean numpy array indicating which of the given IDs are
+           set in the given packed bitset (IDs of -1 are never set)
+        """
+        known = 0 <= ids
+        safe = numpy.where(known, ids, 0)
+        bits = (bitset[safe >> 3] >> (7 - (safe & 7))) & 1
+        return known & (bits == 1)
+
+    def isMember(self, name, symbols):
+        """Returns a boolean numpy array indicating which of the given symbols
+           belong to the given index (or, if a list of names is given, to all
+           of those indices)
+        """
+        bitset = self.intersect(name) if isinstance(name, list) else self.getBitset(name)
+        return self.testBits(bitset, self.getIds(symbols))
+
+    def getMemberships(self, symbols):
+        """Returns a (symbol x index) boolean numpy array of membership for the
+           given symbols, with columns ordered as *getNames()*
+        """
+        ids = self.getIds(symbols)
+        return numpy.stack([self.testBits(self.bitsets[name], ids) for name in self.getNames()], axis=1) if 0 < len(self.bitsets) else numpy.zeros((len(ids), 0), dtype=bool)
+
+    def intersect(self, names):
+        """Returns the packed bitset of symbols belonging to all given indices
+        """
+        bitset = self.getBitset(names[0]).copy()
+        for name in names[1:]:
+            bitset &= self.getBitset(name)
+        return bitset
+
+    def union(self, names):
+        """Returns the packed bitset of symbols belonging to any given index
+        """
+        bitset = numpy.zeros_like(self.getBitset(names[0]))
+        for name in names:
+            bitset |= self.getBitset(name)
+        return bitset
+
+    def getSymbols(self, bitsetOrName):
+        """Returns the symbols set in the given packed bitset. Given an index
+           name instead, returns that index's symbols in definition order.
+        """
+        if isinstance(bitsetOrName, str):
+            if bitsetOrName not in self.members:
+                raise Exception("Unable to locate index '%s'" % bitsetOrName)
+            return [self.symbols[i] for i in self.members[bitsetOrName]]
+        bits = numpy.unpackbits(bitsetOrName)[:len(self.symbols)]
+        return [self.symbols[i] for i in numpy.flatnonzero(bits)]
+
+def getRegistry():
+    """Returns the shared IndexRegistry for the package's index definitions,
+       loading it on first use
+    """
+    global REGISTRY
+    if REGISTRY is None:
+        REGISTRY = IndexRegistry()
+    return REGISTRY
+
+def getSymbols(index):
+    """Returns the list of symbols in the given index, in definition order
+    """
+    return getRegistry().getSymbols(index)
@@ -0,0 +1,373 @@
+"""Positions across datastore snapshots: marking to market, realized and
+   unrealized P&L history, and write-back of "positions.xlsx".
+
+   Prices are looked up through a SymbolIndex, a persistent map (under
+   "cache/positions/") of each snapshot's symbols to their sector code, row,
+   and "Security Price". Index entries are keyed by the (modification time,
+   size) stamps of that snapshot's sector spreadsheets, so sector workbooks
+   are only parsed for new or changed snapshots; marking positions to market
+   over the full history otherwise touches only the small positions tables:
+
+   >>> history = markToMarket()
+   >>> history["unrealized"][-1], history["realized"][-1]
+
+   A position "lot" is identified by its symbol and acquisition date. A lot
+   is held in every snapshot whose positions table lists it (and, for tables
+   with an "is_open" column, marks it open). A lot that stops being held is
+   realized at the price of the first snapshot in which it no longer appears.
+"""
+
+import os
+import sys
+import json
+import argparse
+import datetime
+import numpy
+import quant_local
+from quant_local import profiling, query, risk
+
+INDEX_PATH = quant_local.PACK_PATH + "/cache/positions"
+POSITIONS_FILE = "positions.xlsx"
+POSITIONS_SHEET = "positions"
+PRICE_PROPERTY = "Security Price"
+
+def getSectorStamps(datePath, codes=None):
+    """Returns a dictionary mapping each sector spreadsheet file name in the
+       given snapshot folder to its [modification time, size] stamp. Sector
+       codes are read from the Sectors table unless given (see
+       *quant_local.getSectorPaths()*).
+    """
+    stamps = {}
+    for sectorPath in quant_local.getSectorPaths(datePath, codes):
+        _, fileName = os.path.split(sectorPath)
+        stat = os.stat(sectorPath)
+        stamps[fileName] = [stat.st_mtime, stat.st_size]
+    return stamps
+
+def toDate(value):
+    """Converts a cell value (datetime or "YYYYMMDD" string) to a date
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(str(value), "%Y%m%d").date()
+
+class SymbolIndex(object):
+    """Persistent symbol -> (sector code, row, price) map for every snapshot
+       date in the datastore
+    """
+
+    def __init__(self, indexPath=INDEX_PATH):
+        """Loads any previously-persisted index entries from the given folder.
+           Call *update()* to bring entries up to date with the datastore.
+        """
+        self.indexPath = indexPath
+        self.entries = {}
+        self.lookups = {}
+        path = self.getPath()
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def getPath(self):
+        """Returns the path of the persisted index file
+        """
+        return os.path.abspath(self.indexPath + "/index.json")
+
+    def getDates(self):
+        """Returns the (sorted) list of indexed snapshot dates
+        """
+        return sorted(self.entries.keys())
+
+    @profiling.timed("SymbolIndex.update")
+    def update(self, datePaths=None, sectors=None):
+        """Re-indexes any of the given snapshots (all datastore snapshots by
+           default) whose sector spreadsheets have changed, dropping entries
+           for snapshots that no longer exist, and persists the result if
+           anything changed. Already-loaded Sector objects may be given as a
+           dictionary of "YYYYMMDD" dates to lists, to avoid re-parsing those
+           snapshots. Returns the number of snapshots re-indexed.
+        """
+        if datePaths is None:
+            datePaths = quant_local.getDatePaths()
+        sectors = {} if sectors is None else sectors
+        codes = quant_local.getSectorCodes()
+        dates = []
+        nIndexed = 0
+        for datePath in datePaths:
+            _, date = os.path.split(datePath)
+            dates.append(date)
+            stamps = getSectorStamps(datePath, codes)
+            if date in self.entries and self.entries[date]["stamps"] == stamps:
+                continue
+            loaded = sectors[date] if date in sectors else [quant_local.Sector(p) for p in sorted(quant_local.getSectorPaths(datePath, codes))]
+            self.entries[date] = self.getEntry(stamps, loaded)
+            self.lookups.pop(date, None)
+            nIndexed += 1
+        stale = [date for date in self.entries if date not in dates]
+        for date in stale:
+            del self.entries[date]
+            self.lookups.pop(date, None)
+        if 0 < nIndexed or 0 < len(stale):
+            self.save()
+        return nIndexed
+
+    def getEntry(self, stamps, sectors):
+        """Returns the index entry for one snapshot, given the stamps and
+           loaded Sector objects of that snapshot. Entries are stored as
+           parallel lists (one element per symbol) of symbols, sector numbers
+           (into the list of sector codes), rows, and prices (None where the
+           price is not numeric).
+        """
+        entry = {"stamps": stamps, "codes": [], "symbols": [], "sectors": [], "rows": [], "prices": []}
+        for sector in sectors:
+            entry["codes"].append(sector.getCode())
+            sectorNumber = len(entry["codes"]) - 1
+            prices = sector.table.getColumn(PRICE_PROPERTY) if PRICE_PROPERTY in sector.table.index else [None] * len(sector.table)
+            for row, symbol in enumerate(sector.table.getColumn("Symbol")):
+                if sector.rowIndex.get(symbol, None) != row:
+                    continue
+                price = query.toNumber(prices[row])
+                entry["symbols"].append(symbol)
+                entry["sectors"].append(sectorNumber)
+                entry["rows"].append(row)
+                entry["prices"].append(None if price != price else price)
+        return entry
+
+    def save(self):
+        """Atomically writes the index
+        """
+        os.makedirs(self.indexPath, exist_ok=True)
+        path = self.getPath()
+        with open(path + ".tmp", 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(path + ".tmp", path)
+
+    def getLookup(self, date):
+        """Returns (building and caching, if needed) a dictionary mapping
+           symbols to their position in the given date's entry lists
+        """
+        if date not in self.lookups:
+            self.lookups[date] = dict([(symbol, i) for i, symbol in enumerate(self.entries[date]["symbols"])])
+        return self.lookups[date]
+
+    def locate(self, date, symbol):
+        """Returns the (sector code, row) of the given symbol in the given
+           snapshot, or None if the symbol is not listed in that snapshot
+        """
+        if date not in self.entries:
+            raise Exception("Snapshot %s is not indexed" % date)
+        i = self.getLookup(date).get(symbol, None)
+        if i is None:
+            return None
+        entry = self.entries[date]
+        return entry["codes"][entry["sectors"][i]], entry["rows"][i]
+
+    def getPrices(self, symbols, dates=None):
+        """Returns a (date x symbol) float numpy array of prices for the given
+           symbols over the given dates (all indexed dates by default), with
+           NaN where a symbol is not listed (or has no numeric price)
+        """
+        dates = self.getDates() if dates is None else dates
+        prices = numpy.full((len(dates), len(symbols)), numpy.nan)
+        for i, date in enumerate(dates):
+            lookup = self.getLookup(date)
+            entryPrices = self.entries[date]["prices"]
+            for j, symbol in enumerate(symbols):
+                k = lookup.get(symbol, None)
+                if k is not None and entryPrices[k] is not None:
+                    prices[i, j] = entryPrices[k]
+        return prices
+
+def getSymbolIndex(indexPath=INDEX_PATH, sectors=None):
+    """Returns a SymbolIndex, updated against the current datastore
+    """
+    symbolIndex = SymbolIndex(indexPath)
+    symbolIndex.update(sectors=sectors)
+    return symbolIndex
+
+def readPositions(datePath):
+    """Returns the positions Table of the given snapshot
+    """
+    return quant_local.readXlsxTable(os.path.abspath(datePath + "/%s" % POSITIONS_FILE))
+
+def getLots(datePaths):
+    """Reads the positions table of each given snapshot. Returns the list of
+       distinct lots (dictionaries of "symbol", "acquired", "shares", and
+       "original_price", as first listed) and two (date x lot) arrays: a
+       boolean mask of which lots are held in each snapshot, and the
+       "latest_price" recorded for each held lot (NaN elsewhere).
+    """
+    lots = []
+    lotIds = {}
+    listings = []
+    for datePath in datePaths:
+        listed = []
+        for position in readPositions(datePath):
+            if position.get("is_open", True) is False:
+                continue
+            key = (position["symbol"], toDate(position["acquired"]))
+            if key not in lotIds:
+                lotIds[key] = len(lots)
+                lots.append({"symbol": key[0], "acquired": key[1], "shares": float(position["shares"]), "original_price": float(position["original_price"])})
+            listed.append((lotIds[key], query.toNumber(position.get("latest_price", None))))
+        listings.append(listed)
+    held = numpy.zeros((len(datePaths), len(lots)), dtype=bool)
+    listedPrices = numpy.full((len(datePaths), len(lots)), numpy.nan)
+    for i, listed in enumerate(listings):
+        for lotId, price in listed:
+            held[i, lotId] = True
+            listedPrices[i, lotId] = price
+    return lots, held, listedPrices
+
+@profiling.timed("markToMarket")
+def markToMarket(symbolIndex=None, datePaths=None):
+    """Marks every position lot to market in every snapshot, in one pass over
+       (date x lot) arrays. Returns a dictionary with the snapshot "dates",
+       the "lots" list, (date x lot) "prices" and "held" arrays, and per-date
+       series of market "value", "cost" basis, "unrealized" P&L, cumulative
+       "realized" P&L, and "total" P&L.
+
+       Lots are priced from the snapshot's sector spreadsheets (through the
+       SymbolIndex), falling back to the positions table's "latest_price" and
+       then to the last known price when a symbol is not listed.
+    """
+    if datePaths is None:
+        datePaths = quant_local.getDatePaths()
+    if symbolIndex is None:
+        symbolIndex = getSymbolIndex()
+    dates = [os.path.split(datePath)[1] for datePath in datePaths]
+    lots, held, listedPrices = getLots(datePaths)
+    symbols = [lot["symbol"] for lot in lots]
+    shares = numpy.array([lot["shares"] for lot in lots])
+    basis = numpy.array([lot["original_price"] for lot in lots])
+    prices = symbolIndex.getPrices(symbols, dates)
+    prices = numpy.where(numpy.isnan(prices), listedPrices, prices)
+    prices = risk.forwardFill(prices)
+    prices = numpy.where(numpy.isnan(prices), basis[None, :], prices)
+    gains = (prices - basis[None, :]) * shares[None, :]
+    closed = numpy.zeros_like(held)
+    closed[1:, :] = held[:-1, :] & ~held[1:, :]
+    unrealized = numpy.where(held, gains, 0.0).sum(axis=1)
+    realized = numpy.cumsum(numpy.where(closed, gains, 0.0).sum(axis=1))
+    return {
+        "dates": dates,
+        "lots": lots,
+        "prices": prices,
+        "held": held,
+        "value": numpy.where(held, prices * shares[None, :], 0.0).sum(axis=1),
+        "cost": numpy.where(held, basis * shares, 0.0).sum(axis=1),
+        "unrealized": unrealized,
+        "realized": realized,
+        "total": unrealized + realized,
+    }
+
+def readLayout(xlsxPath):
+    """Returns the layout of an existing positions spreadsheet: its sheet
+       "title", the per-column "headerFormats" and "rowFormats" (number
+       formats of the header and first data row), column "widths" by letter,
+       and "freezePanes"
+    """
+    import openpyxl
+    ws = openpyxl.open(xlsxPath).worksheets[0]
+    rows = list(ws.iter_rows(min_row=1, max_row=2))
+    header = rows[0] if rows else []
+    row = rows[1] if 1 < len(rows) else header
+    return {
+        "title": ws.title,
+        "headerFormats": [cell.number_format for cell in header],
+        "rowFormats": [cell.number_format for cell in row],
+        "widths": dict((letter, dimension.width) for letter, dimension in ws.column_dimensions.items() if dimension.customWidth),
+        "freezePanes": ws.freeze_panes,
+    }
+
+def getCells(ws, values, formats):
+    """Returns write-only cells of the given values, with the given number
+       formats (by column; missing or "General" formats are left unset)
+    """
+    import openpyxl.cell
+    cells = []
+    for j, value in enumerate(values):
+        cell = openpyxl.cell.WriteOnlyCell(ws, value=value)
+        if j < len(formats) and formats[j] != "General":
+            cell.number_format = formats[j]
+        cells.append(cell)
+    return cells
+
+@profiling.timed("writePositions")
+def writePositions(xlsxPath, header, positions, layout=None):
+    """Atomically (re)writes a positions spreadsheet with the given header,
+       using openpyxl's streaming write-only mode. Each position (any
+       mapping) is written as one row of its values for the header keys;
+       other keys are ignored. Formula strings (like "=(F2-E2)/E2") are kept
+       as formulas. Number formats, column widths, and frozen panes are
+       carried over from the given layout (see *readLayout()*), which
+       defaults to that of the existing file, so that hand-kept currency,
+       date, and day-count formats survive the rewrite.
+    """
+    import openpyxl
+    if layout is None and os.path.isfile(xlsxPath):
+        layout = readLayout(xlsxPath)
+    if layout is None:
+        layout = {"title": POSITIONS_SHEET, "headerFormats": [], "rowFormats": [], "widths": {}, "freezePanes": None}
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(layout["title"])
+    for letter, width in layout["widths"].items():
+        ws.column_dimensions[letter].width = width
+    if layout["freezePanes"] is not None:
+        ws.freeze_panes = layout["freezePanes"]
+    ws.append(getCells(ws, list(header), layout["headerFormats"]))
+    for position in positions:
+        ws.append(getCells(ws, [position.get(key, None) for key in header], layout["rowFormats"]))
+    tmpPath = xlsxPath + ".tmp"
+    wb.save(tmpPath)
+    os.replace(tmpPath, xlsxPath)
+
+def updatePositions(positions, datePath=None, symbolIndex=None):
+    """Sets the "latest_price" (and "as_of" date) of the given positions from
+       the given snapshot (the most recent by default), and writes them back
+       to that snapshot's positions.xlsx file. Positions not listed in the
+       snapshot keep their previous price. Returns the positions.
+    """
+    if datePath is None:
+        datePath = quant_local.getDatePaths()[-1]
+    if symbolIndex is None:
+        symbolIndex = getSymbolIndex()
+    _, date = os.path.split(datePath)
+    xlsxPath = os.path.abspath(datePath + "/%s" % POSITIONS_FILE)
+    header = quant_local.readXlsxTable(xlsxPath).header
+    prices = symbolIndex.getPrices([position["symbol"] for position in positions], [date])[0]
+    asOf = datetime.datetime.combine(toDate(date), datetime.time())
+    for position, price in zip(positions, prices):
+        if price == price:
+            position["latest_price"] = float(price)
+            position["as_of"] = asOf
+    writePositions(xlsxPath, header, positions)
+    return positions
+
+def printHistory(history, stream=None):
+    """Writes a table of the per-date P&L series to the given stream (STDOUT
+       by default)
+    """
+    stream = sys.stdout if stream is None else stream
+    stream.write("%-10s %6s %14s %14s %14s %14s %14s\n" % ("date", "lots", "value", "cost", "unrealized", "realized", "total"))
+    for i, date in enumerate(history["dates"]):
+        stream.write("%-10s %6u %14.2f %14.2f %14.2f %14.2f %14.2f\n" % (date, history["held"][i].sum(),
+            history["value"][i], history["cost"][i], history["unrealized"][i], history["realized"][i], history["total"][i]))
+
+def main():
+    """Prints the P&L history of all positions and, with "--write", updates
+       the most recent positions.xlsx with latest prices
+    """
+    parser = argparse.ArgumentParser(description="Mark positions to market across datastore snapshots")
+    parser.add_argument("--write", action="store_true", help="Write latest prices back to the most recent positions.xlsx")
+    args = parser.parse_args()
+    symbolIndex = getSymbolIndex()
+    printHistory(markToMarket(symbolIndex))
+    if args.write:
+        datePath = quant_local.getDatePaths()[-1]
+        updatePositions([dict(position) for position in readPositions(datePath)], datePath, symbolIndex)
+
+if __name__ == "__main__":
+    main()
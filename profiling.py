@@ -0,0 +1,257 @@
+"""Opt-in instrumentation for quant_local pipelines. When enabled, decorated
+   functions and instrumented blocks record wall time, call counts, and bytes
+   read under a stage name, and warnings routed through *warn()* are
+   aggregated into counters instead of being emitted one by one. At the end
+   of a run a summary table is printed to STDERR and (optionally) a Chrome
+   trace JSON file is written, which can be opened in "chrome://tracing" or
+   Perfetto.
+
+   Instrumentation is enabled by setting the QUANT_LOCAL_PROFILE environment
+   variable ("1" for a summary only, or a path to also write a Chrome trace
+   to), or by calling *enable()*. When disabled, instrumented functions are
+   called directly with only a single global check of overhead.
+"""
+
+import os
+import sys
+import time
+import atexit
+import warnings
+import functools
+import threading
+import contextlib
+
+ENV_VAR = "QUANT_LOCAL_PROFILE"
+PROFILER = None
+REPORT_AT_EXIT = False
+
+class Profiler(object):
+    """Accumulates per-stage statistics, warning counters, and (for traced
+       stages) individual trace events. Updates are guarded by a lock so that
+       stages may be recorded from worker threads.
+    """
+
+    def __init__(self, tracePath=None):
+        """A trace path may be given, to which a Chrome trace JSON file will
+           be written by *report()*
+        """
+        self.tracePath = tracePath
+        self.t0 = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+
+    def getStage(self, name):
+        """Returns (creating if needed) the statistics dictionary for the
+           given stage name. Callers must hold the lock.
+        """
+        if name not in self.stages:
+            self.stages[name] = {"calls": 0, "seconds": 0.0, "bytes": 0}
+        return self.stages[name]
+
+    def record(self, name, t0, t1, trace=True):
+        """Records one call of the given stage, which started and ended at
+           the given *time.perf_counter()* values
+        """
+        with self.lock:
+            stage = self.getStage(name)
+            stage["calls"] += 1
+            stage["seconds"] += t1 - t0
+            if trace:
+                self.events.append((name, t0, t1, threading.get_ident()))
+
+    def addBytes(self, name, nBytes):
+        """Adds to the number of bytes read under the given stage
+        """
+        with self.lock:
+            self.getStage(name)["bytes"] += nBytes
+
+    def count(self, counter, n=1):
+        """Increments the given (warning) counter
+        """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def getSummary(self):
+        """Returns a dictionary of stage statistics and counters, suitable for
+           JSON serialization
+        """
+        with self.lock:
+            return {
+                "seconds": time.perf_counter() - self.t0,
+                "stages": dict([(name, dict(stage)) for name, stage in self.stages.items()]),
+                "counters": dict(self.counters),
+            }
+
+    def getChromeTrace(self):
+        """Returns trace events in the Chrome "Trace Event Format" (complete
+           events, with microsecond timestamps relative to enabling)
+        """
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        traceEvents = []
+        for name, t0, t1, tid in events:
+            traceEvents.append({"name": name, "ph": "X", "pid": pid, "tid": tid, "ts": (t0 - self.t0) * 1e6, "dur": (t1 - t0) * 1e6})
+        if 0 < len(counters):
+            ts = (time.perf_counter() - self.t0) * 1e6
+            traceEvents.append({"name": "warnings", "ph": "C", "pid": pid, "tid": 0, "ts": ts, "args": counters})
+        return {"traceEvents": traceEvents, "displayTimeUnit": "ms"}
+
+    def report(self, stream=None):
+        """Writes a summary table to the given stream (STDERR by default),
+           and the Chrome trace to the trace path (if one was given)
+        """
+        stream = sys.stderr if stream is None else stream
+        summary = self.getSummary()
+        stream.write("quant_local profile (%.3f s total)\n" % summary["seconds"])
+        stream.write("%-48s %8s %12s %12s %14s\n" % ("stage", "calls", "total [s]", "mean [ms]", "bytes read"))
+        ordered = sorted(summary["stages"].items(), key=lambda item: -item[1]["seconds"])
+        for name, stage in ordered:
+            mean = 1e3 * stage["seconds"] / stage["calls"] if 0 < stage["calls"] else 0.0
+            stream.write("%-48s %8u %12.4f %12.4f %14u\n" % (name, stage["calls"], stage["seconds"], mean, stage["bytes"]))
+        if 0 < len(summary["counters"]):
+            stream.write("%-48s %8s\n" % ("warning", "count"))
+            for counter, n in sorted(summary["counters"].items(), key=lambda item: -item[1]):
+                stream.write("%-48s %8u\n" % (counter, n))
+        if self.tracePath is not None:
+            import json
+            with open(self.tracePath, 'w') as f:
+                json.dump(self.getChromeTrace(), f)
+            stream.write("Chrome trace written to %s\n" % self.tracePath)
+
+class InstrumentedClient(object):
+    """Proxy around a network client (like an Alpaca REST object) that times
+       each method call as a stage named "<prefix>.<method>"
+    """
+
+    def __init__(self, client, prefix):
+        """Wraps the given client object
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        """Returns the named attribute of the wrapped client; callables are
+           wrapped in a timed stage
+        """
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+        return timed("%s.%s" % (self.prefix, name))(attr)
+
+def enable(tracePath=None, atExit=True):
+    """Enables instrumentation (resetting any previously-recorded statistics)
+       and returns the active Profiler. Unless *atExit* is False, a report is
+       written when the interpreter exits.
+    """
+    global PROFILER, REPORT_AT_EXIT
+    PROFILER = Profiler(tracePath)
+    REPORT_AT_EXIT = atExit
+    return PROFILER
+
+def disable():
+    """Disables instrumentation, discarding recorded statistics
+    """
+    global PROFILER
+    PROFILER = None
+
+def isEnabled():
+    """Returns True if instrumentation is currently enabled
+    """
+    return PROFILER is not None
+
+def timed(name, trace=True):
+    """Decorator that records each call of the decorated function under the
+       given stage name. Set *trace* to False for hot functions (called many
+       times per run), which are then aggregated but not individually traced.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = PROFILER
+            if profiler is None:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, t0, time.perf_counter(), trace)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def stage(name, nBytes=0):
+    """Context manager that records the enclosed block as one call of the
+       given stage, optionally with a number of bytes read
+    """
+    profiler = PROFILER
+    if profiler is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.record(name, t0, time.perf_counter())
+        if 0 < nBytes:
+            profiler.addBytes(name, nBytes)
+
+def addBytes(name, nBytes):
+    """Adds to the number of bytes read under the given stage (if enabled)
+    """
+    if PROFILER is not None:
+        PROFILER.addBytes(name, nBytes)
+
+def addFileBytes(name, path):
+    """Adds the size of the given file to the bytes read under the given
+       stage (if enabled)
+    """
+    if PROFILER is not None:
+        PROFILER.addBytes(name, os.path.getsize(path))
+
+def warn(message, counter):
+    """Issues a warning. When instrumentation is enabled, the warning is
+       instead aggregated under the given counter name (and reported in the
+       summary), rather than emitted per event.
+    """
+    if PROFILER is not None:
+        PROFILER.count(counter)
+    else:
+        warnings.warn(message, stacklevel=2)
+
+def instrumentClient(client, prefix):
+    """Returns the given network client wrapped in an InstrumentedClient (if
+       instrumentation is enabled), or the client itself otherwise
+    """
+    if PROFILER is None:
+        return client
+    return InstrumentedClient(client, prefix)
+
+def report(stream=None):
+    """Writes the summary (and Chrome trace, if configured) for the active
+       Profiler, if any
+    """
+    if PROFILER is not None:
+        PROFILER.report(stream)
+
+def reportAtExit():
+    """Registered with *atexit*; reports only if requested by *enable()*
+    """
+    if REPORT_AT_EXIT:
+        report()
+
+def enableFromEnvironment():
+    """Enables instrumentation if the QUANT_LOCAL_PROFILE environment variable
+       is set (to anything other than "" or "0"). Values other than "1" or
+       "summary" are treated as the Chrome trace output path.
+    """
+    value = os.environ.get(ENV_VAR, "")
+    if value in ["", "0"]:
+        return
+    enable(None if value in ["1", "summary"] else value)
+
+atexit.register(reportAtExit)
+enableFromEnvironment()
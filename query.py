@@ -0,0 +1,545 @@
+"""Screening/query engine over datastore snapshots. Queries are built from
+   projections (the properties to return) and predicates, which use the same
+   comparators as the papa_moo Filter class ("<", "<=", "==", "!=", ">=",
+   ">") and may be combined with *And()* and *Or()*. For example:
+
+   >>> catalog = Catalog()
+   >>> where = And(Where("Security Price", ">", 10), Or(
+   ...     Where("Sector", "==", "Energy"),
+   ...     Where("Market Capitalization", ">=", 1e10)))
+   >>> result = catalog.select(["Symbol", "Security Price"], where)
+
+   Predicates are evaluated as vectorized masks over the (columnar) sector
+   tables, touching only the columns they reference. Per-column statistics
+   (numeric min/max, and the distinct values of string columns) are kept for
+   each loaded sector, so sectors that cannot contain a match are skipped
+   without evaluating any rows. Loaded sectors, converted columns, and
+   statistics are cached by the Catalog, so repeated screens (over the latest
+   snapshot or the full history) run against memory. A Catalog may be shared
+   across threads: its lock guards only cache lookups and updates, so
+   sectors are parsed and queries evaluated without holding it.
+
+   Like Filter, cells that cannot be compared with a predicate's value (blank
+   or "--" cells in a numeric comparison, for instance) never match; dollar
+   strings (like "$1.2B") are converted to numeric values, and other numeric
+   strings (like "1.5") only when the predicate's value is a float. Numeric
+   equality also follows Filter, holding when a cell is within 0.1% of the
+   value (strictly). Where Filter fails outright, predicates differ:
+
+   * "== 0" matches cells exactly equal to zero (and "!= 0" any other
+     numeric cell), where Filter divides by zero and matches nothing
+   * negative values use the same tolerance as positive ones, where Filter's
+     (negative) relative difference makes "==" match every numeric cell
+   * int values compare numerically with float cells under "==" and "!=",
+     where Filter requires both sides to be of the same type
+"""
+
+import os
+import weakref
+import threading
+import numpy
+import quant_local
+
+COMPARATORS = ["<", "<=", "==", "!=", ">=", ">"]
+NUM_REL_TOL = 1e-3 # within 0.1%, like Filter
+
+def isNumber(value):
+    """Returns True for (non-boolean) int and float values
+    """
+    return type(value) in [type(0), type(0.0)]
+
+def isNear(lhs, value):
+    """Returns a mask of the given (float array) cells that equal the given
+       numeric value within NUM_REL_TOL of its magnitude, like Filter
+       (exactly, for a value of zero)
+    """
+    with numpy.errstate(invalid="ignore"):
+        if value == 0:
+            return lhs == 0
+        return numpy.abs(value - lhs) < NUM_REL_TOL * abs(value)
+
+class Predicate(object):
+    """Base class for query predicates. Predicates report the columns they
+       reference, evaluate to a boolean row mask for a given table, and report
+       whether a table's column statistics rule out any match.
+    """
+
+    def getColumns(self):
+        """Returns the set of properties (column keys) referenced
+        """
+        raise NotImplementedError()
+
+    def evaluate(self, catalog, table):
+        """Returns a boolean numpy array (one element per table row)
+        """
+        raise NotImplementedError()
+
+    def canSkip(self, catalog, table):
+        """Returns True if column statistics prove no row can match
+        """
+        raise NotImplementedError()
+
+class Where(Predicate):
+    """Compares a single property against a value, using Filter semantics:
+       numeric values are compared numerically (equality within a relative
+       tolerance), and string values are compared case-insensitively (only
+       "==" and "!=" are supported for strings).
+    """
+
+    def __init__(self, prop, comparator, value):
+        """Constructed like a Filter, from a property, comparator, and value
+        """
+        if comparator not in COMPARATORS:
+            raise Exception("Invalid comparator '%s'" % comparator)
+        if not isNumber(value) and comparator not in ["==", "!="]:
+            raise Exception("Comparator '%s' requires a numeric value" % comparator)
+        self.property = prop
+        self.comparator = comparator
+        self.value = value
+
+    def __repr__(self):
+        """Represented as "Where(property comparator value)"
+        """
+        return "Where(%s %s %s)" % (self.property, self.comparator, repr(self.value))
+
+    def getColumns(self):
+        """Returns the lone property compared by this predicate
+        """
+        return set([self.property])
+
+    def evaluate(self, catalog, table):
+        """Returns a mask of rows satisfying this comparison. Rows with cells
+           of the wrong type (or missing columns) never match.
+        """
+        if self.property not in table.index:
+            return numpy.zeros(len(table), dtype=bool)
+        if isNumber(self.value):
+            lhs = catalog.getNumeric(table, self.property, type(self.value) is type(0.0))
+            valid = ~numpy.isnan(lhs)
+            with numpy.errstate(invalid="ignore"):
+                if self.comparator == "<":
+                    return lhs < self.value
+                elif self.comparator == "<=":
+                    return lhs <= self.value
+                elif self.comparator == ">=":
+                    return lhs >= self.value
+                elif self.comparator == ">":
+                    return lhs > self.value
+            isEqual = isNear(lhs, self.value)
+            if self.comparator == "==":
+                return isEqual
+            return valid & ~isEqual
+        lhs = catalog.getStrings(table, self.property)
+        rhs = toComparable(self.value)
+        isEqual = lhs == rhs
+        if self.comparator == "==":
+            return isEqual
+        return ~isEqual & (lhs != None)
+
+    def canSkip(self, catalog, table):
+        """Uses min/max statistics (numeric values) or distinct-value sets
+           (string values) to rule out the given table
+        """
+        if self.property not in table.index:
+            return True
+        stats = catalog.getStatistics(table, self.property)
+        if isNumber(self.value):
+            lo, hi, value = stats["min"], stats["max"], self.value
+            if lo is None:
+                return True
+            tol = NUM_REL_TOL * abs(value)
+            if self.comparator == "<":
+                return value <= lo
+            elif self.comparator == "<=":
+                return value < lo
+            elif self.comparator == ">=":
+                return hi < value
+            elif self.comparator == ">":
+                return hi <= value
+            elif self.comparator == "==":
+                return value < lo - tol or hi + tol < value
+            return lo == hi and bool(isNear(numpy.float64(lo), value))
+        values = stats["values"]
+        rhs = toComparable(self.value)
+        if self.comparator == "==":
+            return rhs not in values
+        return len(values) == 0 or values == set([rhs])
+
+class And(Predicate):
+    """Satisfied only if all child predicates are satisfied
+    """
+
+    def __init__(self, *predicates):
+        """Joins any number of child predicates
+        """
+        self.predicates = list(predicates)
+
+    def __repr__(self):
+        """Represented as "And(...)"
+        """
+        return "And(%s)" % ", ".join([repr(p) for p in self.predicates])
+
+    def getColumns(self):
+        """Returns the union of columns referenced by child predicates
+        """
+        return set().union(*[p.getColumns() for p in self.predicates])
+
+    def evaluate(self, catalog, table):
+        """Evaluates child predicates in turn, stopping early once no rows
+           remain
+        """
+        mask = numpy.ones(len(table), dtype=bool)
+        for predicate in self.predicates:
+            mask &= predicate.evaluate(catalog, table)
+            if not mask.any():
+                break
+        return mask
+
+    def canSkip(self, catalog, table):
+        """A conjunction is ruled out if any child predicate is
+        """
+        return any([p.canSkip(catalog, table) for p in self.predicates])
+
+class Or(Predicate):
+    """Satisfied if any child predicate is satisfied
+    """
+
+    def __init__(self, *predicates):
+        """Joins any number of child predicates
+        """
+        self.predicates = list(predicates)
+
+    def __repr__(self):
+        """Represented as "Or(...)"
+        """
+        return "Or(%s)" % ", ".join([repr(p) for p in self.predicates])
+
+    def getColumns(self):
+        """Returns the union of columns referenced by child predicates
+        """
+        return set().union(*[p.getColumns() for p in self.predicates])
+
+    def evaluate(self, catalog, table):
+        """Evaluates child predicates (skipping any ruled out by statistics)
+        """
+        mask = numpy.zeros(len(table), dtype=bool)
+        for predicate in self.predicates:
+            if not predicate.canSkip(catalog, table):
+                mask |= predicate.evaluate(catalog, table)
+        return mask
+
+    def canSkip(self, catalog, table):
+        """A disjunction is ruled out only if every child predicate is
+        """
+        return all([p.canSkip(catalog, table) for p in self.predicates])
+
+class InIndex(Predicate):
+    """Tests the "Symbol" column for membership in an index (like "sp500"),
+       using the shared IndexRegistry bitsets. The "==" comparator matches
+       members, and "!=" matches non-members.
+    """
+
+    def __init__(self, name, comparator="=="):
+        """Constructed from an index name and (optional) comparator
+        """
+        if comparator not in ["==", "!="]:
+            raise Exception("Invalid index comparator '%s'" % comparator)
+        self.name = name
+        self.comparator = comparator
+
+    def __repr__(self):
+        """Represented as "InIndex(comparator name)"
+        """
+        return "InIndex(%s %s)" % (self.comparator, self.name)
+
+    def getColumns(self):
+        """Returns the "Symbol" column, against which membership is tested
+        """
+        return set(["Symbol"])
+
+    def evaluate(self, catalog, table):
+        """Returns a mask of rows whose symbols satisfy this predicate
+        """
+        view = catalog.getView(table, "Symbol")
+        key = "index:%s" % self.name
+        if key not in view:
+            from quant_local import indices
+            view[key] = indices.getRegistry().isMember(self.name, table.getColumn("Symbol"))
+        return view[key] if self.comparator == "==" else ~view[key]
+
+    def canSkip(self, catalog, table):
+        """Rules out tables in which no symbol satisfies this predicate
+        """
+        return not self.evaluate(catalog, table).any()
+
+def fromFilters(filters):
+    """Returns an And predicate equivalent to the given list of Filter objects
+       (or any objects with "property", "comparator", and "value" attributes),
+       such as those returned by *papa_moo.getFiltersBuy()*. Filters on the
+       "Index" property become InIndex predicates.
+    """
+    predicates = []
+    for f in filters:
+        if f.property == "Index":
+            predicates.append(InIndex(f.value, f.comparator))
+        else:
+            predicates.append(Where(f.property, f.comparator, f.value))
+    return And(*predicates)
+
+def fromSpec(spec):
+    """Returns a predicate from a JSON-compatible specification, where
+       [property, comparator, value] lists are Where predicates,
+       {"and": [...]} and {"or": [...]} dictionaries join nested
+       specifications, and {"index": name, "comparator": "=="} dictionaries
+       are InIndex predicates
+    """
+    if isinstance(spec, list) and len(spec) == 3:
+        return Where(spec[0], spec[1], spec[2])
+    if isinstance(spec, dict) and "and" in spec:
+        return And(*[fromSpec(child) for child in spec["and"]])
+    if isinstance(spec, dict) and "or" in spec:
+        return Or(*[fromSpec(child) for child in spec["or"]])
+    if isinstance(spec, dict) and "index" in spec:
+        return InIndex(spec["index"], spec.get("comparator", "=="))
+    raise Exception("Invalid predicate specification %s" % repr(spec))
+
+class Catalog(object):
+    """Lazily loads and caches sector tables across the datastore snapshots,
+       along with numeric/string views of (only) the columns that queries
+       touch and per-column statistics.
+    """
+
+    def __init__(self, datastorePath=None):
+        """Defaults to the package datastore (*quant_local.DATASTORE_PATH*)
+        """
+        self.datastorePath = quant_local.DATASTORE_PATH if datastorePath is None else datastorePath
+        self.sectorCodes = None
+        self.sectors = {}
+        self.views = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def getDates(self):
+        """Returns the (sorted) list of snapshot dates, as "YYYYMMDD" strings
+        """
+        return sorted([name for name in os.listdir(self.datastorePath) if len(name) == 8 and name.isdigit()])
+
+    def getSectorCodes(self):
+        """Returns (reading and caching, if needed) the sector codes listed in
+           the "sectors.xlsx" table of this datastore's most recent snapshot
+        """
+        if self.sectorCodes is None:
+            xlsxPath = os.path.abspath(self.datastorePath + "/%s/sectors.xlsx" % self.getDates()[-1])
+            self.sectorCodes = [sector["Code"] for sector in quant_local.readXlsxDicts(xlsxPath)]
+        return self.sectorCodes
+
+    def getSectorPaths(self, date, codes=None):
+        """Returns a dictionary of sector codes to the absolute paths of the
+           sector spreadsheets in the given snapshot, optionally restricted to
+           the given codes
+        """
+        wanted = set(self.getSectorCodes() if codes is None else codes) & set(self.getSectorCodes())
+        datePath = os.path.abspath(self.datastorePath + "/%s" % date)
+        paths = {}
+        for fileName in os.listdir(datePath):
+            code, ext = os.path.splitext(fileName)
+            if ext == ".xls" and code in wanted:
+                paths[code] = os.path.abspath(datePath + "/%s" % fileName)
+        return paths
+
+    def getSectors(self, date, codes=None):
+        """Returns (loading and caching, if needed) the Sector objects for the
+           given snapshot date, in code order. If codes are given, only those
+           sectors are loaded; sectors are cached by (date, code).
+        """
+        sectors = []
+        for code, sectorPath in sorted(self.getSectorPaths(date, codes).items()):
+            with self.lock:
+                sector = self.sectors.get((date, code), None)
+            if sector is None:
+                sector = quant_local.Sector(sectorPath) # parsed without holding the lock
+                with self.lock:
+                    sector = self.sectors.setdefault((date, code), sector)
+            sectors.append(sector)
+        return sectors
+
+    def setSectors(self, date, sectors):
+        """Seeds the cache with already-loaded Sector objects for the given
+           snapshot date (replacing any cached for that date)
+        """
+        with self.lock:
+            self.dropSectors(date)
+            for sector in sectors:
+                self.sectors[(date, sector.getCode())] = sector
+
+    def invalidate(self, date=None):
+        """Drops cached sectors for the given date (or all dates, along with
+           the sector codes)
+        """
+        with self.lock:
+            if date is None:
+                self.sectorCodes = None
+                self.sectors = {}
+            else:
+                self.dropSectors(date)
+
+    def dropSectors(self, date):
+        """Drops cached sectors for the given date (the lock must be held)
+        """
+        for key in [key for key in self.sectors if key[0] == date]:
+            del self.sectors[key]
+
+    def getView(self, table, key):
+        """Returns the cache dictionary for converted views of the given
+           table column
+        """
+        with self.lock:
+            views = self.views.setdefault(table, {})
+            return views.setdefault(key, {})
+
+    def getNumeric(self, table, key, parseStrings=True):
+        """Returns a float numpy array view of the given column, with NaN for
+           values that are not numeric (dollar strings are converted, and
+           other numeric strings too if *parseStrings* is True; see
+           *toNumber()*)
+        """
+        view = self.getView(table, key)
+        name = "numeric" if parseStrings else "numeric cells"
+        if name not in view:
+            column = table.getColumn(key)
+            if isinstance(column, quant_local.NumericColumn):
+                numeric = numpy.frombuffer(column.data, dtype=numpy.float64).copy()
+                for i, value in column.getExceptions():
+                    numeric[i] = toNumber(value, parseStrings)
+            elif hasattr(column, "typecode") and column.typecode == "d":
+                numeric = numpy.frombuffer(column, dtype=numpy.float64)
+            elif hasattr(column, "typecode"):
+                numeric = numpy.frombuffer(column, dtype=numpy.int64).astype(numpy.float64)
+            elif isinstance(column, quant_local.DictionaryColumn):
+                values = numpy.array([toNumber(value, parseStrings) for value in column.values], dtype=numpy.float64)
+                numeric = values[numpy.frombuffer(column.codes, dtype=column.codes.typecode)]
+            else:
+                numeric = numpy.array([toNumber(value, parseStrings) for value in column], dtype=numpy.float64)
+            view[name] = numeric
+        return view[name]
+
+    def getStrings(self, table, key):
+        """Returns an object numpy array view of the given column, with string
+           values lower-cased (for case-insensitive comparison) and None for
+           non-string values
+        """
+        view = self.getView(table, key)
+        if "strings" not in view:
+            column = table.getColumn(key)
+            strings = numpy.full(len(column), None, dtype=object)
+            if isinstance(column, quant_local.NumericColumn):
+                for i, value in column.getExceptions():
+                    strings[i] = toComparable(value)
+            elif isinstance(column, quant_local.DictionaryColumn):
+                values = numpy.full(len(column.values), None, dtype=object)
+                values[:] = [toComparable(value) for value in column.values]
+                strings = values[numpy.frombuffer(column.codes, dtype=column.codes.typecode)]
+            elif type(column) is list or isinstance(column, quant_local.StringColumn):
+                strings[:] = [toComparable(value) for value in column]
+            view["strings"] = strings
+        return view["strings"]
+
+    def getStatistics(self, table, key):
+        """Returns a dictionary of statistics for the given column: numeric
+           "min" and "max" (None if there are no numeric values), and the set
+           of distinct (lower-cased) string "values"
+        """
+        view = self.getView(table, key)
+        if "statistics" not in view:
+            numeric = self.getNumeric(table, key)
+            valid = numeric[~numpy.isnan(numeric)]
+            strings = self.getStrings(table, key)
+            view["statistics"] = {
+                "min": float(valid.min()) if 0 < len(valid) else None,
+                "max": float(valid.max()) if 0 < len(valid) else None,
+                "values": set([value for value in strings if value is not None]),
+            }
+        return view["statistics"]
+
+    def select(self, columns, where=None, dates=None, codes=None, asRecords=False):
+        """Returns the given columns for all securities satisfying the given
+           predicate (or all securities, if None). Dates may be None (latest
+           snapshot only), "all", or a list of "YYYYMMDD" strings; codes may
+           restrict the sectors searched (and loaded). Results are a dictionary of numpy
+           arrays (one per column, plus "date" and "sector" columns), or a
+           list of dictionaries if *asRecords* is True.
+        """
+        if dates is None:
+            dates = self.getDates()[-1:]
+        elif dates == "all":
+            dates = self.getDates()
+        parts = dict([(key, []) for key in ["date", "sector"] + list(columns)])
+        for date in dates:
+            for sector in self.getSectors(date, codes):
+                code = sector.getCode()
+                table = sector.table
+                if where is None:
+                    rows = numpy.arange(len(table))
+                elif where.canSkip(self, table):
+                    continue
+                else:
+                    rows = numpy.flatnonzero(where.evaluate(self, table))
+                if len(rows) == 0:
+                    continue
+                parts["date"].append(numpy.full(len(rows), date, dtype=object))
+                parts["sector"].append(numpy.full(len(rows), code, dtype=object))
+                for key in columns:
+                    parts[key].append(self.project(table, key, rows))
+        result = {}
+        for key, arrays in parts.items():
+            result[key] = numpy.concatenate(arrays) if 0 < len(arrays) else numpy.array([], dtype=object)
+        if asRecords:
+            keys = list(result.keys())
+            return [dict(zip(keys, values)) for values in zip(*[result[key].tolist() for key in keys])]
+        return result
+
+    def project(self, table, key, rows):
+        """Returns the given rows of the given column as a numpy array. Fully
+           numeric columns are returned as float arrays (without conversion of
+           individual values); anything else is returned as an object array
+           of the original cell values.
+        """
+        if key not in table.index:
+            return numpy.full(len(rows), None, dtype=object)
+        column = table.getColumn(key)
+        if hasattr(column, "typecode") and column.typecode == "d":
+            return numpy.frombuffer(column, dtype=numpy.float64)[rows]
+        if isinstance(column, quant_local.DictionaryColumn) and all([type(value) is float for value in column.values]):
+            values = numpy.array(column.values, dtype=numpy.float64)
+            return values[numpy.frombuffer(column.codes, dtype=column.codes.typecode)[rows]]
+        values = numpy.empty(len(rows), dtype=object)
+        values[:] = [column[i] for i in rows]
+        return values
+
+def toNumber(value, parseStrings=True):
+    """Converts a cell value to float for numeric comparison, returning NaN
+       for values that cannot be compared numerically. Dollar strings are
+       always converted; other numeric strings only if *parseStrings* is
+       True (as Filter does for float values only).
+    """
+    if isNumber(value):
+        return float(value)
+    if type(value) is type("") and 0 < len(value):
+        try:
+            if value[0] == "$":
+                return quant_local.convertDollarString(value)
+            if not parseStrings:
+                return numpy.nan
+            return float(value)
+        except Exception:
+            return numpy.nan
+    return numpy.nan
+
+def toComparable(value):
+    """Converts a cell value for (case-insensitive) equality comparison:
+       strings are lower-cased, booleans are kept, and anything else is None
+    """
+    if type(value) is type(""):
+        return value.lower()
+    if type(value) is type(True):
+        return value
+    return None
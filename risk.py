@@ -0,0 +1,221 @@
+"""Risk measures over (time x symbol) price or return arrays, computed for
+   every symbol at once: rolling and full-sample volatility, drawdowns, beta
+   against a benchmark (like SPY, or an equal-weighted universe proxy),
+   pairwise correlation, and historical and parametric value-at-risk.
+
+   Missing observations are NaN. Rolling statistics are differenced from
+   cumulative sums (so any window length costs the same), rolling quantiles
+   are taken over strided window views, and correlations are pairwise-
+   complete (each pair uses only the periods where both symbols have
+   returns) yet reduce to a few matrix products:
+
+   >>> returns = getReturns(closes)
+   >>> table = getRiskTable(closes, benchmark=getReturns(spyCloses)[:, 0])
+   >>> table["maxDrawdown"], table["historicalVaR"]
+
+   All measures are oriented so that lower values mean less risk (drawdowns
+   and VaR are reported as positive losses), so they can be minimized
+   directly, e.g. as extra papa_moo frontier objectives.
+"""
+
+import math
+import statistics
+import warnings
+import numpy
+
+PERIODS_PER_YEAR = 252 # daily bars; use 52 for weekly snapshots
+VAR_LEVEL = 0.95
+MIN_PERIODS = 2
+
+def forwardFill(values):
+    """Returns a copy of the given (time x column) array with NaN elements
+       replaced by the most recent non-NaN value above them (leading NaNs are
+       kept)
+    """
+    valid = ~numpy.isnan(values)
+    rows = numpy.where(valid, numpy.arange(values.shape[0])[:, None], 0)
+    numpy.maximum.accumulate(rows, axis=0, out=rows)
+    filled = values[rows, numpy.arange(values.shape[1])[None, :]]
+    filled[~numpy.maximum.accumulate(valid, axis=0)] = numpy.nan
+    return filled
+
+def getReturns(prices):
+    """Returns the (time - 1 x symbol) simple returns of the given prices,
+       with NaN where either price is missing (or not positive)
+    """
+    prices = numpy.asarray(prices, dtype=numpy.float64)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        returns = prices[1:] / prices[:-1] - 1.0
+    returns[~numpy.isfinite(returns) | ~(0 < prices[:-1])] = numpy.nan
+    return returns
+
+def getCumulative(values, valid):
+    """Returns cumulative sums (with a leading row of zeros) of the given
+       values where valid, so that sums over rows [i, j) are c[j] - c[i]
+    """
+    zeros = numpy.zeros((1,) + values.shape[1:])
+    return numpy.concatenate([zeros, numpy.cumsum(numpy.where(valid, values, 0.0), axis=0)], axis=0)
+
+def rollingVolatility(returns, window, periodsPerYear=PERIODS_PER_YEAR):
+    """Returns the annualized (sample) standard deviation of the returns over
+       each trailing window, as a (time x symbol) array. Rows before the
+       first full window, and windows with fewer than two valid returns, are
+       NaN.
+    """
+    valid = ~numpy.isnan(returns)
+    sums = getCumulative(returns, valid)
+    squares = getCumulative(returns * returns, valid)
+    counts = getCumulative(valid.astype(numpy.float64), True)
+    volatility = numpy.full(returns.shape, numpy.nan)
+    if window <= len(returns):
+        n = counts[window:] - counts[:-window]
+        s = sums[window:] - sums[:-window]
+        q = squares[window:] - squares[:-window]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            variance = (q - s * s / n) / (n - 1)
+        variance[n < MIN_PERIODS] = numpy.nan
+        volatility[window-1:] = numpy.sqrt(numpy.maximum(variance, 0.0)) * math.sqrt(periodsPerYear)
+    return volatility
+
+def volatility(returns, periodsPerYear=PERIODS_PER_YEAR):
+    """Returns the annualized (sample) standard deviation of each symbol's
+       returns
+    """
+    return rollingVolatility(returns, len(returns), periodsPerYear)[-1] if 0 < len(returns) else numpy.full(returns.shape[1:], numpy.nan)
+
+def drawdowns(prices):
+    """Returns the (time x symbol) drawdown of each price from its running
+       peak, as a positive fraction (0 at a new high). Missing prices carry
+       the previous price forward.
+    """
+    filled = forwardFill(numpy.asarray(prices, dtype=numpy.float64))
+    peaks = numpy.fmax.accumulate(filled, axis=0)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return 1.0 - filled / peaks
+
+def maxDrawdown(prices):
+    """Returns the maximum drawdown (a positive fraction) of each symbol
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # all-NaN symbols
+        return numpy.nanmax(drawdowns(prices), axis=0)
+
+def rollingBeta(returns, benchmark, window):
+    """Returns the (time x symbol) beta of each symbol's returns against the
+       given benchmark returns (one per period) over each trailing window,
+       using only periods where both are valid
+    """
+    benchmark = numpy.broadcast_to(numpy.asarray(benchmark, dtype=numpy.float64)[:, None], returns.shape)
+    valid = ~numpy.isnan(returns) & ~numpy.isnan(benchmark)
+    cumulative = [getCumulative(values, valid) for values in [returns, benchmark, returns * benchmark, benchmark * benchmark, numpy.ones(returns.shape)]]
+    beta = numpy.full(returns.shape, numpy.nan)
+    if window <= len(returns):
+        x, y, xy, yy, n = [c[window:] - c[:-window] for c in cumulative]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            covariance = xy - x * y / n
+            variance = yy - y * y / n
+            windowed = numpy.where((MIN_PERIODS <= n) & (0 < variance), covariance / variance, numpy.nan)
+        beta[window-1:] = windowed
+    return beta
+
+def beta(returns, benchmark):
+    """Returns the beta of each symbol's returns against the given benchmark
+       returns (one per period)
+    """
+    return rollingBeta(returns, benchmark, len(returns))[-1] if 0 < len(returns) else numpy.full(returns.shape[1:], numpy.nan)
+
+def correlation(returns):
+    """Returns the (symbol x symbol) pairwise-complete Pearson correlation
+       matrix of the given returns. Sums over the periods valid for both
+       symbols of each pair are computed as matrix products of the zero-
+       filled returns and the validity mask. Pairs with fewer than two common
+       periods (or no variance) are NaN.
+    """
+    valid = ~numpy.isnan(returns)
+    if valid.all():
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return numpy.corrcoef(returns, rowvar=False) if MIN_PERIODS <= len(returns) else numpy.full((returns.shape[1],) * 2, numpy.nan)
+    m = valid.astype(numpy.float64)
+    x = numpy.where(valid, returns, 0.0)
+    n = m.T @ m
+    sx = x.T @ m # sum of each row symbol's returns, over periods valid for the column symbol
+    sxx = (x * x).T @ m
+    sxy = x.T @ x
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        covariance = sxy - sx * sx.T / n
+        variances = sxx - sx * sx / n
+        corr = covariance / numpy.sqrt(variances * variances.T)
+    corr[(n < MIN_PERIODS) | ~(0 < variances) | ~(0 < variances.T)] = numpy.nan
+    return numpy.clip(corr, -1.0, 1.0)
+
+def getQuantile(values, q, axis=0):
+    """Returns the q-th quantile (linearly interpolated, like *numpy.quantile*)
+       of the non-NaN values along the given axis, from one in-place sort of
+       a contiguous copy (which places NaNs last) serving every column,
+       rather than *numpy.nanquantile*'s per-column work
+    """
+    ordered = numpy.array(values, dtype=numpy.float64, order="C")
+    ordered.sort(axis=axis)
+    n = (~numpy.isnan(ordered)).sum(axis=axis, keepdims=True)
+    position = numpy.maximum(n - 1, 0) * q
+    lower = numpy.floor(position).astype(numpy.int64)
+    upper = numpy.minimum(lower + 1, numpy.maximum(n - 1, 0))
+    below = numpy.take_along_axis(ordered, lower, axis=axis)
+    above = numpy.take_along_axis(ordered, upper, axis=axis)
+    quantile = below + (above - below) * (position - lower)
+    quantile[n == 0] = numpy.nan
+    return numpy.squeeze(quantile, axis=axis)
+
+def historicalVaR(returns, level=VAR_LEVEL):
+    """Returns the historical value-at-risk of each symbol at the given
+       confidence level: the loss (as a positive fraction) at the lower
+       (1 - level) quantile of its returns
+    """
+    return -getQuantile(returns, 1.0 - level, axis=0)
+
+def rollingHistoricalVaR(returns, window, level=VAR_LEVEL):
+    """Returns the (time x symbol) historical value-at-risk over each trailing
+       window, from quantiles over a strided (window-count x symbol x window)
+       view of the returns. Rows before the first full window are NaN.
+    """
+    var = numpy.full(returns.shape, numpy.nan)
+    if window <= len(returns):
+        views = numpy.lib.stride_tricks.sliding_window_view(returns, window, axis=0)
+        var[window-1:] = -getQuantile(views, 1.0 - level, axis=-1)
+    return var
+
+def parametricVaR(returns, level=VAR_LEVEL):
+    """Returns the parametric (normal) value-at-risk of each symbol at the
+       given confidence level, from the mean and sample standard deviation of
+       its returns
+    """
+    z = statistics.NormalDist().inv_cdf(1.0 - level)
+    valid = ~numpy.isnan(returns)
+    n = valid.sum(axis=0)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        mean = numpy.where(valid, returns, 0.0).sum(axis=0) / n
+        deviations = numpy.where(valid, returns - mean, 0.0)
+        std = numpy.sqrt((deviations * deviations).sum(axis=0) / (n - 1))
+    return numpy.where(MIN_PERIODS <= n, -(mean + z * std), numpy.nan)
+
+def getRiskTable(prices, benchmark=None, level=VAR_LEVEL, periodsPerYear=PERIODS_PER_YEAR):
+    """Returns a dictionary of per-symbol risk measures (each an array with
+       one element per price column) over the full price history:
+       "volatility", "maxDrawdown", "historicalVaR", "parametricVaR", and,
+       given benchmark returns (one per return period, or "universe" for the
+       equal-weighted mean return of all symbols), "beta"
+    """
+    returns = getReturns(prices)
+    table = {
+        "volatility": volatility(returns, periodsPerYear),
+        "maxDrawdown": maxDrawdown(prices),
+        "historicalVaR": historicalVaR(returns, level),
+        "parametricVaR": parametricVaR(returns, level),
+    }
+    if benchmark is not None:
+        if isinstance(benchmark, str) and benchmark == "universe":
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                benchmark = numpy.nanmean(returns, axis=1)
+        table["beta"] = beta(returns, benchmark)
+    return table
@@ -0,0 +1,229 @@
+"""Concurrent, cached, and rate-limited HTTP scraping. A Scraper shares one
+   pooled *requests.Session* across a bounded pool of worker threads, spaces
+   out requests to each host by a minimum interval, and keeps an on-disk
+   cache of response bodies so that re-runs only fetch pages older than the
+   cache TTL.
+
+   Cached responses are stored under human-readable file names derived from
+   the URL (see *getCacheName()*), so a cache folder doubles as a set of
+   fixtures: in replay mode, responses are served from that folder only
+   (regardless of age), and a missing fixture raises an exception instead of
+   touching the network.
+
+   Network requests time out after *timeout* seconds. Throttled (429) and
+   server-error (5xx) responses, as well as timeouts and dropped
+   connections, are retried with exponential backoff; a 429 response's
+   "Retry-After" header is honored, and defers every request to that host.
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+import email.utils
+import concurrent.futures
+from quant_local import profiling
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0 Safari/537.36"
+MAX_NAME_LENGTH = 180
+MAX_RETRY_DELAY = 300.0
+
+def getHost(url):
+    """Returns the host portion of the given URL (used to key rate limits)
+    """
+    match = re.match(r"^\w+://([^/?#]+)", url)
+    if match is None:
+        raise Exception("Unable to determine host for URL '%s'" % url)
+    return match.group(1).lower()
+
+def getCacheName(url):
+    """Returns the cache/fixture file name for the given URL. The scheme is
+       dropped and any run of characters that are unsafe in file names is
+       replaced by "_" (for example, "https://finance.yahoo.com/quote/XOM"
+       becomes "finance.yahoo.com_quote_XOM"). Long names are truncated and
+       suffixed with a hash of the full URL to stay unique.
+    """
+    name = re.sub(r"^\w+://", "", url)
+    name = re.sub(r"[^A-Za-z0-9.,=+-]+", "_", name).strip("_")
+    if MAX_NAME_LENGTH < len(name):
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+        name = name[:MAX_NAME_LENGTH - 17] + "_" + digest
+    return name
+
+def getRetryDelay(res, attempt, backoff):
+    """Returns the number of seconds to wait before retrying the request that
+       received the given response (None for a timeout or dropped connection):
+       the "Retry-After" header if present (in seconds or as an HTTP date),
+       or *backoff* doubled with each previous attempt otherwise, capped at
+       MAX_RETRY_DELAY
+    """
+    delay = backoff * 2 ** attempt
+    retryAfter = None if res is None else res.headers.get("Retry-After", None)
+    if retryAfter is not None:
+        try:
+            delay = float(retryAfter)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(retryAfter).timestamp() - time.time()
+            except (TypeError, ValueError):
+                pass
+    return min(max(delay, 0.0), MAX_RETRY_DELAY)
+
+class RateLimiter(object):
+    """Thread-safe, per-host request spacing. Each call to *wait()* reserves
+       the next available slot for that host (at least *minInterval* seconds
+       after the previous one) and sleeps until it arrives.
+    """
+
+    def __init__(self, minInterval):
+        """Requests to the same host are spaced at least this many seconds
+           apart
+        """
+        self.minInterval = minInterval
+        self.lock = threading.Lock()
+        self.nextTimes = {}
+
+    def wait(self, host):
+        """Blocks until a request to the given host is allowed
+        """
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextTimes.get(host, now))
+            self.nextTimes[host] = slot + self.minInterval
+        if now < slot:
+            time.sleep(slot - now)
+
+    def defer(self, host, delay):
+        """Pushes the next available slot for the given host at least this
+           many seconds into the future (for example, when the host asks
+           clients to back off)
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.nextTimes[host] = max(self.nextTimes.get(host, now), now + delay)
+
+class Scraper(object):
+    """Fetches URLs through a pooled session, per-host rate limiter, and
+       on-disk cache (or, in replay mode, from fixtures only).
+    """
+
+    def __init__(self, cachePath=None, ttl=86400.0, maxWorkers=8, minInterval=1.0, replay=False, timeout=30.0, retries=3, backoff=2.0):
+        """A cache path is required for caching (or replay). Cached responses
+           younger than *ttl* seconds are reused; *maxWorkers* bounds the
+           number of concurrent requests, and *minInterval* is the minimum
+           spacing (in seconds) of requests to any one host. Each request
+           times out after *timeout* seconds, and transient failures are
+           retried up to *retries* times, starting *backoff* seconds apart.
+        """
+        if replay and cachePath is None:
+            raise Exception("Replay mode requires a cache (fixture) path")
+        self.cachePath = cachePath
+        self.ttl = ttl
+        self.maxWorkers = maxWorkers
+        self.replay = replay
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(minInterval)
+        self.session = None
+        self.sessionLock = threading.Lock()
+        if cachePath is not None and not replay:
+            os.makedirs(cachePath, exist_ok=True)
+
+    def getSession(self):
+        """Returns the shared *requests.Session* (created on first use, with a
+           connection pool sized to the worker pool)
+        """
+        with self.sessionLock:
+            if self.session is None:
+                import requests
+                import requests.adapters
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.maxWorkers, pool_maxsize=self.maxWorkers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = USER_AGENT
+                self.session = session
+            return self.session
+
+    def getCachePath(self, url):
+        """Returns the path of the cache (or fixture) file for the given URL
+        """
+        return os.path.abspath(self.cachePath + "/%s" % getCacheName(url))
+
+    def readCache(self, url):
+        """Returns cached content for the given URL, or None if there is no
+           (fresh) cached response. In replay mode, a missing fixture raises an
+           exception.
+        """
+        if self.cachePath is None:
+            return None
+        path = self.getCachePath(url)
+        if not os.path.isfile(path):
+            if self.replay:
+                raise Exception("No fixture for URL '%s' (expected %s)" % (url, path))
+            return None
+        if not self.replay and self.ttl < time.time() - os.path.getmtime(path):
+            return None
+        with open(path, 'rb') as f:
+            content = f.read()
+        profiling.addBytes("scrape.cache", len(content))
+        return content
+
+    def writeCache(self, url, content):
+        """Atomically writes the given content to the cache file for the URL
+        """
+        if self.cachePath is None:
+            return
+        path = self.getCachePath(url)
+        tmpPath = "%s.%u.tmp" % (path, threading.get_ident())
+        with open(tmpPath, 'wb') as f:
+            f.write(content)
+        os.replace(tmpPath, path)
+
+    def fetch(self, url):
+        """Returns the response body (bytes) for the given URL, from the cache
+           if fresh, or from the network (rate-limited) otherwise
+        """
+        content = self.readCache(url)
+        if content is not None:
+            return content
+        import requests
+        host = getHost(url)
+        for attempt in range(self.retries + 1):
+            self.limiter.wait(host)
+            try:
+                with profiling.stage("scrape.%s" % host):
+                    res = self.getSession().get(url, timeout=self.timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if self.retries <= attempt:
+                    raise Exception("Request for '%s' failed: %s" % (url, str(e)))
+                res = None
+            else:
+                if res.status_code == 200:
+                    break
+                if self.retries <= attempt or (res.status_code != 429 and res.status_code < 500):
+                    raise Exception("Request for '%s' failed with status %u" % (url, res.status_code))
+            delay = getRetryDelay(res, attempt, self.backoff)
+            profiling.warn("Retrying '%s' in %.1f seconds (%s)" % (url, delay, "no response" if res is None else "status %u" % res.status_code), "scrape.retry")
+            self.limiter.defer(host, delay)
+        profiling.addBytes("scrape.%s" % host, len(res.content))
+        self.writeCache(url, res.content)
+        return res.content
+
+    def map(self, func, items, label=str):
+        """Calls the given function on each item across the worker pool,
+           returning a list of results in item order. Exceptions raised for an
+           individual item are returned in place of its result (and counted,
+           if profiling is enabled), so one failed page does not abort a run.
+           Failures are reported using *label(item)* (for example, a symbol).
+        """
+        def call(item):
+            try:
+                return func(item)
+            except Exception as e:
+                profiling.warn("Scrape failed for %s: %s" % (label(item), str(e)), "scrape.%s" % type(e).__name__)
+                return e
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            return list(executor.map(call, items))
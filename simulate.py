@@ -0,0 +1,218 @@
+"""Monte Carlo simulation of strategy outcomes. Price paths are bootstrapped
+   from a (time x symbol) price history (cached daily bars, "charts/" files,
+   or the weekly datastore snapshots) by a moving block bootstrap: each path
+   is stitched together from randomly-chosen blocks of consecutive historical
+   returns, resampled jointly across symbols, which preserves short-range
+   autocorrelation and cross-sectional correlation.
+
+   A strategy is a signal function that receives a batch of price paths as
+   a (path x time x symbol) array and returns portfolio weights of the same
+   shape (the fraction of equity in each symbol at each close, held until the
+   next). Signal functions are replayed over whole batches of paths at once,
+   and batches are spread across a process pool. Each batch draws from its
+   own child of one seed sequence, so results depend only on the seed (not on
+   the number of workers):
+
+   >>> result = simulate(closes, bollinger(window=20, width=2.0), nPaths=2000)
+   >>> result["finalReturn"], result["maxDrawdown"]
+"""
+
+import json
+import argparse
+import functools
+import concurrent.futures
+import numpy
+from quant_local import profiling, risk
+
+N_PATHS = 1000
+HORIZON = 252 # periods simulated per path
+BLOCK_LENGTH = 10
+BATCH_SIZE = 250 # paths per pool task
+SIGNAL_COLUMNS = 2048 # (path, symbol) columns per rolling-window evaluation, to bound memory
+PERCENTILES = [5, 25, 50, 75, 95]
+CONTEXT = None # (returns, history, signal, horizon, blockLength) in each pool worker
+
+def buyAndHold(prices):
+    """Signal function holding equal weights in every symbol (rebalanced at
+       each close)
+    """
+    return numpy.full(prices.shape, 1.0 / prices.shape[2])
+
+def bollingerSignal(prices, window=10, width=1.0, centre="median"):
+    """Signal function for the alpaca_bolband strategy: an equal share of
+       equity in each symbol while its band position is held (see
+       *alpaca_bolband.getBandHoldings()*). Paths are independent, so the
+       batch is evaluated as (time x path*symbol) columns, a few thousand
+       columns at a time.
+    """
+    from quant_local.strategies import alpaca_bolband
+    nPaths, nTimes, nSymbols = prices.shape
+    closes = prices.transpose(1, 0, 2).reshape(nTimes, nPaths * nSymbols)
+    held = numpy.zeros(closes.shape, dtype=bool)
+    for start in range(0, closes.shape[1], SIGNAL_COLUMNS):
+        held[:, start:start+SIGNAL_COLUMNS] = alpaca_bolband.getBandHoldings(closes[:, start:start+SIGNAL_COLUMNS], window, [width], [centre])[0]
+    return held.reshape(nTimes, nPaths, nSymbols).transpose(1, 0, 2) / nSymbols
+
+def bollinger(window=10, width=1.0, centre="median"):
+    """Returns a (picklable) Bollinger band signal function with the given
+       settings
+    """
+    return functools.partial(bollingerSignal, window=window, width=width, centre=centre)
+
+def getBlockIndices(rng, nReturns, horizon, nPaths, blockLength=BLOCK_LENGTH):
+    """Returns a (path x horizon) array of historical return indices, made of
+       consecutive runs of *blockLength* indices starting at uniformly random
+       positions (the moving block bootstrap)
+    """
+    blockLength = max(1, min(blockLength, nReturns))
+    nBlocks = -(-horizon // blockLength)
+    starts = rng.integers(0, nReturns - blockLength + 1, size=(nPaths, nBlocks))
+    indices = starts[:, :, None] + numpy.arange(blockLength)[None, None, :]
+    return indices.reshape(nPaths, nBlocks * blockLength)[:, :horizon]
+
+def getPaths(returns, history, indices):
+    """Returns a (path x time x symbol) array of prices: the given history
+       (a time x symbol array, identical for every path), followed by one
+       price per bootstrapped return, compounded from the last historical
+       price
+    """
+    growth = numpy.cumprod(1.0 + returns[indices], axis=1)
+    simulated = history[-1][None, None, :] * growth
+    return numpy.concatenate([numpy.broadcast_to(history[None, :, :], (len(indices),) + history.shape), simulated], axis=1)
+
+def evaluatePaths(paths, weights, nHistory):
+    """Returns (path x time) arrays of cumulative return and drawdown for the
+       simulated part of the given paths, where the portfolio holds the given
+       weights from each close to the next (starting from the last historical
+       close)
+    """
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        changes = paths[:, nHistory:] / paths[:, nHistory-1:-1] - 1.0
+    changes[~numpy.isfinite(changes)] = 0.0
+    portfolio = (weights[:, nHistory-1:-1] * changes).sum(axis=2)
+    equity = numpy.concatenate([numpy.ones((len(paths), 1)), numpy.cumprod(1.0 + portfolio, axis=1)], axis=1)
+    drawdowns = 1.0 - equity / numpy.maximum.accumulate(equity, axis=1)
+    return equity - 1.0, drawdowns
+
+def simulateBatch(returns, history, signal, horizon, blockLength, seed, nPaths):
+    """Simulates and evaluates one batch of paths from the given seed (a
+       numpy SeedSequence)
+    """
+    rng = numpy.random.default_rng(seed)
+    indices = getBlockIndices(rng, len(returns), horizon, nPaths, blockLength)
+    paths = getPaths(returns, history, indices)
+    return evaluatePaths(paths, signal(paths), len(history))
+
+def setContext(returns, history, signal, horizon, blockLength):
+    """Pool worker initializer: keeps the (read-only) simulation inputs, so
+       that tasks only carry their seed and size
+    """
+    global CONTEXT
+    CONTEXT = (returns, history, signal, horizon, blockLength)
+
+def simulateTask(task):
+    """Pool worker task: simulates one (seed, number of paths) batch
+    """
+    seed, nPaths = task
+    returns, history, signal, horizon, blockLength = CONTEXT
+    return simulateBatch(returns, history, signal, horizon, blockLength, seed, nPaths)
+
+@profiling.timed("simulate")
+def simulate(prices, signal=buyAndHold, nPaths=N_PATHS, horizon=HORIZON, blockLength=BLOCK_LENGTH, warmup=0, seed=0, maxWorkers=None, batchSize=BATCH_SIZE, percentiles=PERCENTILES):
+    """Bootstraps price paths from the given (time x symbol) price history and
+       replays the given signal function over them. Each path continues from
+       the last *warmup* + 1 historical prices (so signals with lookback
+       windows are defined from the start). Returns a dictionary with the
+       "percentiles", (percentile x time) "returnBands" and "drawdownBands"
+       of cumulative return and drawdown at each period, and percentiles of
+       the "finalReturn" and "maxDrawdown" of each path.
+
+       Batches of *batchSize* paths run across a process pool of
+       *maxWorkers* processes (all CPUs by default), or in this process if
+       *maxWorkers* is 1. Missing historical returns are treated as zero.
+    """
+    prices = numpy.asarray(prices, dtype=numpy.float64)
+    returns = risk.getReturns(prices)
+    returns[numpy.isnan(returns)] = 0.0
+    if len(returns) == 0:
+        raise Exception("At least two historical prices are required")
+    history = risk.forwardFill(prices)[-(warmup + 1):]
+    sizes = [min(batchSize, nPaths - start) for start in range(0, nPaths, batchSize)]
+    seeds = numpy.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = list(zip(seeds, sizes))
+    if maxWorkers == 1:
+        batches = [simulateBatch(returns, history, signal, horizon, blockLength, s, n) for s, n in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=maxWorkers, initializer=setContext, initargs=(returns, history, signal, horizon, blockLength)) as executor:
+            batches = list(executor.map(simulateTask, tasks))
+    cumulative = numpy.concatenate([batch[0] for batch in batches], axis=0)
+    drawdowns = numpy.concatenate([batch[1] for batch in batches], axis=0)
+    return {
+        "paths": nPaths,
+        "horizon": horizon,
+        "percentiles": list(percentiles),
+        "returnBands": numpy.percentile(cumulative, percentiles, axis=0),
+        "drawdownBands": numpy.percentile(drawdowns, percentiles, axis=0),
+        "finalReturn": numpy.percentile(cumulative[:, -1], percentiles),
+        "maxDrawdown": numpy.percentile(drawdowns.max(axis=1), percentiles),
+    }
+
+def getSnapshotPrices(symbols):
+    """Returns the weekly "Security Price" history of the given symbols across
+       the datastore snapshots (see *portfolio.SymbolIndex*)
+    """
+    from quant_local import portfolio
+    return portfolio.getSymbolIndex().getPrices(symbols)
+
+def getBarPrices(symbols, fetch=True):
+    """Returns (symbols found, daily closes) from the bar cache
+    """
+    from quant_local import bars
+    daily = bars.getBars(symbols, "day", fetch=fetch)
+    symbols = [symbol for symbol in symbols if symbol in daily and 0 < len(daily[symbol][0])]
+    return symbols, bars.alignField(daily, symbols, "close")[1]
+
+def main():
+    """Simulates a strategy over the current positions (from weekly snapshot
+       prices) or the alpaca_bolband symbols (from cached daily bars), and
+       prints percentile bands as JSON
+    """
+    parser = argparse.ArgumentParser(description="Monte Carlo block-bootstrap simulation of strategy outcomes")
+    parser.add_argument("--source", choices=["positions", "bolband"], default="positions")
+    parser.add_argument("--strategy", choices=["hold", "bollinger"], default="hold")
+    parser.add_argument("--paths", type=int, default=N_PATHS)
+    parser.add_argument("--horizon", type=int, default=None, help="Periods per path (default: one year)")
+    parser.add_argument("--block", type=int, default=None, help="Block length, in periods")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--window", type=int, default=10)
+    parser.add_argument("--width", type=float, default=1.0)
+    parser.add_argument("--centre", choices=["median", "mean"], default="median")
+    parser.add_argument("--offline", action="store_true", help="Use cached bars only")
+    args = parser.parse_args()
+    if args.source == "positions":
+        import quant_local
+        from quant_local import portfolio
+        symbols = sorted(set([position["symbol"] for position in portfolio.readPositions(quant_local.getDatePaths()[-1])]))
+        prices = getSnapshotPrices(symbols)
+        horizon, block = 52, 4
+    else:
+        from quant_local.strategies import alpaca_bolband
+        symbols, prices = getBarPrices(alpaca_bolband.SYMBOLS, not args.offline)
+        horizon, block = HORIZON, BLOCK_LENGTH
+    horizon = horizon if args.horizon is None else args.horizon
+    block = block if args.block is None else args.block
+    signal = buyAndHold if args.strategy == "hold" else bollinger(args.window, args.width, args.centre)
+    warmup = 0 if args.strategy == "hold" else args.window
+    result = simulate(prices, signal, args.paths, horizon, block, warmup, args.seed, args.workers)
+    print(json.dumps({
+        "symbols": len(symbols),
+        "paths": result["paths"],
+        "horizon": result["horizon"],
+        "percentiles": result["percentiles"],
+        "finalReturn": result["finalReturn"].tolist(),
+        "maxDrawdown": result["maxDrawdown"].tolist(),
+    }))
+
+if __name__ == "__main__":
+    main()
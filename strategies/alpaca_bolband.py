@@ -1,12 +1,23 @@
-"""
+"""Bollinger band strategy on Alpaca daily bars. Each symbol is recommended
+   "BUY" when its last close falls below the band (a rolling centre statistic
+   less some multiple of the rolling standard deviation), "SELL" when it rises
+   above it, and "HOLD" otherwise.
+
+   Band settings can be chosen by walk-forward optimization over cached daily
+   bars (see the "bars" module): a grid of window lengths, band widths, and
+   centre statistics is evaluated across rolling train/test folds, with
+   symbols spread across a process pool that reads closing prices from
+   shared memory. Run with "--optimize" (and optionally "--index sp500").
 """
 
 import sys
+import math
+import argparse
+import warnings
+import concurrent.futures
 import numpy
-import alpaca_trade_api as ata
-from quant_local import keys
+from quant_local import alpaca, bars, indices, profiling
 
-BASE_URL = "https://paper-api.alpaca.markets"
 #SYMBOLS = [
 #    "SLB",
 #    "HAL",
@@ -70,19 +81,27 @@ SYMBOLS = [
     "WAT"
 ] # sector=healthcare; industry=life sciences; hq=usa
 SYMBOLS.sort()
+WINDOWS = [5, 10, 15, 20, 30, 40, 50] # sessions
+WIDTHS = [0.5, 1.0, 1.5, 2.0, 2.5] # standard deviations
+CENTRES = ["median", "mean"]
+TRAIN_SESSIONS = 252
+TEST_SESSIONS = 63
+SESSIONS_PER_YEAR = 252
+SHARED = None # (SharedMemory, closes) attached in each pool worker
 
-def singleSymbol(symbol):
+def singleSymbol(symbol, window=10, width=1.0, centre="median"):
     """Evaluates a bollinger band strategy from Alpaca-driven historical data
        for the given symbol. Returns one of three given states: "SELL", "HOLD",
-       and "BUY", depending where in the 10-session moving average the most
-       recent closing (adjusted?) indicator is located.
+       and "BUY", depending where in the band (by default, the 10-session
+       median plus or minus one standard deviation) the most recent closing
+       (adjusted?) indicator is located.
     """
-    keypair = keys.get("alpaca")
-    api = ata.REST(key_id=keypair[1], secret_key=keypair[0], base_url=BASE_URL)
-    market_data = api.get_barset([symbol], "day", limit=10)[symbol]
+    api = alpaca.getApi()
+    market_data = api.get_barset([symbol], "day", limit=window)[symbol]
     close = numpy.array([point.c for point in market_data], dtype=numpy.float64)
-    lower = numpy.median(close) - numpy.std(close)
-    upper = numpy.median(close) + numpy.std(close)
+    middle = numpy.median(close) if centre == "median" else numpy.mean(close)
+    lower = middle - width * numpy.std(close)
+    upper = middle + width * numpy.std(close)
     if close[-1] < lower:
         norm = (close[-1] - lower) / (upper - lower)
         return (symbol, "BUY", norm)
@@ -92,6 +111,221 @@ def singleSymbol(symbol):
     else:
         return (symbol, "HOLD", 0)
 
+def getParameterGrid(windows=WINDOWS, widths=WIDTHS, centres=CENTRES):
+    """Returns the list of (window, width, centre) parameter sets, ordered by
+       window, then centre, then width (the order in which *getBandReturns()*
+       evaluates them)
+    """
+    return [(window, width, centre) for window in windows for centre in centres for width in widths]
+
+def getFolds(nSessions, train=TRAIN_SESSIONS, test=TEST_SESSIONS):
+    """Returns rolling walk-forward folds over the given number of sessions,
+       as (trainStart, trainStop, testStart, testStop) index tuples. Each test
+       period immediately follows its training period, and successive folds
+       advance by the test length.
+    """
+    folds = []
+    start = 0
+    while start + train + test <= nSessions:
+        folds.append((start, start + train, start + train, start + train + test))
+        start += test
+    return folds
+
+def getBandHoldings(closes, window, widths=WIDTHS, centres=CENTRES):
+    """Returns a (parameter x session x symbol) boolean array indicating
+       whether a long position is held at each close, for the given window
+       across the given band widths and centre statistics (ordered as
+       *getParameterGrid()*). Rolling centres and standard deviations are
+       computed once per window over a (session x symbol x window) copy of a
+       strided view, and broadcast across widths. A position is entered at a close
+       below the band and exited at a close above it; nothing is held before
+       the first full window.
+    """
+    nSessions, nSymbols = closes.shape
+    windows = numpy.ascontiguousarray(numpy.lib.stride_tricks.sliding_window_view(closes, window, axis=0))
+    std = windows.std(axis=-1)
+    middles = {"mean": windows.mean(axis=-1)}
+    if "median" in centres:
+        windows.sort(axis=-1) # in place; much faster than numpy.median over a strided view
+        median = 0.5 * (windows[..., (window-1)//2] + windows[..., window//2])
+        middles["median"] = numpy.where(numpy.isnan(std), numpy.nan, median) # sorting moves NaNs last
+    last = closes[window-1:]
+    widths = numpy.asarray(widths, dtype=numpy.float64)[:, None, None]
+    sessions = numpy.arange(last.shape[0])[None, :, None]
+    holdings = numpy.zeros((len(widths) * len(centres), nSessions, nSymbols), dtype=bool)
+    with numpy.errstate(invalid="ignore"):
+        for i, centre in enumerate(centres):
+            middle = middles[centre]
+            signal = numpy.where(last < middle - widths * std, 1, numpy.where(middle + widths * std < last, -1, 0))
+            latest = numpy.maximum.accumulate(numpy.where(signal != 0, sessions, -1), axis=1)
+            held = (0 <= latest) & (numpy.take_along_axis(signal, numpy.maximum(latest, 0), axis=1) == 1)
+            holdings[i*len(widths):(i+1)*len(widths), window-1:] = held
+    return holdings
+
+def getBandReturns(closes, window, widths=WIDTHS, centres=CENTRES):
+    """Returns a (parameter x session x symbol) array of daily strategy
+       returns for the given window, across the given band widths and centre
+       statistics (see *getBandHoldings()*). Each session's return is earned
+       by the position held at the previous close; sessions without a valid
+       return are zero.
+    """
+    nSessions, nSymbols = closes.shape
+    holdings = getBandHoldings(closes, window, widths, centres)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        changes = numpy.zeros((nSessions, nSymbols))
+        changes[1:] = closes[1:] / closes[:-1] - 1.0
+        changes[~numpy.isfinite(changes)] = 0.0
+    returns = numpy.zeros(holdings.shape)
+    returns[:, 1:] = numpy.where(holdings[:, :-1], changes[None, 1:], 0.0)
+    return returns
+
+def getFoldSharpes(returns, valid, folds):
+    """Returns (parameter x fold x symbol) arrays of annualized Sharpe ratios
+       over the training and test periods of each fold, and of total (log)
+       returns over each test period, given daily strategy returns and a
+       (session x symbol) mask of sessions with a valid market return. Sums
+       are differenced from cumulative arrays, so each fold costs O(1) per
+       parameter set and symbol. Periods in which no position is held have a
+       Sharpe ratio of zero, and periods without valid sessions give NaN.
+    """
+    zeros = numpy.zeros(returns.shape[:1] + (1,) + returns.shape[2:])
+    sums = numpy.concatenate([zeros, numpy.cumsum(returns, axis=1)], axis=1)
+    squares = numpy.concatenate([zeros, numpy.cumsum(returns * returns, axis=1)], axis=1)
+    logs = numpy.concatenate([zeros, numpy.cumsum(numpy.log1p(returns), axis=1)], axis=1)
+    counts = numpy.concatenate([zeros[0], numpy.cumsum(valid, axis=0)], axis=0)
+    def getSharpe(start, stop):
+        n = counts[stop] - counts[start]
+        mean = (sums[:, stop] - sums[:, start]) / numpy.maximum(n, 1)
+        variance = (squares[:, stop] - squares[:, start]) / numpy.maximum(n, 1) - mean * mean
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            sharpe = numpy.where(1e-12 < variance, mean / numpy.sqrt(variance) * math.sqrt(SESSIONS_PER_YEAR), 0.0)
+        return numpy.where(0 < n, sharpe, numpy.nan)
+    trainSharpes = numpy.stack([getSharpe(fold[0], fold[1]) for fold in folds], axis=1)
+    testSharpes = numpy.stack([getSharpe(fold[2], fold[3]) for fold in folds], axis=1)
+    testReturns = numpy.stack([numpy.where(0 < counts[fold[3]] - counts[fold[2]], logs[:, fold[3]] - logs[:, fold[2]], numpy.nan) for fold in folds], axis=1)
+    return trainSharpes, testSharpes, testReturns
+
+def evaluateChunk(closes, window, widths, centres, folds):
+    """Evaluates every parameter set for one window over the given (session x
+       symbol) closes, returning fold statistics (see *getFoldSharpes()*)
+    """
+    returns = getBandReturns(closes, window, widths, centres)
+    valid = numpy.zeros(closes.shape, dtype=bool)
+    valid[1:] = numpy.isfinite(closes[1:]) & numpy.isfinite(closes[:-1])
+    return getFoldSharpes(returns, valid, folds)
+
+def attachShared(name, shape):
+    """Pool worker initializer: attaches to the shared-memory closes array
+    """
+    global SHARED
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    SHARED = (shm, numpy.ndarray(shape, dtype=numpy.float64, buffer=shm.buf))
+
+def evaluateShared(task):
+    """Pool worker task: evaluates one (window, first symbol, last symbol)
+       chunk of the shared closes array
+    """
+    window, start, stop, widths, centres, folds = task
+    return evaluateChunk(SHARED[1][:, start:stop], window, widths, centres, folds)
+
+@profiling.timed("alpaca_bolband.optimize")
+def optimize(closes, windows=WINDOWS, widths=WIDTHS, centres=CENTRES, train=TRAIN_SESSIONS, test=TEST_SESSIONS, maxWorkers=None, chunkSize=64):
+    """Walk-forward optimization of band settings over a (session x symbol)
+       array of daily closes (NaN where a symbol has no bar). Each fold picks
+       the parameter set with the best mean training Sharpe ratio across
+       symbols, and is scored by that set's mean Sharpe ratio over the test
+       period that follows. Returns a dictionary of "folds", per-parameter
+       "results" (mean training and out-of-sample Sharpe ratios, mean
+       out-of-sample log return, and the number of folds that selected it,
+       sorted by out-of-sample Sharpe), the per-fold "selected" parameters,
+       and the overall "walkForwardSharpe".
+
+       (window, symbol chunk) tasks are spread across a process pool of
+       *maxWorkers* processes (all CPUs by default), which read the closes
+       from shared memory rather than receiving copies. With one worker,
+       tasks are evaluated in this process.
+    """
+    closes = numpy.ascontiguousarray(closes, dtype=numpy.float64)
+    nSessions, nSymbols = closes.shape
+    folds = getFolds(nSessions, train, test)
+    if len(folds) == 0:
+        raise Exception("%u sessions are too few for %u-session training and %u-session test periods" % (nSessions, train, test))
+    tasks = [(window, start, min(start + chunkSize, nSymbols), list(widths), list(centres), folds) for window in windows for start in range(0, nSymbols, chunkSize)]
+    if maxWorkers == 1:
+        chunks = [evaluateChunk(closes[:, task[1]:task[2]], task[0], task[3], task[4], task[5]) for task in tasks]
+    else:
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(create=True, size=max(closes.nbytes, 1))
+        try:
+            numpy.ndarray(closes.shape, dtype=numpy.float64, buffer=shm.buf)[:] = closes
+            with concurrent.futures.ProcessPoolExecutor(max_workers=maxWorkers, initializer=attachShared, initargs=(shm.name, closes.shape)) as executor:
+                chunks = list(executor.map(evaluateShared, tasks))
+        finally:
+            shm.close()
+            shm.unlink()
+    nStarts = len(range(0, nSymbols, chunkSize))
+    trainSharpes, testSharpes, testReturns = [numpy.concatenate([
+        numpy.concatenate([chunks[w * nStarts + c][k] for c in range(nStarts)], axis=2) for w in range(len(windows))
+    ], axis=0) for k in range(3)]
+    grid = getParameterGrid(windows, widths, centres)
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # all-NaN slices
+        trainScores = numpy.nanmean(trainSharpes, axis=2)
+        testScores = numpy.nanmean(testSharpes, axis=2)
+        testMeans = numpy.nanmean(testReturns, axis=2)
+        selected = numpy.argmax(numpy.nan_to_num(trainScores, nan=-numpy.inf), axis=0)
+        for i, (window, width, centre) in enumerate(grid):
+            results.append({
+                "window": window,
+                "width": width,
+                "centre": centre,
+                "trainSharpe": float(numpy.nanmean(trainScores[i])),
+                "testSharpe": float(numpy.nanmean(testScores[i])),
+                "testReturn": float(numpy.nanmean(testMeans[i])),
+                "selected": int((selected == i).sum()),
+            })
+    results.sort(key=lambda result: -result["testSharpe"] if result["testSharpe"] == result["testSharpe"] else numpy.inf)
+    return {
+        "folds": folds,
+        "results": results,
+        "selected": [grid[i] for i in selected],
+        "walkForwardSharpe": float(numpy.nanmean(testScores[selected, numpy.arange(len(folds))])),
+    }
+
+def getCloses(symbols, fetch=True, fromMinutes=False):
+    """Returns the symbols with cached (or fetched) daily bars, their session
+       timestamps, and a (session x symbol) array of closes. Daily bars are
+       resampled from the minute store instead, if *fromMinutes* is True.
+    """
+    if fromMinutes:
+        daily = bars.getResampledBars(symbols, "day", fetch=fetch)
+    else:
+        daily = bars.getBars(symbols, "day", fetch=fetch)
+    symbols = [symbol for symbol in symbols if symbol in daily and 0 < len(daily[symbol][0])]
+    t, closes = bars.alignField(daily, symbols, "close")
+    return symbols, t, closes
+
+def mainOptimize():
+    """Walk-forward optimizes band settings over SYMBOLS (or an index) and
+       reports out-of-sample performance per parameter set
+    """
+    parser = argparse.ArgumentParser(description="Walk-forward optimization of Bollinger band settings")
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--index", default=None, help="Index definition to use instead of SYMBOLS (e.g., sp500)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--offline", action="store_true", help="Use cached bars only")
+    parser.add_argument("--from-minutes", action="store_true", help="Resample daily bars from the cached minute bars")
+    args = parser.parse_args()
+    symbols = SYMBOLS if args.index is None else indices.getSymbols(args.index)
+    symbols, _, closes = getCloses(symbols, not args.offline, args.from_minutes)
+    result = optimize(closes, maxWorkers=args.workers)
+    print("%u symbols, %u sessions, %u folds; walk-forward out-of-sample Sharpe %.3f" % (len(symbols), closes.shape[0], len(result["folds"]), result["walkForwardSharpe"]))
+    print("%6s %6s %8s %12s %12s %12s %9s" % ("window", "width", "centre", "train SR", "test SR", "test logret", "selected"))
+    for r in result["results"]:
+        print("%6u %6.2f %8s %12.3f %12.3f %12.4f %9u" % (r["window"], r["width"], r["centre"], r["trainSharpe"], r["testSharpe"], r["testReturn"], r["selected"]))
+
 def main():
     """Iterates over SYMBOLS to report strategy actions (non-holds)
     """
@@ -104,4 +338,7 @@ def main():
         print("%s: %s (%f)" % (action[0], action[1], action[2] * 100))
 
 if __name__ == "__main__":
-    main()
+    if "--optimize" in sys.argv[1:]:
+        mainOptimize()
+    else:
+        main()
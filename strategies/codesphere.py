@@ -3,23 +3,18 @@
 
 import time
 import numpy
-import alpaca_trade_api as ata
-from quant_local import keys
-
-BASE_URL = "https://paper-api.alpaca.markets"
+from quant_local import alpaca
 
 def buy(symbol, nShares):
     """
     """
-    keypair = keys.get("alpaca")
-    api = ata.REST(key_id=keypair[1], secret_key=keypair[0], base_url=BASE_URL)
+    api = alpaca.getApi()
     api.submit_order(symbol=symbol, qty=nShares, side="buy", type="market", time_in_force="gtc")
 
 def sell(symbol, nShares):
     """
     """
-    keypair = keys.get("alpaca")
-    api = ata.REST(key_id=keypair[1], secret_key=keypair[0], base_url=BASE_URL)
+    api = alpaca.getApi()
     api.submit_order(symbol=symbol, qty=nShares, side="sell", type="market", time_in_force="gtc")
 
 def trading():
@@ -31,8 +26,7 @@ def trading():
 def reading(symbol="SPY"):
     """
     """
-    keypair = keys.get("alpaca")
-    api = ata.REST(key_id=keypair[1], secret_key=keypair[0], base_url=BASE_URL)
+    api = alpaca.getApi()
     while True:
         print("")
         print("Checking price...")
@@ -51,8 +45,7 @@ def strategy(symbol="SPY"):
     """
     """
     pos_held = False
-    keypair = keys.get("alpaca")
-    api = ata.REST(key_id=keypair[1], secret_key=keypair[0], base_url=BASE_URL)
+    api = alpaca.getApi()
     while True:
         print("")
         print("Checking price...")
@@ -81,8 +74,7 @@ def backtest(symbol="SPY"):
     """
     """
     pos_held = False
-    keypair = keys.get("alpaca")
-    api = ata.REST(key_id=keypair[1], secret_key=keypair[0], base_url=BASE_URL)
+    api = alpaca.getApi()
     hours_to_test = 2
     print("Checking price")
     market_data = api.get_barset(symbol, "minute", limit=(60 * hours_to_test))
@@ -10,14 +10,19 @@
 
 import re
 import json
+import datetime
 import numpy
-import requests
 import bs4
 import quant_local
+from quant_local import query, scrape
 
 #NAME_PREFIXES = ["Mr.", "Ms.", "Mrs.", "Dr."]
 #NAME_SUFFIXES = ["Ph.D.", "Jr.", "Sr."]
 BLOOMBERG_SEARCH_URL = r"https://search.bloomberg.com/lookup.json?types=Person&exclude_subtypes=label:editorial&group_size=1&fields=url&query=%s%s%s"
+YAHOO_PROFILE_URL = r"https://finance.yahoo.com/quote/%s/profile?p=%s"
+CACHE_PATH = quant_local.PACK_PATH + "/cache/http"
+CACHE_TTL = 7 * 86400.0 # executive rosters change slowly; re-fetch weekly
+LAGS = [7, 28, 91, 182] # in calendar days (snapshots are irregularly spaced)
 
 def getSecuritiesByMarketCap(sector):
     """
@@ -68,12 +73,12 @@ def addNameIdentifiers(officer):
     officer["First"] = parts[0]
     officer["Last"] = parts[-1]
 
-def getSecurityCSuite(security, titles=["CEO", "COO", "CFO"]):
-    """This could probably go in the "scrapefe" package
+def parseCSuite(content, titles=["CEO", "COO", "CFO"]):
+    """Parses the "Key Executives" table from the content of a Yahoo Finance
+       profile page, returning officers (dictionaries of table fields) whose
+       titles match the given abbreviations, augmented with identifiers.
     """
-    res = requests.get("https://finance.yahoo.com/quote/%s/profile?p=%s" % (security["Symbol"], security["Symbol"]))
-    assert res.status_code == 200
-    soup = bs4.BeautifulSoup(res.content, features="lxml")
+    soup = bs4.BeautifulSoup(content, features="lxml")
     h3 = soup.findAll("h3", text="Key Executives")[0]
     cSuiteTable = h3.parent.findAll("table")[0]
     headers = cSuiteTable.find("thead").findAll("th")
@@ -92,26 +97,182 @@ def getSecurityCSuite(security, titles=["CEO", "COO", "CFO"]):
         addNameIdentifiers(officer)
     return officers
 
-def getBloombergProfile(officer):
+def getSecurityCSuite(security, titles=["CEO", "COO", "CFO"], scraper=None):
+    """This could probably go in the "scrapefe" package. Pages are fetched
+       through the given Scraper (an uncached one, by default).
+    """
+    scraper = scrape.Scraper() if scraper is None else scraper
+    symbol = security["Symbol"]
+    content = scraper.fetch(YAHOO_PROFILE_URL % (symbol, symbol))
+    officers = parseCSuite(content, titles)
+    for officer in officers:
+        officer["Symbol"] = symbol
+    return officers
+
+def getBloombergProfile(officer, scraper=None):
     """Uses a site-specific search in an attempt to look up the unique ID used
        by their Bloomberg profile page.
     """
+    scraper = scrape.Scraper() if scraper is None else scraper
     url = BLOOMBERG_SEARCH_URL % (officer["First"], "%20", officer["Last"])
-    res = requests.get(url)
-    data = json.loads(res)
+    data = json.loads(scraper.fetch(url))
     profileUrl = data[0]["results"][0]["url"]
     officer["BloombergId"] = int(profileUrl.split("/")[-1])
-    
-def main():
+
+def getCSuites(securities, scraper):
+    """Collects C-suite officers for each of the given securities, fetching
+       profile pages (and then Bloomberg profile IDs, once per unique officer
+       identifier) concurrently through the given Scraper. Returns a list of
+       officer lists, in security order; securities whose pages could not be
+       fetched or parsed have empty lists.
+    """
+    csuites = scraper.map(lambda security: getSecurityCSuite(security, scraper=scraper), securities, label=lambda security: security["Symbol"])
+    csuites = [[] if isinstance(csuite, Exception) else csuite for csuite in csuites]
+    unique = {}
+    for csuite in csuites:
+        for officer in csuite:
+            unique.setdefault(officer["Identifier"], officer)
+    scraper.map(lambda officer: getBloombergProfile(officer, scraper=scraper), list(unique.values()), label=lambda officer: officer["Identifier"])
+    for csuite in csuites:
+        for officer in csuite:
+            if "BloombergId" in unique[officer["Identifier"]]:
+                officer["BloombergId"] = unique[officer["Identifier"]]["BloombergId"]
+    return csuites
+
+def getParticipation(symbols, csuites):
+    """Returns a sparse (security x officer) participation matrix, in CSR
+       format, for the given symbols and their matching C-suite officer
+       lists, along with the list of officer identifiers (one per column).
+       Officers serving at several securities share one column.
+    """
+    import scipy.sparse
+    officerIds = []
+    officerCols = {}
+    rows = []
+    cols = []
+    for i, csuite in enumerate(csuites):
+        for officer in csuite:
+            identifier = officer["Identifier"]
+            if identifier not in officerCols:
+                officerCols[identifier] = len(officerIds)
+                officerIds.append(identifier)
+            rows.append(i)
+            cols.append(officerCols[identifier])
+    data = numpy.ones(len(rows))
+    A = scipy.sparse.coo_matrix((data, (rows, cols)), shape=(len(symbols), len(officerIds))).tocsr()
+    A.data[:] = 1.0 # collapse duplicate entries (same officer listed twice)
+    return A, officerIds
+
+def getPriceHistory(symbols, code="ENERGY", catalog=None):
+    """Returns a (snapshot x symbol) numpy array of "Security Price" values
+       across all datastore snapshots for the given sector, with NaN where a
+       symbol is missing from a snapshot, along with the list of snapshot
+       dates (one per row).
+    """
+    catalog = query.Catalog() if catalog is None else catalog
+    dates = catalog.getDates()
+    result = catalog.select(["Symbol", "Security Price"], query.Where("Security Price", ">", 0), dates="all", codes=[code])
+    dateRows = dict([(date, i) for i, date in enumerate(dates)])
+    symbolCols = dict([(symbol, j) for j, symbol in enumerate(symbols)])
+    prices = numpy.full((len(dates), len(symbols)), numpy.nan)
+    keep = numpy.array([symbol in symbolCols for symbol in result["Symbol"]], dtype=bool)
+    rows = numpy.array([dateRows[date] for date in result["date"][keep]], dtype=int)
+    cols = numpy.array([symbolCols[symbol] for symbol in result["Symbol"][keep]], dtype=int)
+    prices[rows, cols] = result["Security Price"][keep].astype(numpy.float64)
+    return prices, dates
+
+def getLagSnapshots(dates, lags=LAGS):
+    """Returns, for each lag (in calendar days), the row index of the earlier
+       snapshot whose date is closest to that many days before the latest
+       snapshot (None if there is only one snapshot). Snapshot dates are
+       "YYYYMMDD" strings, in ascending order.
     """
+    days = [datetime.datetime.strptime(date, "%Y%m%d").toordinal() for date in dates]
+    rows = []
+    for lag in lags:
+        target = days[-1] - lag
+        rows.append(min(range(len(days) - 1), key=lambda i: abs(days[i] - target)) if 1 < len(days) else None)
+    return rows
+
+def getLaggedReturns(prices, dates, lags=LAGS):
+    """Returns a (symbol x lag) numpy array of log returns from the price
+       history (see *getPriceHistory()*): column k is the return since the
+       snapshot closest to *lags[k]* calendar days before the latest one
+       (see *getLagSnapshots()*). Returns that cannot be computed are NaN.
+       Also returns the list of snapshot dates actually used (one per lag).
+    """
+    Y = numpy.full((prices.shape[1], len(lags)), numpy.nan)
+    rows = getLagSnapshots(dates, lags)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        for k, row in enumerate(rows):
+            if row is not None:
+                Y[:,k] = numpy.log(prices[-1,:] / prices[row,:])
+    return Y, [None if row is None else dates[row] for row in rows]
+
+def fitOfficerEffects(A, Y, ridge=1.0):
+    """Fits per-officer effects for each lag (column of Y), as the ridge
+       solution of A * B = Y - mean(Y) over only the securities with a finite
+       return at that lag (rows of A without one are masked out, rather than
+       treated as average). The regularized normal matrix (A'A + ridge*I) is
+       sparse; it is factorized once per distinct mask, and solved for every
+       lag sharing that mask together. Returns a (officer x lag) numpy array
+       of effects.
+    """
+    import scipy.sparse
+    import scipy.sparse.linalg
+    A = scipy.sparse.csr_matrix(A)
+    finite = numpy.isfinite(Y)
+    effects = numpy.zeros((A.shape[1], Y.shape[1]))
+    groups = {}
+    for k in range(Y.shape[1]):
+        groups.setdefault(finite[:,k].tobytes(), []).append(k)
+    for ks in groups.values():
+        mask = finite[:,ks[0]]
+        if not mask.any():
+            continue
+        Am = A[mask,:]
+        Yc = Y[mask,:][:,ks] - Y[mask,:][:,ks].mean(axis=0)
+        normal = (Am.T @ Am + ridge * scipy.sparse.identity(A.shape[1])).tocsc()
+        effects[:,ks] = scipy.sparse.linalg.splu(normal).solve(numpy.asarray(Am.T @ Yc))
+    return effects
+
+def resolveWinnersLosers(effects, officerIds, lag=0, n=10):
+    """Returns lists of (identifier, effect) tuples for the *n* officers with
+       the largest positive ("winners") and negative ("losers") effects at the
+       given lag index
+    """
+    order = numpy.argsort(effects[:,lag])
+    winners = [(officerIds[i], float(effects[i,lag])) for i in order[::-1][:n] if 0 < effects[i,lag]]
+    losers = [(officerIds[i], float(effects[i,lag])) for i in order[:n] if effects[i,lag] < 0]
+    return winners, losers
+
+def main(cachePath=CACHE_PATH, replay=False):
+    """Surveys C-suite officers of energy-sector securities (by descending
+       market cap), then fits officer effects against lagged price returns
+       and reports "winners" and "losers" at each lag. Responses are cached
+       under the given path; in replay mode, pages are served from that path
+       only (as fixtures).
     """
     sectors = quant_local.getSectors()
     sector = quant_local.getSectorByCode(sectors, "ENERGY")
     securities = getSecuritiesByMarketCap(sector)
-    for security in securities:
-        csuite = getSecurityCSuite(security)
+    scraper = scrape.Scraper(cachePath, ttl=CACHE_TTL, replay=replay)
+    csuites = getCSuites(securities, scraper)
+    for security, csuite in zip(securities, csuites):
         for officer in csuite:
-
+            print("%s: %s (%s, Bloomberg ID %s)" % (security["Symbol"], officer["Identifier"], officer["Title"], str(officer.get("BloombergId", "?"))))
+    symbols = [security["Symbol"] for security in securities]
+    A, officerIds = getParticipation(symbols, csuites)
+    prices, dates = getPriceHistory(symbols, sector.getCode())
+    Y, lagDates = getLaggedReturns(prices, dates)
+    effects = fitOfficerEffects(A, Y)
+    for k, lag in enumerate(LAGS):
+        winners, losers = resolveWinnersLosers(effects, officerIds, k)
+        print("Lag of %u days (since %s):" % (lag, lagDates[k]))
+        for identifier, effect in winners:
+            print("\tWINNER %s (%+.4f)" % (identifier, effect))
+        for identifier, effect in losers:
+            print("\tLOSER %s (%+.4f)" % (identifier, effect))
 
 if __name__ == "__main__":
-   main()
+    main()
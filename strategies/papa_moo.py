@@ -6,10 +6,22 @@
    owned).
 """
 
+import os
+import json
 import pprint
-import warnings
 import numpy
 import quant_local
+import argparse
+from quant_local import indices, portfolio, profiling, risk
+
+INDEX_PROPERTY = "Index" # filter rows on this property test index membership
+METRICS = [ # hard-coded for now, could easily be parameterized
+    "Price Performance (52 Weeks)",
+    "Standard Deviation (1 Yr Annualized)"
+]
+STATE_PATH = quant_local.PACK_PATH + "/cache/papa_moo"
+RISK_OBJECTIVES = ["volatility", "maxDrawdown", "historicalVaR", "parametricVaR", "beta"] # see risk.getRiskTable()
+SNAPSHOTS_PER_YEAR = 52
 
 class Filter(object):
     """Models a specific filter used by the papa_moo strategy. (Filters,
@@ -57,11 +69,11 @@ class Filter(object):
             else:
                 raise Exception("Invalid comparator '%s'" % self.comparator)
         except Exception as e:
-            warnings.warn("\n".join([
+            profiling.warn("\n".join([
                 "Exception while evaluating:",
                 "\tSecurity %s" % symbProps["Symbol"],
                 "\tAgainst filter (%s,%s,%s)" % (self.property, self.comparator, str(self.value))
-            ]))
+            ]), "Filter.isOkay(%s,%s,%s)" % (self.property, self.comparator, str(self.value)))
             return False
 
     def compareLT(self, lhs, rhs):
@@ -112,26 +124,73 @@ class Filter(object):
         assert(type(rhs) in [type(0), type(0.0)])
         return lhs > rhs
 
+class IndexFilter(object):
+    """Filters securities by membership in an index (like "sp500"), as
+       defined under "definitions/indices/". Deserialized from filter rows
+       whose property is "Index"; the "==" comparator passes members of the
+       index, and "!=" passes non-members. Membership is tested against the
+       shared IndexRegistry bitsets, so a whole list of symbols can also be
+       tested at once (see *getMask()*).
+    """
+
+    def __init__(self, comparator, value):
+        """Index filters are constructed with a comparator ("==" or "!=") and
+           an index name
+        """
+        if comparator not in ["==", "!="]:
+            raise Exception("Invalid index comparator '%s'" % comparator)
+        self.property = INDEX_PROPERTY
+        self.comparator = comparator
+        self.value = value
+
+    def getMask(self, symbols):
+        """Returns a boolean numpy array indicating which of the given symbols
+           satisfy this filter
+        """
+        mask = indices.getRegistry().isMember(self.value, symbols)
+        return mask if self.comparator == "==" else ~mask
+
+    def isOkay(self, symbProps):
+        """Returns True if the given symbol properties satisfy this filter
+        """
+        return bool(self.getMask([symbProps["Symbol"]])[0])
+
+def makeFilter(row):
+    """Returns a Filter (or, for "Index" properties, an IndexFilter) from the
+       given filter table row
+    """
+    if row["property"] == INDEX_PROPERTY:
+        return IndexFilter(row["comparator"], row["value"])
+    return Filter(row["property"], row["comparator"], row["value"])
+
+@profiling.timed("filterBuys")
 def filterBuys(sectors, filtersBuy):
     """Returns dictionary mapping sector codes to lists of symbols that passed
-       all buy filters.
+       all buy filters. Index filters are applied first, to each sector's
+       whole symbol list at once, so that only index members are evaluated
+       against the remaining (per-security) filters.
     """
     allPassed = {}
+    if len(filtersBuy) == 0:
+        return allPassed
+    indexFilters = [fltr for fltr in filtersBuy if isinstance(fltr, IndexFilter)]
+    otherFilters = [fltr for fltr in filtersBuy if not isinstance(fltr, IndexFilter)]
     for sector in sectors:
         code = sector.getCode()
         secPassed = []
         symbols = sector.getSymbols()
-        for symbol in symbols:
-            security = sector.getSecurity(symbol)
-            for ndx, fltr in enumerate(filtersBuy):
-                if not fltr.isOkay(security):
-                    break
-                elif ndx == len(filtersBuy) - 1:
-                    secPassed.append(symbol)
+        mask = numpy.ones(len(symbols), dtype=bool)
+        for fltr in indexFilters:
+            mask &= fltr.getMask(symbols)
+        for ndx in numpy.flatnonzero(mask):
+            security = sector.getSecurity(symbols[ndx])
+            if all(fltr.isOkay(security) for fltr in otherFilters):
+                secPassed.append(symbols[ndx])
         if 0 < len(secPassed):
             allPassed[code] = secPassed
     return allPassed
 
+@profiling.timed("filterSells")
 def filterSells(positions, filtersSell):
     """Returns dictionary mapping sector codes to lists of symbols that passed
        all sell filters.
@@ -147,51 +206,44 @@ def filterSells(positions, filtersSell):
                 allPassed[position["sector"]].append(position["symbol"])
     return allPassed
 
-def getFiltersBuy():
+@profiling.timed("getFiltersBuy")
+def getFiltersBuy(datePath=None):
     """Returns "buy" filter Objects as deserialized from the lone worksheet in
-       the "datastore/filters_buy.xlsx" file.
+       the "datastore/filters_buy.xlsx" file (of the most recent snapshot,
+       unless a date path is given).
     """
-    datePaths = quant_local.getDatePaths()
-    rows = quant_local.readXlsxDicts(datePaths[-1] + "/filters_buy.xlsx")
-    filters = []
-    for row in rows:
-        filters.append(Filter(row["property"], row["comparator"], row["value"]))
-    return filters
+    if datePath is None:
+        datePath = quant_local.getDatePaths()[-1]
+    rows = quant_local.readXlsxDicts(datePath + "/filters_buy.xlsx")
+    return [makeFilter(row) for row in rows]
 
-def getFiltersSell():
+@profiling.timed("getFiltersSell")
+def getFiltersSell(datePath=None):
     """Returns "sell" filter Objects as deserialized from the lone worksheet in
-       the "datastore/filters_sell.xlsx" file.
+       the "datastore/filters_sell.xlsx" file (of the most recent snapshot,
+       unless a date path is given).
     """
-    datePaths = quant_local.getDatePaths()
-    rows = quant_local.readXlsxDicts(datePaths[-1] + "/filters_sell.xlsx")
-    filters = []
-    for row in rows:
-        filters.append(Filter(row["property"], row["comparator"], row["value"]))
-    return filters
+    if datePath is None:
+        datePath = quant_local.getDatePaths()[-1]
+    rows = quant_local.readXlsxDicts(datePath + "/filters_sell.xlsx")
+    return [makeFilter(row) for row in rows]
 
+@profiling.timed("getMetrics")
 def getMetrics(sector, symbols):
-    """Returns a 2xN numpy.Array of metrics for the given symbols from the
-       given sector.
-    """
-    metrics = [ # hard-coded for now, could easily be parameterized
-        "Price Performance (52 Weeks)",
-        "Standard Deviation (1 Yr Annualized)"
-    ]
-    table = numpy.zeros((2, len(symbols)))
-    toDelete = [] # columns (symbols) to remove once populated
-    for i, metric in enumerate(metrics):
-        for j, symbol in enumerate(symbols):
-            try:
-                security = sector.getSecurity(symbol)
-                table[i,j] = security[metric]
-            except Exception as e:
-                warnings.warn("Could not extract metric %s for symbol %s" % (metric, symbol))
-                print(e)
-                toDelete.append(j)
-    for j in toDelete[::-1]:
-        table = numpy.delete(table, j, 1)
-    return table
+    """Returns the given symbols of the given sector whose metrics can be
+       extracted (see *getSecurityMetrics()*), along with a matching 2xN
+       numpy.Array of their metrics (one column per returned symbol)
+    """
+    kept = []
+    columns = []
+    for symbol in symbols:
+        metrics = getSecurityMetrics(sector.getSecurity(symbol))
+        if metrics is not None:
+            kept.append(symbol)
+            columns.append(metrics)
+    return kept, numpy.array(columns, dtype=numpy.float64).reshape(-1, len(METRICS)).T
 
+@profiling.timed("getFrontier")
 def getFrontier(x, y):
     """Given x and y numpy.array objects (of matching 1d length), returns
        indices of a subset of points that constitute the frontier (in this
@@ -206,72 +258,393 @@ def getFrontier(x, y):
             y_ = y[i]
     return indices[-1::-1]
 
+@profiling.timed("getParetoFrontier")
+def getParetoFrontier(x, ys):
+    """Generalizes *getFrontier()* to more objectives: given x (to maximize)
+       and a KxN numpy.array of objectives to minimize, returns indices of
+       the non-dominated points, ordered in increasing x value. NaN values
+       are treated as the worst possible value of their objective.
+    """
+    objectives = numpy.vstack([-numpy.asarray(x, dtype=numpy.float64)[None,:], numpy.asarray(ys, dtype=numpy.float64)])
+    objectives = numpy.where(numpy.isnan(objectives), numpy.inf, objectives)
+    noWorse = (objectives[:,:,None] <= objectives[:,None,:]).all(axis=0)
+    better = (objectives[:,:,None] < objectives[:,None,:]).any(axis=0)
+    dominated = (noWorse & better).any(axis=0)
+    indices = numpy.flatnonzero(~dominated)
+    return list(indices[numpy.argsort(-objectives[0,indices], kind="stable")])
+
+def getRiskTable(symbolIndex=None, benchmark="universe"):
+    """Returns a dictionary mapping symbols to dictionaries of risk measures
+       (see *risk.getRiskTable()*), computed from the weekly "Security Price"
+       history of every symbol in the most recent snapshot. Beta is measured
+       against the equal-weighted mean return of that universe by default.
+    """
+    if symbolIndex is None:
+        symbolIndex = portfolio.getSymbolIndex()
+    symbols = symbolIndex.entries[symbolIndex.getDates()[-1]]["symbols"]
+    table = risk.getRiskTable(symbolIndex.getPrices(symbols), benchmark, periodsPerYear=SNAPSHOTS_PER_YEAR)
+    names = sorted(table.keys())
+    return dict([(symbol, dict([(name, float(table[name][j])) for name in names])) for j, symbol in enumerate(symbols)])
+
+@profiling.timed("updatePositions")
 def updatePositions(positions):
     """Adjusts the positions list and writes the results back out to the most
        recent positions.xlsx file. Latest price values are updated from the
-       adjacent sector-specific spreadsheet.
+       adjacent sector-specific spreadsheet (through the persistent symbol
+       index of the "portfolio" module, rather than by reloading sectors).
     """
-    # first cache map of symbols->sectors
-    sectors = quant_local.getSectors()
-    ssMap = {}
-    for sector in sectors:
-        code = sector.getCode()
-        symbols = sector.getSymbols()
-        for symbol in symbols:
-            ssMap[symbol] = code
-    # now retrieve latest price
-    for position in positions:
-        symbol = position["symbol"]
-        code = ssMap[symbol]
-        sector = quant_local.getSectorByCode(sectors, code)
-        security = sector.getSecurity(symbol)
-        position["latest_price"] = "$%.2f" % security["Security Price"]
+    portfolio.updatePositions(positions)
     pprint.pprint(positions)
 
-def main():
-    """When invoked as an entry point, the papa_moo strategy iterates over all
-       sectors to perform a MPT-like multi-objective optimization for low-risk,
-       high-return securities (as defined by standard-deviation and
-       52-week-return, respectively). Some "SELL" recommendations are also made
-       based on the "SELL" filters, but these involve no optimization and are
-       merely filter/condition checks.
-    """
-    sectors = quant_local.getSectors()
-    filtersBuy = getFiltersBuy()
-    filtersSell = getFiltersSell()
-    positions = quant_local.getPositions(sectors)
-    allBuys = filterBuys(sectors, filtersBuy)
-    allSells = filterSells(positions, filtersSell)
+def selectPicks(buySymbols, xy, extra=None):
+    """Given buy candidates and their 2xN metrics table, returns the list of
+       picked symbols: the second-highest point of the frontier in metric
+       space (or none, if the frontier has fewer than two points). Extra
+       objectives to minimize (a KxN table, like risk measures) may be given,
+       in which case the frontier is the Pareto set across all objectives.
+    """
+    if len(buySymbols) == 0:
+        return []
+    if extra is None:
+        frontier = getFrontier(xy[0,:], xy[1,:])
+    else:
+        frontier = getParetoFrontier(xy[0,:], numpy.vstack([xy[1:2,:], extra]))
+    if 1 < len(frontier):
+        return [buySymbols[frontier[-2]]]
+    return []
+
+def getPicks(sectors, allBuys, riskNames=None, riskTable=None):
+    """Returns dictionary mapping sector codes (for sectors with any buy
+       candidates) to lists of picked symbols. If the names of risk measures
+       (from RISK_OBJECTIVES) are given, they are minimized as extra frontier
+       objectives, using the given risk table (see *getRiskTable()*, which is
+       called if no table is given).
+    """
+    if riskNames is not None and 0 < len(riskNames) and riskTable is None:
+        riskTable = getRiskTable()
+    picks = {}
     for sector in sectors:
         code = sector.getCode()
         if code not in allBuys:
             continue
-        buySymbols = allBuys[code]
-        # filter buys by second-highest frontier in metric space
-        xy = getMetrics(sector, buySymbols)
-        frontier = getFrontier(xy[0,:], xy[1,:])
-        ndx = None
-        if 1 < len(frontier):
-            ndx = frontier[-2]
-            buySymbols = [buySymbols[ndx]]
-        else:
-            buySymbols = []
-        # filter sells
-        if code not in allSells:
-            allSells[code] = []
-        sellSymbols = allSells[code]
-        # if a symbol appears in both buys and sells, mark as "HOLD" instead
+        symbols, xy = getMetrics(sector, allBuys[code])
+        if riskNames is None or len(riskNames) == 0:
+            picks[code] = selectPicks(symbols, xy)
+            continue
+        extra = numpy.array([[riskTable.get(symbol, {}).get(name, numpy.nan) for symbol in symbols] for name in riskNames], dtype=numpy.float64).reshape(len(riskNames), len(symbols))
+        picks[code] = selectPicks(symbols, xy, extra)
+    return picks
+
+def getRecommendations(sectors, picks, allSells, positions):
+    """Returns a list of (code, actions) tuples, in sector order, for each
+       sector with picks. Actions map "BUY", "HOLD", and "SELL" to lists of
+       symbols: a symbol appearing in both picks and sells is marked "HOLD"
+       instead, and picks that are already owned are not bought again.
+    """
+    ownedSymbols = set([position["symbol"] for position in positions])
+    recommendations = []
+    for sector in sectors:
+        code = sector.getCode()
+        if code not in picks:
+            continue
+        buySymbols = picks[code]
+        sellSymbols = allSells.get(code, [])
         holdSymbols = list(set(buySymbols).intersection(set(sellSymbols)))
-        ownedSymbols = [position["symbol"] for position in positions]
+        recommendations.append((code, {
+            "BUY": [symbol for symbol in buySymbols if symbol not in holdSymbols and symbol not in ownedSymbols],
+            "HOLD": holdSymbols,
+            "SELL": [symbol for symbol in sellSymbols if symbol not in holdSymbols],
+        }))
+    return recommendations
+
+def printRecommendations(recommendations):
+    """Prints recommendations (as returned by *getRecommendations()*)
+    """
+    for code, actions in recommendations:
         print("Recommendations for sector %s:" % code)
-        for symbol in buySymbols:
-            if symbol not in holdSymbols and symbol not in ownedSymbols:
-                print("\tBUY %s" % symbol)
-        for symbol in holdSymbols:
-            print("\tHOLD %s" % symbol)
-        for symbol in sellSymbols:
-            if symbol not in holdSymbols:
-                print("\tSELL %s" % symbol)
+        for action in ["BUY", "HOLD", "SELL"]:
+            for symbol in actions[action]:
+                print("\t%s %s" % (action, symbol))
+
+def toStateValue(value):
+    """Normalizes a cell value for persisted state and comparison: NaN floats
+       become None (so that unchanged NaN cells compare equal)
+    """
+    if type(value) is type(0.0) and value != value:
+        return None
+    return value
+
+def getStateKeys(filtersBuy):
+    """Returns the (sorted) properties on which per-security filter results
+       and metrics depend
+    """
+    keys = set(["Symbol"] + METRICS)
+    for fltr in filtersBuy:
+        if not isinstance(fltr, IndexFilter):
+            keys.add(fltr.property)
+    return sorted(keys)
+
+def getIndexStamps(filtersBuy):
+    """Returns a JSON-serializable dictionary mapping the index names used by
+       the given filters to the (modification time, size) stamps of their
+       definition files (None if missing), used to detect changed membership
+    """
+    stamps = {}
+    for fltr in filtersBuy:
+        if isinstance(fltr, IndexFilter):
+            path = os.path.abspath(indices.INDICES_PATH + "/%s.txt" % fltr.value)
+            stamps[fltr.value] = [os.stat(path).st_mtime, os.stat(path).st_size] if os.path.isfile(path) else None
+    return stamps
+
+def getFilterDefinitions(filters):
+    """Returns a JSON-serializable list of filter definitions, used to detect
+       changes in filters between runs
+    """
+    return [[fltr.property, fltr.comparator, fltr.value] for fltr in filters]
+
+def diffSector(sector, previous, keys):
+    """Compares the given sector against its persisted state from a previous
+       snapshot, column by column over the given keys. Returns a tuple of the
+       previous row index of each current symbol (-1 for new symbols) and a
+       dictionary mapping each key to a boolean numpy array (one element per
+       symbol) that is True where the value changed (or the symbol is new).
+    """
+    symbols = sector.getSymbols()
+    if previous is None:
+        rows = numpy.full(len(symbols), -1, dtype=int)
+        return rows, dict([(key, numpy.ones(len(symbols), dtype=bool)) for key in keys])
+    prevRows = dict([(symbol, i) for i, symbol in enumerate(previous["symbols"])])
+    rows = numpy.array([prevRows.get(symbol, -1) for symbol in symbols], dtype=int)
+    nPrev = len(previous["symbols"])
+    changed = {}
+    for key in keys:
+        newValues = numpy.empty(len(symbols), dtype=object)
+        newValues[:] = getStateColumn(sector, key)
+        oldValues = numpy.empty(nPrev + 1, dtype=object) # last element pads new symbols
+        oldValues[:nPrev] = previous["columns"][key]
+        changed[key] = (newValues != oldValues[rows]).astype(bool) | (rows < 0)
+    return rows, changed
+
+def getStateColumn(sector, key):
+    """Returns the (normalized) values of the given column of a sector, as
+       persisted in state; missing columns are all None
+    """
+    if key not in sector.table.index:
+        return [None] * len(sector.table)
+    return [toStateValue(value) for value in sector.table.getColumn(key)]
+
+def getSecurityMetrics(security):
+    """Returns the [x, y] metric pair for the given security, or None if the
+       metrics cannot be extracted
+    """
+    try:
+        return [float(security[metric]) for metric in METRICS]
+    except Exception as e:
+        profiling.warn("Could not extract metrics for symbol %s (%s)" % (security["Symbol"], str(e)), "getMetrics")
+        return None
+
+def loadState(date, statePath=STATE_PATH, before=False):
+    """Returns the persisted papa_moo state for the most recent snapshot date
+       on or before the given date (a "YYYYMMDD" string), or strictly before
+       it if *before* is True, or None if there is no such state
+    """
+    if not os.path.isdir(statePath):
+        return None
+    candidates = sorted([fileName for fileName in os.listdir(statePath) if fileName.endswith(".json") and (fileName[:-5] < date if before else fileName[:-5] <= date)])
+    if len(candidates) == 0:
+        return None
+    with open(os.path.abspath(statePath + "/%s" % candidates[-1]), 'r') as f:
+        return json.load(f)
+
+def saveState(state, statePath=STATE_PATH):
+    """Atomically writes the given state, named by its snapshot date
+    """
+    os.makedirs(statePath, exist_ok=True)
+    path = os.path.abspath(statePath + "/%s.json" % state["date"])
+    with open(path + ".tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def getChangeReport(previous, recommendations):
+    """Compares recommendations against those from a previous state. Returns
+       a dictionary of (code, symbol) lists for "new BUY" (newly recommended
+       buys), "dropped" (buys no longer recommended), and "new SELL" (newly
+       recommended sells).
+    """
+    def getPairs(recs, action):
+        return set([(code, symbol) for code, actions in recs for symbol in actions[action]])
+    prevRecs = [] if previous is None else [(code, actions) for code, actions in previous["recommendations"]]
+    return {
+        "new BUY": sorted(getPairs(recommendations, "BUY") - getPairs(prevRecs, "BUY")),
+        "dropped": sorted(getPairs(prevRecs, "BUY") - getPairs(recommendations, "BUY")),
+        "new SELL": sorted(getPairs(recommendations, "SELL") - getPairs(prevRecs, "SELL")),
+    }
+
+def loadBaseline(date, filtersBuy, statePath=STATE_PATH):
+    """Returns (previous, baseline) states for an incremental run at the given
+       date: the state of the most recent earlier snapshot (against which
+       changes are reported), and the state from which results can be carried
+       over. The baseline is the state for this same date (a rerun), or else
+       the previous state, provided its buy filters and state keys match;
+       otherwise it is None.
+    """
+    latest = loadState(date, statePath)
+    previous = loadState(date, statePath, before=True) if latest is not None and latest["date"] == date else latest
+    for candidate in [latest, previous]:
+        if candidate is not None and candidate["filtersBuy"] == getFilterDefinitions(filtersBuy) and candidate["keys"] == getStateKeys(filtersBuy):
+            return previous, candidate
+    return previous, None
+
+@profiling.timed("getIncrementalPicks")
+def getIncrementalPicks(date, sectors, filtersBuy, baseline=None):
+    """Computes frontier picks for the given sectors incrementally, against
+       the given baseline state (see *loadBaseline()*; everything is
+       evaluated if there is none). Each buy filter is re-evaluated only for
+       securities that are new or whose filtered property changed, and
+       metrics only for passing securities whose metric properties changed;
+       other results are carried over. Index filters are cheap bitset tests,
+       and are always applied. Frontier picks are reused for sectors with no
+       changes (and only while the definition files of any filtered indices
+       are unchanged). Returns a tuple of (picks, new state, statistics); the
+       state lacks only the "recommendations" entry.
+
+       As in *getPicks()*, candidates whose metrics cannot be extracted are
+       dropped before the frontier is computed.
+    """
+    keys = getStateKeys(filtersBuy)
+    indexStamps = getIndexStamps(filtersBuy)
+    prevSectors = {} if baseline is None else baseline["sectors"]
+    reusePicks = baseline is not None and baseline.get("indexStamps", None) == indexStamps
+    state = {"date": date, "filtersBuy": getFilterDefinitions(filtersBuy), "keys": keys, "indexStamps": indexStamps, "sectors": {}}
+    picks = {}
+    stats = {"baseline": None if baseline is None else baseline["date"], "securities": 0, "filter evaluations": 0, "metric evaluations": 0, "filters": len(filtersBuy)}
+    for sector in sectors:
+        code = sector.getCode()
+        symbols = sector.getSymbols()
+        prevSector = prevSectors.get(code, None)
+        rows, changed = diffSector(sector, prevSector, keys)
+        isNew = rows < 0
+        safeRows = numpy.where(isNew, 0, rows)
+        # per-filter results, re-evaluated only where the filtered property changed
+        results = []
+        for f, fltr in enumerate(filtersBuy):
+            if isinstance(fltr, IndexFilter):
+                results.append(fltr.getMask(symbols))
+                continue
+            result = numpy.zeros(len(symbols), dtype=bool)
+            if prevSector is not None and 0 < len(prevSector["symbols"]):
+                result[:] = numpy.array(prevSector["results"][f], dtype=bool)[safeRows]
+            for ndx in numpy.flatnonzero(changed[fltr.property]):
+                result[ndx] = fltr.isOkay(sector.getSecurity(symbols[ndx]))
+                stats["filter evaluations"] += 1
+            results.append(result)
+        passed = numpy.zeros(len(symbols), dtype=bool)
+        if 0 < len(filtersBuy):
+            passed = numpy.logical_and.reduce(results)
+        # metrics of passing securities, re-extracted only where they changed
+        metricChanged = numpy.logical_or.reduce([changed[metric] for metric in METRICS])
+        metrics = [None] * len(symbols)
+        for ndx in numpy.flatnonzero(passed):
+            if metricChanged[ndx] or prevSector["metrics"][rows[ndx]] is None:
+                metrics[ndx] = getSecurityMetrics(sector.getSecurity(symbols[ndx]))
+                stats["metric evaluations"] += 1
+            else:
+                metrics[ndx] = prevSector["metrics"][rows[ndx]]
+        stats["securities"] += len(symbols)
+        # frontier picks, reused if nothing in the sector changed
+        candidates = [ndx for ndx in numpy.flatnonzero(passed) if metrics[ndx] is not None]
+        isUnchanged = prevSector is not None and len(symbols) == len(prevSector["symbols"]) and not numpy.logical_or.reduce(list(changed.values()) + [isNew]).any()
+        if reusePicks and isUnchanged and prevSector["picks"] is not None:
+            picks[code] = prevSector["picks"]
+        elif passed.any():
+            xy = numpy.array([metrics[ndx] for ndx in candidates], dtype=numpy.float64).reshape(-1, len(METRICS)).T
+            picks[code] = selectPicks([symbols[ndx] for ndx in candidates], xy)
+        state["sectors"][code] = {
+            "symbols": symbols,
+            "columns": dict([(key, getStateColumn(sector, key)) for key in keys]),
+            "results": [result.tolist() for result in results],
+            "metrics": metrics,
+            "picks": picks.get(code, None),
+        }
+    return picks, state, stats
+
+@profiling.timed("recommendIncremental")
+def recommendIncremental(statePath=STATE_PATH, datePath=None):
+    """Computes recommendations for the most recent snapshot (or the snapshot
+       at the given date path) incrementally, against persisted state (see
+       *loadBaseline()* and *getIncrementalPicks()*). Changes are reported
+       against the state of the most recent earlier snapshot. Sells are
+       always re-evaluated (they depend on positions). Persists the new state
+       and returns a tuple of (recommendations, change report, statistics).
+    """
+    if datePath is None:
+        datePath = quant_local.getDatePaths()[-1]
+    _, date = os.path.split(datePath)
+    sectors = quant_local.getSectors(datePath)
+    filtersBuy = getFiltersBuy(datePath)
+    filtersSell = getFiltersSell(datePath)
+    positions = quant_local.getPositions(sectors, datePath)
+    previous, baseline = loadBaseline(date, filtersBuy, statePath)
+    picks, state, stats = getIncrementalPicks(date, sectors, filtersBuy, baseline)
+    stats["previous"] = None if previous is None else previous["date"]
+    allSells = filterSells(positions, filtersSell)
+    recommendations = getRecommendations(sectors, picks, allSells, positions)
+    report = getChangeReport(previous, recommendations)
+    state["recommendations"] = recommendations
+    saveState(state, statePath)
+    return recommendations, report, stats
+
+def mainIncremental():
+    """Entry point (with "--incremental") that prints recommendations using
+       *recommendIncremental()*, followed by a report of changes since the
+       run for the previous snapshot
+    """
+    recommendations, report, stats = recommendIncremental()
+    printRecommendations(recommendations)
+    print("Changes since %s (%u of %u filter evaluations):" % (str(stats["previous"]), stats["filter evaluations"], stats["securities"] * stats["filters"]))
+    for change in ["new BUY", "dropped", "new SELL"]:
+        for code, symbol in report[change]:
+            print("\t%s %s (%s)" % (change.upper(), symbol, code))
+
+def recommend(datePath=None, riskNames=None):
+    """Returns recommendations (see *getRecommendations()*) for the most
+       recent snapshot (or the snapshot at the given date path), computed
+       from scratch
+    """
+    if datePath is None:
+        datePath = quant_local.getDatePaths()[-1]
+    sectors = quant_local.getSectors(datePath)
+    filtersBuy = getFiltersBuy(datePath)
+    filtersSell = getFiltersSell(datePath)
+    positions = quant_local.getPositions(sectors, datePath)
+    allBuys = filterBuys(sectors, filtersBuy)
+    allSells = filterSells(positions, filtersSell)
+    picks = getPicks(sectors, allBuys, riskNames)
+    return getRecommendations(sectors, picks, allSells, positions)
+
+def main(riskNames=None):
+    """When invoked as an entry point, the papa_moo strategy iterates over all
+       sectors to perform a MPT-like multi-objective optimization for low-risk,
+       high-return securities (as defined by standard-deviation and
+       52-week-return, respectively, plus any extra risk measures named).
+       Some "SELL" recommendations are also made based on the "SELL" filters,
+       but these involve no optimization and are merely filter/condition
+       checks.
+    """
+    printRecommendations(recommend(None, riskNames))
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="papa_moo sector recommendations")
+    parser.add_argument("--incremental", action="store_true", help="Re-evaluate only what changed since the previous run")
+    parser.add_argument("--risk", default="", help="Comma-separated extra frontier objectives, from: %s" % ", ".join(RISK_OBJECTIVES))
+    args = parser.parse_args()
+    riskNames = [name for name in args.risk.split(",") if 0 < len(name)]
+    for name in riskNames:
+        if name not in RISK_OBJECTIVES:
+            parser.error("Unknown risk objective '%s'" % name)
+    if args.incremental and 0 < len(riskNames):
+        parser.error("--risk is not supported with --incremental")
+    if args.incremental:
+        mainIncremental()
+    else:
+        main(riskNames)
@@ -2,33 +2,27 @@
 """
 
 import os
-import numpy
-import alpaca_trade_api as ata
-from quant_local import keys
+from quant_local import alpaca
 
 MOD_PATH, _ = os.path.split(os.path.abspath(__file__))
 _, MOD_NAME = os.path.split(MOD_PATH)
 
-BASE_URL = "https://paper-api.alpaca.markets"
-
 def getSymbols(index="nasdaq100"):
+    """Returns the list of symbols in the given index, as defined under
+       "definitions/indices/" (the indices module, which needs numpy, is
+       only imported here)
     """
-    """
-    filePath = os.path.abspath(MOD_PATH + "/../definitions/indices/%s.txt" % index)
-    if not os.path.isfile(filePath):
-        raise Exception("Unable to locate index '%s'" % index)
-    with open(filePath, 'r') as f:
-        raw = f.read()
-    return raw.strip().splitlines()
+    from quant_local import indices
+    return indices.getSymbols(index)
 
 def symbolTensor(symbols):
     """Returns a numpy matrix giving time series (first dimension) across
        symbols (second dimension) for closing price.
     """
+    import numpy
     I = 100
     J = len(symbols)
-    keypair = keys.get("alpaca")
-    api = ata.REST(key_id=keypair[1], secret_key=keypair[0], base_url=BASE_URL)
+    api = alpaca.getApi()
     market_data = api.get_barset(symbols, "day", limit=I)
     st = numpy.zeros((I, J))
     for i, s in enumerate(symbols):